@@ -1,26 +1,127 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, Field, validator
 from typing import List, Optional
 from enum import Enum
 import torch
 from diffusers import StableDiffusionXLPipeline, EulerAncestralDiscreteScheduler, DDIMScheduler, DPMSolverMultistepScheduler
+from diffusers import AutoencoderTiny, StableDiffusionXLImg2ImgPipeline
 import base64
 from io import BytesIO
 import random
-from transformers import CLIPTokenizer, T5Tokenizer, T5ForConditionalGeneration
+from transformers import CLIPTokenizer, CLIPTokenizerFast, T5Tokenizer, T5ForConditionalGeneration
+from accelerate import init_empty_weights
+from safetensors.torch import load_file as load_safetensors, save_file as save_safetensors
 import re
+from PIL import Image, ImageDraw
 from PIL.PngImagePlugin import PngInfo
 from datetime import datetime
 import os
 import json
 from fastapi_mcp import FastApiMCP
+from prometheus_client import Counter, make_asgi_app
 import glob
+import asyncio
+import threading
+import time
+import weakref
+import hashlib
+import struct
+import sqlite3
+import zlib
+import uuid
+import mmap
+import math
+import numpy as np
+from collections import OrderedDict
+import concurrent.futures
+import importlib
+import itertools
+import multiprocessing
+import queue
 
 class SamplerType(str, Enum):
+    """Samplers exposed by the API.
+
+    test_scripts/benchmark_steps.py prints a latency vs steps table per
+    sampler against a running instance.
+    """
     DPM_SOLVER = "dpm solver ++"
     EULER_A = "euler a"
     DDIM = "ddim"
 
+class QualityTier(str, Enum):
+    STANDARD = "standard"
+    DRAFT = "draft"
+
+# Defaults for each quality tier. Draft trades detail for speed: fewer steps,
+# a scheduler configured for few-step sampling and a reduced resolution.
+QUALITY_PRESETS = {
+    QualityTier.STANDARD: {"num_inference_steps": 30, "width": 1024, "height": 1024, "few_step_scheduler": False},
+    QualityTier.DRAFT: {"num_inference_steps": 8, "width": 768, "height": 768, "few_step_scheduler": True},
+}
+# /v1/refine renders at the standard tier's steps but the draft's resolution,
+# so the seed starts from the same initial noise as the draft it refines
+REFINE_PRESET = dict(QUALITY_PRESETS[QualityTier.STANDARD],
+                     width=QUALITY_PRESETS[QualityTier.DRAFT]["width"],
+                     height=QUALITY_PRESETS[QualityTier.DRAFT]["height"])
+MIN_INFERENCE_STEPS = 1
+MAX_INFERENCE_STEPS = 100
+# CLIP context length, including the BOS/EOS tokens
+MAX_TOKENS = 77
+
+# Largest side the upscale stage will produce
+MAX_UPSCALE_SIZE = int(os.environ.get("MAX_UPSCALE_SIZE", "4096"))
+
+class PromptMode(str, Enum):
+    REWRITE = "rewrite"  # Summarize prompts over 77 tokens with T5
+    CHUNKED = "chunked"  # Encode long prompts in 77-token CLIP windows, with (text:1.2) weighting
+
+class InferenceBackend(str, Enum):
+    EAGER = "eager"
+    COMPILE = "compile"
+    INT8 = "int8"
+    ONNX = "onnx"
+
+class MemoryProfile(str, Enum):
+    FULL = "full"
+    CHANNELS_LAST = "channels_last"
+    BALANCED = "balanced"
+    LOW_VRAM = "low_vram"
+    MINIMAL = "minimal"
+
+# Memory/latency tradeoffs, from fastest and hungriest to slowest and leanest.
+# The ordering follows from what each profile keeps on the device; these are not
+# measurements. test_scripts/benchmark_memory_profiles.py measures a given machine.
+MEMORY_PROFILES = {
+    MemoryProfile.FULL: {
+        "attention_slicing": False, "vae_slicing": False, "vae_tiling": False,
+        "offload": None, "channels_last": False,
+        "description": "Whole pipeline resident on the device. Lowest latency, highest peak memory."
+    },
+    MemoryProfile.CHANNELS_LAST: {
+        "attention_slicing": False, "vae_slicing": False, "vae_tiling": False,
+        "offload": None, "channels_last": True,
+        "description": "Like full, with a channels-last UNet. Can speed up convolutions, depending on the hardware."
+    },
+    MemoryProfile.BALANCED: {
+        "attention_slicing": True, "vae_slicing": True, "vae_tiling": False,
+        "offload": None, "channels_last": False,
+        "description": "Sliced attention and per-image VAE decode. Lower peak memory for a small latency cost."
+    },
+    MemoryProfile.LOW_VRAM: {
+        "attention_slicing": True, "vae_slicing": True, "vae_tiling": True,
+        "offload": "model", "channels_last": False,
+        "description": "Whole sub-models are moved to the GPU only while they run. Less GPU memory, slower."
+    },
+    MemoryProfile.MINIMAL: {
+        "attention_slicing": True, "vae_slicing": True, "vae_tiling": True,
+        "offload": "sequential", "channels_last": False,
+        "description": "Layers are streamed to the GPU one at a time. Lowest GPU memory, much slower."
+    },
+}
+
 class LoraConfig(BaseModel):
     filename: str
     weight: float = Field(ge=0.0, le=1.0)
@@ -47,27 +148,173 @@ class GenerationRequest(BaseModel):
     guidance_scale: Optional[float] = Field(default=7.0, ge=2.0, le=15.0)
     loras: Optional[List[LoraConfig]] = None
     style_name: Optional[str] = None  # New field for style selection
+    style_names: Optional[List[str]] = None  # Stacked styles, outermost first; applied after style_name
+    num_inference_steps: Optional[int] = Field(default=None, ge=MIN_INFERENCE_STEPS, le=MAX_INFERENCE_STEPS)
+    quality: Optional[QualityTier] = QualityTier.STANDARD
+    memory_profile: Optional[MemoryProfile] = None  # Defaults to the MEMORY_PROFILE set at startup
+    model: Optional[str] = None  # Model directory name under /app/models/sdxl, defaults to DEFAULT_MODEL
+    # Optional upscale stage: set a target size to upscale and refine tile by tile
+    target_width: Optional[int] = Field(default=None, ge=64, le=MAX_UPSCALE_SIZE)
+    target_height: Optional[int] = Field(default=None, ge=64, le=MAX_UPSCALE_SIZE)
+    tile_size: Optional[int] = Field(default=1024, ge=256, le=2048)
+    tile_overlap: Optional[int] = Field(default=128, ge=0, le=512)
+    upscale_strength: Optional[float] = Field(default=0.35, gt=0.0, le=1.0)
 
     @validator('guidance_scale')
     def validate_guidance_scale(cls, v):
         if v < 2.0 or v > 15.0:
             raise ValueError('Guidance scale must be between 2 and 15')
         return v
-        
-    @validator('prompt')
-    def process_prompt(cls, v):
-        return rewrite_prompt(v)
-        
-    @validator('negative_prompt')
-    def process_negative_prompt(cls, v):
-        if v:
-            return rewrite_prompt(v)
+
+class RefineRequest(GenerationRequest):
+    """Re-render a draft seed at full quality; steps and resolution come from REFINE_PRESET"""
+    seed: int
+    num_images: Optional[int] = Field(default=1, ge=1, le=1)
+    quality: Optional[QualityTier] = QualityTier.STANDARD
+
+    @validator('quality', pre=True)
+    def reject_quality_override(cls, v):
+        if v is not None and v != QualityTier.STANDARD:
+            raise ValueError('Refinement always uses the standard tier')
+        return v
+
+    @validator('num_inference_steps', pre=True)
+    def reject_steps_override(cls, v):
+        if v is not None:
+            raise ValueError('num_inference_steps is fixed for refinement')
+        return v
+
+class StreamGenerationRequest(GenerationRequest):
+    preview_every: Optional[int] = Field(default=5, ge=1, le=MAX_INFERENCE_STEPS)  # Emit a preview every K steps
+
+class UpscaleRequest(BaseModel):
+    """Upscale a stored or uploaded image; prompts default to the ones in its metadata"""
+    image_id: Optional[str] = None
+    image: Optional[str] = None  # Base64 PNG/JPEG, used when image_id is not given
+    prompt: Optional[str] = None
+    negative_prompt: Optional[str] = None
+    model: Optional[str] = None
+    sampler: Optional[SamplerType] = SamplerType.DPM_SOLVER
+    scale: Optional[float] = Field(default=2.0, gt=1.0, le=4.0)  # Used when no target size is given
+    target_width: Optional[int] = Field(default=None, ge=64, le=MAX_UPSCALE_SIZE)
+    target_height: Optional[int] = Field(default=None, ge=64, le=MAX_UPSCALE_SIZE)
+    tile_size: Optional[int] = Field(default=1024, ge=256, le=2048)
+    tile_overlap: Optional[int] = Field(default=128, ge=0, le=512)
+    strength: Optional[float] = Field(default=0.35, gt=0.0, le=1.0)
+    num_inference_steps: Optional[int] = Field(default=20, ge=MIN_INFERENCE_STEPS, le=MAX_INFERENCE_STEPS)
+    guidance_scale: Optional[float] = Field(default=7.0, ge=2.0, le=15.0)
+    seed: Optional[int] = None
+
+class ImageToImageRequest(BaseModel):
+    """Shared fields of the stages that start from an existing image"""
+    image_id: Optional[str] = None
+    image: Optional[str] = None  # Base64 PNG/JPEG, used when image_id is not given
+    negative_prompt: Optional[str] = None  # Defaults to the source image's negative prompt
+    style_name: Optional[str] = None
+    style_names: Optional[List[str]] = None
+    sampler: Optional[SamplerType] = SamplerType.DPM_SOLVER
+    num_images: Optional[int] = Field(default=1, ge=1, le=8)
+    num_inference_steps: Optional[int] = Field(default=30, ge=MIN_INFERENCE_STEPS, le=MAX_INFERENCE_STEPS)
+    guidance_scale: Optional[float] = Field(default=7.0, ge=2.0, le=15.0)
+    seed: Optional[int] = None
+    loras: Optional[List[LoraConfig]] = None
+    model: Optional[str] = None
+
+class Img2ImgRequest(ImageToImageRequest):
+    """Re-render an image towards a new prompt; only the last `strength` of the schedule runs"""
+    prompt: str
+    strength: Optional[float] = Field(default=0.6, gt=0.0, le=1.0)
+
+class VariationsRequest(ImageToImageRequest):
+    """Variations of an image with its original prompt, LoRAs and model unless overridden"""
+    prompt: Optional[str] = None
+    num_images: Optional[int] = Field(default=4, ge=1, le=8)
+    strength: Optional[float] = Field(default=0.45, gt=0.0, le=1.0)
+
+class HistoryImportRequest(BaseModel):
+    directories: List[str]
+    recursive: Optional[bool] = True
+
+MAX_ANALYZE_PROMPTS = 256
+
+class PromptAnalyzeRequest(BaseModel):
+    prompts: List[str] = Field(min_length=1, max_length=MAX_ANALYZE_PROMPTS)
+    style_name: Optional[str] = None  # Analyze each prompt with this style applied
+    style_names: Optional[List[str]] = None
+    max_tokens: Optional[int] = Field(default=MAX_TOKENS, ge=3, le=1024)  # Including BOS/EOS
+
+class PromptAnalysis(BaseModel):
+    prompt: str
+    styled_prompt: str
+    style_fragments_dropped: int  # Style fragments trimmed to fit the token budget
+    token_count: int  # Including BOS/EOS
+    max_tokens: int
+    fits: bool
+    overflow_tokens: int
+    overflow_token_index: Optional[int]  # First token past the limit
+    overflow_char_offset: Optional[int]  # Character position of that token in styled_prompt
+    truncated_prompt: str  # What CLIP sees when the prompt is cut at the limit
+    overflow_text: str
+    windows: int  # 77-token windows needed in chunked prompt mode
+    would_rewrite: bool  # True if generation would send this prompt through the T5 rewriter
+
+class PromptAnalyzeResponse(BaseModel):
+    prompt_mode: PromptMode
+    results: List[PromptAnalysis]
+
+class SweepRequest(BaseModel):
+    """A grid of generations over seeds x guidance scales x samplers x styles"""
+    prompt: str
+    negative_prompt: Optional[str] = ""
+    seeds: Optional[List[int]] = Field(default=None, min_length=1)
+    num_seeds: Optional[int] = Field(default=4, ge=1)  # Random seeds, used when seeds is not given
+    guidance_scales: List[float] = Field(default=[7.0], min_length=1)
+    samplers: List[SamplerType] = Field(default=[SamplerType.DPM_SOLVER], min_length=1)
+    styles: List[Optional[str]] = Field(default=[None], min_length=1)  # null for the unstyled prompt
+    num_inference_steps: Optional[int] = Field(default=None, ge=MIN_INFERENCE_STEPS, le=MAX_INFERENCE_STEPS)
+    quality: Optional[QualityTier] = QualityTier.DRAFT
+    memory_profile: Optional[MemoryProfile] = None
+    model: Optional[str] = None
+    loras: Optional[List[LoraConfig]] = None
+    thumbnail_size: Optional[int] = Field(default=256, ge=64, le=1024)  # Longest side of a contact-sheet cell
+    estimate_only: Optional[bool] = False  # Return the cost estimate without rendering
+
+    @validator('guidance_scales', each_item=True)
+    def validate_guidance_scales(cls, v):
+        if v < 2.0 or v > 15.0:
+            raise ValueError('Guidance scale must be between 2 and 15')
         return v
 
+class AutotuneRequest(BaseModel):
+    model: Optional[str] = None
+    width: Optional[int] = Field(default=None, ge=64, le=MAX_UPSCALE_SIZE)  # Both omitted: every quality preset
+    height: Optional[int] = Field(default=None, ge=64, le=MAX_UPSCALE_SIZE)
+    memory_profile: Optional[MemoryProfile] = None
+    loras: Optional[List[LoraConfig]] = None
+    force: Optional[bool] = False  # Probe again even if a probed result is cached
+
+class SweepCell(BaseModel):
+    row: int
+    column: int
+    seed: int
+    guidance_scale: float
+    sampler: SamplerType
+    style: Optional[str]
+    image_id: Optional[str] = None
+
+class SweepResponse(BaseModel):
+    contact_sheet: Optional[str] = None  # Base64 PNG, one row per sampler/style/guidance, one column per seed
+    contact_sheet_id: Optional[str] = None
+    cells: List[SweepCell]
+    estimated_cost: float  # In 1024x1024 denoising steps
+    max_cost: float
+    parameters: dict
+
 class GenerationResponse(BaseModel):
     images: List[str]
     seeds: List[int]
     parameters: dict
+    image_ids: List[str] = []  # Stored copies, usable as image_id in /v1/upscale
 
 app = FastAPI(
     title="Stable Diffusion API",
@@ -82,30 +329,114 @@ app = FastAPI(
     
     Endpoints:
     - /v1/generate - Generate images
+    - /v1/generate/stream - Generate images with live previews (SSE)
+    - /v1/refine - Re-render a draft seed at full quality
+    - /v1/sweep - Render a seed/guidance/sampler/style grid as a contact sheet
     - /v1/models - List available models
     - /v1/loras - List available LoRAs
     - /v1/samplers - List available samplers
+    - /v1/memory-profiles - List memory profiles
+    - /v1/prompt/analyze - Count prompt tokens and find overflow before generating
+    - /v1/history - Search past generations by prompt text and parameters
+    - /v1/img2img - Re-render an image towards a new prompt
+    - /v1/variations - Variations of an image from its stored latents
+    - /v1/upscale - Upscale an image with tiled img2img refinement
+    - /v1/backend - Report the inference backend and its parity check
+    - /v1/autotune - Probe and report safe batch sizes per resolution bucket
+    - /v1/memory - Report process memory (RSS/PSS/USS) and model load times
     - /v1/health - Check API status
+    - /metrics - Prometheus metrics
+    - /v1/ready - Report startup progress of each component
+    - /v1/workers - Report worker replica health and utilization
+    - /v1/embedding-cache - Report prompt embedding cache usage
     """,
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc"
 )
 
-# Initialize FastAPI-MCP
-mcp = FastApiMCP(app)
-
-# Mount the MCP server to make endpoints available as tools
-mcp.mount()
+# Prometheus metrics
+app.mount("/metrics", make_asgi_app())
 
-# Global pipeline variable
-pipeline = None
+# Serialises use of the shared pipelines between requests and the warm-up run
+pipeline_lock = threading.Lock()
 
 # Update these paths
+MODELS_BASE_PATH = "/app/models/sdxl"
 MODEL_DIR = "/app/models/sdxl/base"  # Changed to point to the diffusers format directory
+DEFAULT_MODEL = os.path.basename(MODEL_DIR)
 CLIP_PATH = "/app/models/tokenizers/clip"
 T5_PATH = "/app/models/tokenizers/t5"
 
+# Fall back to CPU (and full precision) when no GPU is available
+DEVICE = os.environ.get("DEVICE") or ("cuda" if torch.cuda.is_available() else "cpu")
+TORCH_DTYPE = torch.float16 if DEVICE.startswith("cuda") else torch.float32
+DEFAULT_MEMORY_PROFILE = MemoryProfile(os.environ.get("MEMORY_PROFILE", MemoryProfile.FULL.value))
+
+# Model registry: pipelines kept on the device at once, and where evicted ones go
+MAX_RESIDENT_MODELS = int(os.environ.get("MAX_RESIDENT_MODELS", "1"))
+MODEL_EVICTION = os.environ.get("MODEL_EVICTION", "cpu")  # "cpu" keeps weights in RAM, "disk" drops them
+
+# Worker pool mode: one pipeline replica process per entry, e.g. "cuda:0,cuda:1" or "cpu,cpu"
+WORKER_DEVICES = [d.strip() for d in os.environ.get("WORKER_DEVICES", "").split(",") if d.strip()]
+WORKER_ROUTING = os.environ.get("WORKER_ROUTING", "least_loaded")  # or "sticky_lora"
+WORKER_PIPELINE_FACTORY = os.environ.get("WORKER_PIPELINE_FACTORY", f"{__name__}:load_replica_pipeline")
+WORKER_START_TIMEOUT = float(os.environ.get("WORKER_START_TIMEOUT", "900"))
+MAX_REPLICA_RESTARTS = int(os.environ.get("MAX_REPLICA_RESTARTS", "3"))
+# Seconds a replica gets to finish a render (including time queued behind others) before it is restarted
+WORKER_RENDER_TIMEOUT = float(os.environ.get("WORKER_RENDER_TIMEOUT", "600"))
+
+# Text-encoder output cache budget, and whether to pre-encode style negatives at startup
+EMBEDDING_CACHE_MB = int(os.environ.get("EMBEDDING_CACHE_MB", "256"))
+PRECOMPUTE_STYLE_EMBEDDINGS = os.environ.get("PRECOMPUTE_STYLE_EMBEDDINGS", "false").lower() in ("1", "true", "yes")
+
+# Accelerated inference backend, see apply_inference_backend()
+INFERENCE_BACKEND = InferenceBackend(os.environ.get("INFERENCE_BACKEND", InferenceBackend.EAGER.value))
+COMPILE_MODE = os.environ.get("COMPILE_MODE", "default")
+COMPILE_CACHE_DIR = os.environ.get("COMPILE_CACHE_DIR", "/app/models/.compile_cache")
+ONNX_CACHE_DIR = os.environ.get("ONNX_CACHE_DIR", "/app/models/onnx")
+BACKEND_PARITY_CHECK = os.environ.get("BACKEND_PARITY_CHECK", "false").lower() in ("1", "true", "yes")
+BACKEND_PARITY_MIN_PSNR = float(os.environ.get("BACKEND_PARITY_MIN_PSNR", "25"))
+
+# Map safetensors weights straight into memory on CPU so co-located processes share the page cache
+MMAP_WEIGHTS = os.environ.get("MMAP_WEIGHTS", "true").lower() in ("1", "true", "yes")
+
+# Generated images are kept here so later stages can refer to them by id
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "/app/outputs")
+# Stored images (and their latents) older than this are deleted; 0 keeps them forever
+OUTPUT_TTL_SECONDS = int(os.environ.get("OUTPUT_TTL_SECONDS", "604800"))
+# Oldest images are deleted once OUTPUT_DIR holds more than this; 0 for no limit
+OUTPUT_MAX_MB = int(os.environ.get("OUTPUT_MAX_MB", "10240"))
+# Minimum seconds between pruning passes over OUTPUT_DIR
+OUTPUT_PRUNE_INTERVAL = 60
+# SQLite index of every stored generation, searched by /v1/history
+HISTORY_DB_PATH = os.environ.get("HISTORY_DB_PATH", os.path.join(OUTPUT_DIR, "history.sqlite3"))
+# Directories /v1/history/import may read from; anything else on the host is refused
+HISTORY_IMPORT_ROOTS = [p.strip() for p in os.environ.get("HISTORY_IMPORT_ROOTS", OUTPUT_DIR).split(",") if p.strip()]
+# Tiles refined per img2img call during upscaling; bounds peak memory
+UPSCALE_TILE_BATCH = int(os.environ.get("UPSCALE_TILE_BATCH", "2"))
+
+# Sweeps are rejected above this cost, measured in 1024x1024 denoising steps
+SWEEP_MAX_COST = float(os.environ.get("SWEEP_MAX_COST", "1000"))
+# Seeds denoised together per pipeline call in a sweep; 0 uses the autotuned batch size
+SWEEP_BATCH_SIZE = int(os.environ.get("SWEEP_BATCH_SIZE", "0"))
+
+# Batch size autotuning, see BatchAutotuner; results are cached per device and model
+AUTOTUNE_ON_STARTUP = os.environ.get("AUTOTUNE_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+AUTOTUNE_CACHE_PATH = os.environ.get("AUTOTUNE_CACHE_PATH", "/app/models/.autotune.json")
+AUTOTUNE_MAX_BATCH = int(os.environ.get("AUTOTUNE_MAX_BATCH", "8"))
+AUTOTUNE_MEMORY_FRACTION = float(os.environ.get("AUTOTUNE_MEMORY_FRACTION", "0.9"))  # Share of device memory a batch may peak at
+AUTOTUNE_STEPS = int(os.environ.get("AUTOTUNE_STEPS", "2"))
+DEFAULT_BATCH_SIZE = int(os.environ.get("DEFAULT_BATCH_SIZE", "1"))  # Used until a bucket has been tuned
+
+# Optional TAESD-style tiny autoencoder for previews; falls back to a linear projection
+TAESD_PATH = os.environ.get("TAESD_PATH", "/app/models/taesdxl")
+PREVIEW_JPEG_QUALITY = int(os.environ.get("PREVIEW_JPEG_QUALITY", "70"))
+
+# Run a short generation after the model loads to prime kernels and allocators
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+WARMUP_STEPS = int(os.environ.get("WARMUP_STEPS", "2"))
+
 def get_model_path():
     """Get the path to the diffusers model directory"""
     if not os.path.exists(MODEL_DIR):
@@ -118,30 +449,122 @@ def get_model_path():
     
     return MODEL_DIR
 
-# Get model path dynamically
-MODEL_PATH = get_model_path()
+# Validated by the pipeline loader at startup
+MODEL_PATH = MODEL_DIR
 
-# Add this near the top with other globals
-tokenizer = CLIPTokenizer.from_pretrained(
-    CLIP_PATH,
-    local_files_only=True
-)
-prompt_rewriter = T5ForConditionalGeneration.from_pretrained(
-    T5_PATH,
-    local_files_only=True,
-    torch_dtype=torch.float16
-)
-prompt_tokenizer = T5Tokenizer.from_pretrained(
-    T5_PATH,
-    local_files_only=True
-)
-MAX_TOKENS = 77
+# Loaded in the background at startup, see load_heavy_components()
+tokenizer = None
+prompt_rewriter = None
+prompt_tokenizer = None
+
+# How prompts longer than MAX_TOKENS are handled; chunked mode never loads T5
+PROMPT_MODE = PromptMode(os.environ.get("PROMPT_MODE", PromptMode.REWRITE.value))
+
+# Startup state for each component: pending -> loading -> ready | failed
+STARTUP_COMPONENTS = ["styles", "clip_tokenizer", "sdxl_pipeline"]
+if PROMPT_MODE == PromptMode.REWRITE:
+    STARTUP_COMPONENTS.insert(2, "prompt_rewriter")
+if PRECOMPUTE_STYLE_EMBEDDINGS:
+    STARTUP_COMPONENTS.append("style_embeddings")
+if WARMUP_ON_STARTUP:
+    STARTUP_COMPONENTS.append("warmup")
+if AUTOTUNE_ON_STARTUP:
+    STARTUP_COMPONENTS.append("autotune")
+
+component_status = {
+    name: {"state": "pending", "seconds": None, "error": None}
+    for name in STARTUP_COMPONENTS
+}
+startup_timings = {"started_at": None, "total_seconds": None}
+
+def run_startup_phase(name: str, loader) -> None:
+    """Run a startup loader, recording its state and duration"""
+    status = component_status[name]
+    status["state"] = "loading"
+    start = time.perf_counter()
+    try:
+        loader()
+        status["state"] = "ready"
+    except Exception as e:
+        status["state"] = "failed"
+        status["error"] = str(e)
+        print(f"Startup phase '{name}' failed: {e}")
+    finally:
+        status["seconds"] = round(time.perf_counter() - start, 3)
+        print(f"Startup phase '{name}' {status['state']} in {status['seconds']}s")
+
+def require_component(name: str) -> None:
+    """Fail fast with 503 when a component has not finished loading"""
+    status = component_status[name]
+    if status["state"] == "failed":
+        raise HTTPException(status_code=503, detail=f"Component '{name}' failed to load: {status['error']}")
+    if status["state"] != "ready":
+        raise HTTPException(status_code=503, detail=f"Component '{name}' is still loading, retry shortly")
+
+def load_clip_tokenizer():
+    global tokenizer
+    # Rust-backed tokenizer: batch encoding and character offsets for prompt analysis
+    tokenizer = CLIPTokenizerFast.from_pretrained(
+        CLIP_PATH,
+        local_files_only=True
+    )
+    # Styles load before the heavy components, so their templates can be tokenized now
+    prepare_style_spans()
+
+# Prompt text -> (token ids, character offsets) without BOS/EOS, least recently used first
+token_cache = OrderedDict()
+token_cache_lock = threading.Lock()
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+
+def tokenize_prompts(texts: List[str]) -> List[tuple]:
+    """CLIP token ids and offsets for a batch of texts, encoding only cache misses"""
+    results = {}
+    with token_cache_lock:
+        for text in texts:
+            if text in token_cache:
+                token_cache.move_to_end(text)
+                results[text] = token_cache[text]
+    misses = list(dict.fromkeys(text for text in texts if text not in results))
+    if misses:
+        encoded = tokenizer(misses, add_special_tokens=False, return_offsets_mapping=True)
+        with token_cache_lock:
+            for text, ids, offsets in zip(misses, encoded["input_ids"], encoded["offset_mapping"]):
+                results[text] = token_cache[text] = (ids, offsets)
+            while len(token_cache) > TOKEN_CACHE_SIZE:
+                token_cache.popitem(last=False)
+    return [results[text] for text in texts]
+
+def count_tokens(text: str) -> int:
+    """CLIP tokens including BOS/EOS, comparable with MAX_TOKENS"""
+    return len(tokenize_prompts([text])[0][0]) + 2
+
+def load_prompt_rewriter():
+    global prompt_rewriter, prompt_tokenizer
+    prompt_tokenizer = T5Tokenizer.from_pretrained(
+        T5_PATH,
+        local_files_only=True
+    )
+    # The rewriter always runs on CPU, so it can use the checkpoint's own dtype straight from the page cache
+    if MMAP_WEIGHTS:
+        prompt_rewriter = load_module_mmap(T5_PATH, T5ForConditionalGeneration)
+        if prompt_rewriter is not None:
+            return
+    prompt_rewriter = T5ForConditionalGeneration.from_pretrained(
+        T5_PATH,
+        local_files_only=True,
+        torch_dtype=torch.float16
+    )
 
 def rewrite_prompt(prompt: str) -> str:
     """Use T5 to rewrite prompt, trying multiple lengths to preserve detail"""
-    tokens = tokenizer.encode(prompt)
-    if len(tokens) <= MAX_TOKENS:
+    if PROMPT_MODE == PromptMode.CHUNKED:
+        # Long prompts are encoded in full, see encode_prompt_chunked()
         return prompt
+    require_component("clip_tokenizer")
+    token_count = count_tokens(prompt)
+    if token_count <= MAX_TOKENS:
+        return prompt
+    require_component("prompt_rewriter")
         
     # Try different target lengths, from longest to shortest
     target_lengths = [70, 60, 50, 40]  # All under MAX_TOKENS=77
@@ -162,7 +585,7 @@ def rewrite_prompt(prompt: str) -> str:
         )
         
         candidate = prompt_tokenizer.decode(outputs[0], skip_special_tokens=True)
-        candidate_tokens = len(tokenizer.encode(candidate))
+        candidate_tokens = count_tokens(candidate)
         
         if candidate_tokens <= MAX_TOKENS:
             best_prompt = candidate
@@ -172,12 +595,25 @@ def rewrite_prompt(prompt: str) -> str:
         # Fallback to shortest possible if all attempts are too long
         best_prompt = rewrite_prompt_aggressive(prompt)
     
-    print(f"Original prompt ({len(tokens)} tokens): {prompt}")
-    print(f"Rewritten prompt ({len(tokenizer.encode(best_prompt))} tokens): {best_prompt}")
-    print(f"Token reduction: {len(tokens)} -> {len(tokenizer.encode(best_prompt))}")
+    rewritten_count = count_tokens(best_prompt)
+    print(f"Original prompt ({token_count} tokens): {prompt}")
+    print(f"Rewritten prompt ({rewritten_count} tokens): {best_prompt}")
+    print(f"Token reduction: {token_count} -> {rewritten_count}")
     
     return best_prompt
 
+def rewrite_request_prompts(request: BaseModel) -> None:
+    """Shorten a request's over-long prompt and negative prompt in place.
+
+    Called by the render functions rather than request validators, so a
+    tokenizer or rewriter that is still loading surfaces as require_component's
+    503 and the T5 rewrite runs off the event loop.
+    """
+    for field in ("prompt", "negative_prompt"):
+        value = getattr(request, field, None)
+        if value:
+            setattr(request, field, rewrite_prompt(value))
+
 def rewrite_prompt_aggressive(prompt: str) -> str:
     """Aggressive shortening as a last resort"""
     input_text = f"Summarize very briefly: {prompt}"
@@ -252,6 +688,165 @@ def apply_style_to_prompt(prompt: str, style_name: str, available_styles: dict)
         # Style only has negative prompt, return original prompt
         return prompt
 
+# Splits style text into fragments at commas and " . " separators, keeping the separators
+STYLE_FRAGMENT_SEPARATOR = re.compile(r"(\s*,\s*|\s+\.\s+)")
+
+# Style name -> pre-tokenized template spans, filled once the CLIP tokenizer is loaded
+style_spans = {}
+
+def split_style_fragments(text: str, leading: bool) -> List[str]:
+    """Split template text into fragments that join back to the original text.
+
+    Prefix fragments keep their trailing separator and suffix fragments their
+    leading one, so dropping a fragment never leaves a dangling comma.
+    """
+    parts = STYLE_FRAGMENT_SEPARATOR.split(text)
+    if leading:
+        fragments = [parts[0]] + [parts[i] + parts[i + 1] for i in range(1, len(parts), 2)]
+    else:
+        fragments = [parts[i] + (parts[i + 1] if i + 1 < len(parts) else "") for i in range(0, len(parts), 2)]
+    return [fragment for fragment in fragments if fragment]
+
+def split_negative_fragments(text: Optional[str]) -> List[str]:
+    return [fragment.strip() for fragment in (text or "").split(",") if fragment.strip()]
+
+def build_style_spans(styles: List[StyleModel]) -> dict:
+    """Split style templates around {prompt} and count the tokens of every fragment in one batch"""
+    layouts = {}
+    for style in styles:
+        template = style.prompt or ""
+        if "{prompt}" in template:
+            prefix, suffix = template.split("{prompt}", 1)
+        elif template:
+            prefix, suffix = f"{template}, ", ""
+        else:
+            prefix, suffix = "", ""
+        layouts[style.name] = {
+            "prefix": split_style_fragments(prefix, leading=False),
+            "suffix": split_style_fragments(suffix, leading=True),
+            "negative": split_negative_fragments(style.negative_prompt),
+        }
+    texts = list({fragment for layout in layouts.values() for part in layout.values() for fragment in part})
+    lengths = dict(zip(texts, (len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]))) if texts else {}
+    return {
+        name: {part: [(fragment, lengths[fragment]) for fragment in fragments] for part, fragments in layout.items()}
+        for name, layout in layouts.items()
+    }
+
+def prepare_style_spans():
+    """Pre-tokenize every style template so styled prompts can be assembled within the token budget"""
+    style_spans.clear()
+    style_spans.update(build_style_spans(list(AVAILABLE_STYLES.values())))
+    print(f"Pre-tokenized {len(style_spans)} style templates")
+
+def get_style_spans(style_name: str) -> dict:
+    if style_name not in AVAILABLE_STYLES:
+        raise ValueError(f"Style '{style_name}' not found")
+    if style_name not in style_spans:
+        style_spans.update(build_style_spans([AVAILABLE_STYLES[style_name]]))
+    return style_spans[style_name]
+
+def resolve_style_names(style_name: Optional[str], style_names: Optional[List[str]]) -> List[str]:
+    """Ordered, de-duplicated styles of a request; style_name is kept for older clients"""
+    names = ([style_name] if style_name else []) + list(style_names or [])
+    return list(dict.fromkeys(names))
+
+def style_token_budget(max_tokens: int = MAX_TOKENS) -> Optional[int]:
+    """Token budget for styled prompts; chunked mode encodes every token so nothing is trimmed"""
+    return max_tokens if PROMPT_MODE == PromptMode.REWRITE else None
+
+def trim_to_budget(build, candidates: list, budget: Optional[int]) -> int:
+    """Drop candidates in order until build() fits the budget, returning how many were dropped.
+
+    The pre-tokenized fragment lengths give the estimate, which is then
+    confirmed on the assembled text since BPE merges at fragment joins can
+    shift the count by a token.
+    """
+    if budget is None:
+        return 0
+    dropped = 0
+    tokens = count_tokens(build())
+    while dropped < len(candidates) and tokens > budget:
+        drop, length = candidates[dropped]
+        drop()
+        dropped += 1
+        tokens -= length
+        if tokens <= budget:
+            tokens = count_tokens(build())
+    return dropped
+
+def assemble_styled_prompt(prompt: str, style_names: List[str], budget: Optional[int] = None) -> tuple:
+    """Apply an ordered stack of styles to a prompt within the CLIP token budget.
+
+    The first style is the outermost template, so one style gives the same text
+    as apply_style_to_prompt. The user's prompt is never trimmed; style
+    fragments go first from the last style, suffix before prefix and from the
+    end inwards. Returns the styled prompt and the number of fragments dropped.
+    """
+    spans = [get_style_spans(name) for name in style_names]
+    kept = [{"prefix": [True] * len(s["prefix"]), "suffix": [True] * len(s["suffix"])} for s in spans]
+
+    def build() -> str:
+        prefix = "".join(f for s, k in zip(spans, kept) for (f, _), keep in zip(s["prefix"], k["prefix"]) if keep)
+        suffix = "".join(f for s, k in reversed(list(zip(spans, kept))) for (f, _), keep in zip(s["suffix"], k["suffix"]) if keep)
+        return prefix + prompt + suffix
+
+    def dropper(index: int, part: str, position: int):
+        return lambda: kept[index][part].__setitem__(position, False)
+
+    candidates = [
+        (dropper(index, part, position), spans[index][part][position][1] + 1)
+        for index in reversed(range(len(spans)))
+        for part in ("suffix", "prefix")
+        for position in reversed(range(len(spans[index][part])))
+    ]
+    dropped = trim_to_budget(build, candidates, budget)
+    return build(), dropped
+
+def merge_negative_prompts(negative_prompt: Optional[str], style_names: List[str], budget: Optional[int] = None) -> str:
+    """Merge the request's negative prompt with each style's, de-duplicated and within the token budget.
+
+    Fragments from the request always stay; style fragments are dropped from
+    the last style backwards until the merged prompt fits.
+    """
+    fragments = [(fragment, None) for fragment in split_negative_fragments(negative_prompt)]
+    seen = {fragment.lower() for fragment, _ in fragments}
+    for name in style_names:
+        for fragment, length in get_style_spans(name)["negative"]:
+            if fragment.lower() not in seen:
+                seen.add(fragment.lower())
+                fragments.append((fragment, length))
+    if not style_names:
+        return negative_prompt or ""
+    kept = [True] * len(fragments)
+
+    def build() -> str:
+        return ", ".join(fragment for (fragment, _), keep in zip(fragments, kept) if keep)
+
+    candidates = [
+        (lambda position=position: kept.__setitem__(position, False), length + 1)
+        for position, (_, length) in reversed(list(enumerate(fragments)))
+        if length is not None
+    ]
+    trim_to_budget(build, candidates, budget)
+    return build()
+
+def apply_request_styles(prompt: str, negative_prompt: Optional[str], style_name: Optional[str],
+                         style_names: Optional[List[str]], max_tokens: int = MAX_TOKENS) -> dict:
+    """Styled prompt and merged negative prompt for a request's style stack"""
+    names = resolve_style_names(style_name, style_names)
+    if not names:
+        return {"styles": [], "prompt": prompt, "negative_prompt": negative_prompt, "fragments_dropped": 0}
+    budget = style_token_budget(max_tokens)
+    if budget is not None:
+        require_component("clip_tokenizer")
+    try:
+        styled, dropped = assemble_styled_prompt(prompt, names, budget)
+        negative = merge_negative_prompts(negative_prompt, names, budget)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"styles": names, "prompt": styled, "negative_prompt": negative, "fragments_dropped": dropped}
+
 def suggest_styles(description: str, available_styles: dict, max_suggestions: int = 3) -> List[StyleModel]:
     """Suggest styles based on user description using keyword matching"""
     description_lower = description.lower()
@@ -316,240 +911,2818 @@ def suggest_styles(description: str, available_styles: dict, max_suggestions: in
 # Global styles variable
 AVAILABLE_STYLES = {}
 
-def get_scheduler(sampler_type: SamplerType):
-    if sampler_type == SamplerType.DPM_SOLVER:
-        return DPMSolverMultistepScheduler.from_pretrained(MODEL_PATH, subfolder="scheduler")
-    elif sampler_type == SamplerType.EULER_A:
-        return EulerAncestralDiscreteScheduler.from_pretrained(MODEL_PATH, subfolder="scheduler")
-    elif sampler_type == SamplerType.DDIM:
-        return DDIMScheduler.from_pretrained(MODEL_PATH, subfolder="scheduler")
+SCHEDULER_CLASSES = {
+    SamplerType.DPM_SOLVER: DPMSolverMultistepScheduler,
+    SamplerType.EULER_A: EulerAncestralDiscreteScheduler,
+    SamplerType.DDIM: DDIMScheduler,
+}
 
-@app.on_event("startup")
-async def startup_event():
-    global pipeline, AVAILABLE_STYLES
-    try:
-        print(f"Loading model from: {MODEL_PATH}")
-        pipeline = StableDiffusionXLPipeline.from_pretrained(
-            MODEL_PATH,  # Now points to the diffusers format directory
-            torch_dtype=torch.float16,
-            use_safetensors=True,
-            local_files_only=True
-        )
-        
-        if torch.cuda.is_available():
-            pipeline = pipeline.to("cuda")
-        
-        # Load styles
-        print("Loading SDXL styles...")
-        AVAILABLE_STYLES = load_all_styles()
-        print(f"Loaded {len(AVAILABLE_STYLES)} styles")
-            
-    except Exception as e:
-        print(f"Error loading model: {str(e)}")
-        raise
+# Scheduler settings for few-step sampling: Karras sigmas keep DPM-Solver++
+# sharp at low step counts, trailing spacing makes the last step land on t=0
+FEW_STEP_OVERRIDES = {
+    SamplerType.DPM_SOLVER: {"use_karras_sigmas": True},
+    SamplerType.EULER_A: {"timestep_spacing": "trailing"},
+    SamplerType.DDIM: {"timestep_spacing": "trailing"},
+}
 
-@app.post("/v1/generate", response_model=GenerationResponse)
-async def generate_images(request: GenerationRequest):
-    if pipeline is None:
-        raise HTTPException(status_code=500, detail="Model not loaded")
-    
-    try:
-        # Create a copy of the pipeline for this generation
-        current_pipeline = pipeline
-        
-        # Load LoRAs if specified
-        if request.loras:
-            current_pipeline = load_loras(pipeline.copy(), request.loras)
-            
-        # Set scheduler based on request
-        current_pipeline.scheduler = get_scheduler(request.sampler)
-        
-        # Store original prompt before any modification
-        original_prompt = request.prompt
-        
-        # Apply style if specified
-        style_applied = None
-        final_prompt = request.prompt
-        if request.style_name:
-            try:
-                final_prompt = apply_style_to_prompt(request.prompt, request.style_name, AVAILABLE_STYLES)
-                style_applied = request.style_name
-                print(f"Applied style '{request.style_name}': '{request.prompt}' -> '{final_prompt}'")
-            except ValueError as e:
-                raise HTTPException(status_code=400, detail=str(e))
-        
-        # Generate seeds
-        seeds = []
-        if request.seed is not None:
-            seeds = [request.seed] + [random.randint(0, 2**32 - 1) for _ in range(request.num_images - 1)]
+# Scheduler config each pipeline was loaded with, before any per-request swap
+base_scheduler_configs = weakref.WeakKeyDictionary()
+
+def get_scheduler(sampler_type: SamplerType, base_config, few_steps: bool = False):
+    """Build the scheduler for a sampler, optionally tuned for few-step sampling"""
+    overrides = FEW_STEP_OVERRIDES[sampler_type] if few_steps else {}
+    return SCHEDULER_CLASSES[sampler_type].from_config(base_config, **overrides)
+
+def resolve_generation_settings(request: GenerationRequest) -> dict:
+    """Resolve steps, resolution and scheduler tuning from the quality tier"""
+    if isinstance(request, RefineRequest):
+        return dict(REFINE_PRESET, quality=QualityTier.STANDARD)
+    quality = request.quality or QualityTier.STANDARD
+    settings = dict(QUALITY_PRESETS[quality], quality=quality)
+    if request.num_inference_steps is not None:
+        settings["num_inference_steps"] = request.num_inference_steps
+    return settings
+
+def load_sdxl_pipeline():
+    global MODEL_PATH, worker_pool
+    MODEL_PATH = get_model_path()
+    if WORKER_DEVICES:
+        pool = WorkerPool(WORKER_DEVICES, WORKER_PIPELINE_FACTORY, WORKER_ROUTING)
+        pool.start(timeout=WORKER_START_TIMEOUT)
+        worker_pool = pool
+    else:
+        model_registry.get(DEFAULT_MODEL)
+
+# Memory profile currently applied to each loaded pipeline
+active_memory_profiles = weakref.WeakKeyDictionary()
+# Pipeline that last applied a memory profile to each module. Components shared
+# between models carry the offload hooks, device placement and VAE slicing of
+# whichever pipeline configured them last.
+module_profile_owners = weakref.WeakKeyDictionary()  # module -> weakref to pipeline
+
+def is_torch_pipeline(pipe) -> bool:
+    """True for diffusers pipelines backed by PyTorch modules (not ONNX Runtime)"""
+    return isinstance(getattr(pipe, "unet", None), torch.nn.Module)
+
+def pipeline_modules(pipe) -> list:
+    return [module for module in pipe.components.values() if isinstance(module, torch.nn.Module)]
+
+def owns_memory_profile(pipe) -> bool:
+    """True when no shared component was reconfigured by another pipeline since this one's profile"""
+    owner = weakref.ref(pipe)
+    return all(module_profile_owners.get(module) == owner for module in pipeline_modules(pipe))
+
+def apply_memory_profile(pipe, profile: MemoryProfile) -> None:
+    """Configure a pipeline for a memory profile, undoing any previous profile.
+
+    A pipeline whose shared components were configured by another pipeline
+    is set up again even when its own profile has not changed. Renders are
+    serialized by pipeline_lock (or a single-threaded replica), so the setup
+    holds for the whole render.
+    """
+    if not is_torch_pipeline(pipe):
+        return
+    if active_memory_profiles.get(pipe) == profile and owns_memory_profile(pipe):
+        return
+    config = MEMORY_PROFILES[profile]
+
+    # Reset to the plain resident configuration first
+    if pipe in active_memory_profiles:
+        pipe.remove_all_hooks()
+        pipe.disable_attention_slicing()
+        pipe.disable_vae_slicing()
+        pipe.disable_vae_tiling()
+        pipe.unet.to(memory_format=torch.contiguous_format)
+
+    if config["attention_slicing"]:
+        pipe.enable_attention_slicing()
+    if config["vae_slicing"]:
+        pipe.enable_vae_slicing()
+    if config["vae_tiling"]:
+        pipe.enable_vae_tiling()
+    if config["channels_last"]:
+        pipe.unet.to(memory_format=torch.channels_last)
+
+    # Offloading only helps when weights can live somewhere other than the device
+    if config["offload"] and DEVICE.startswith("cuda"):
+        if config["offload"] == "sequential":
+            pipe.enable_sequential_cpu_offload(device=DEVICE)
         else:
-            seeds = [random.randint(0, 2**32 - 1) for _ in range(request.num_images)]
-        
-        # Generate images
-        images = []
-        for i, seed in enumerate(seeds):
-            generator = torch.Generator(device='cuda').manual_seed(seed)
-            output = current_pipeline(
-                prompt=final_prompt,
-                negative_prompt=request.negative_prompt,
-                guidance_scale=request.guidance_scale,
-                generator=generator,
-                num_inference_steps=30
-            )
-            
-            # Convert to base64 with metadata
-            for image in output.images:
-                # Create metadata
-                metadata = PngInfo()
-                
-                # Generation parameters
-                metadata.add_text("original_prompt", original_prompt)
-                metadata.add_text("styled_prompt", final_prompt)
-                metadata.add_text("style_applied", style_applied or "none")
-                metadata.add_text("negative_prompt", request.negative_prompt or "")
-                metadata.add_text("sampler", str(request.sampler))
-                metadata.add_text("guidance_scale", str(request.guidance_scale))
-                metadata.add_text("seed", str(seed))
-                metadata.add_text("num_inference_steps", "30")
-                
-                # LoRA information
-                if request.loras:
-                    metadata.add_text("loras", json.dumps([
-                        {"file": l.filename, "weight": l.weight} 
-                        for l in request.loras
-                    ]))
-                
-                # Model information
-                metadata.add_text("model_path", MODEL_PATH)
-                metadata.add_text("model_type", "SDXL")
-                metadata.add_text("scheduler_type", current_pipeline.scheduler.__class__.__name__)
-                
-                # System information
-                metadata.add_text("torch_version", torch.__version__)
-                metadata.add_text("device", str(current_pipeline.device))
-                metadata.add_text("generation_time", datetime.now().isoformat())
-                
-                # Save image with metadata
-                buffered = BytesIO()
-                image.save(buffered, format="PNG", pnginfo=metadata)
-                images.append(base64.b64encode(buffered.getvalue()).decode())
-        
-        return GenerationResponse(
-            images=images,
-            seeds=seeds,
-            parameters={
-                "original_prompt": original_prompt,
-                "styled_prompt": final_prompt,
-                "style_applied": style_applied,
-                "negative_prompt": request.negative_prompt,
-                "sampler": request.sampler,
-                "guidance_scale": request.guidance_scale,
-                "num_inference_steps": 30,
-                "scheduler_type": current_pipeline.scheduler.__class__.__name__,
-                "loras": [{"file": l.filename, "weight": l.weight} for l in request.loras] if request.loras else None
-            }
-        )
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+            pipe.enable_model_cpu_offload(device=DEVICE)
+    else:
+        pipe.to(DEVICE)
 
-@app.get("/v1/health")
-async def health_check():
-    return {"status": "healthy", "model_loaded": pipeline is not None}
+    owner = weakref.ref(pipe)
+    for module in pipeline_modules(pipe):
+        module_profile_owners[module] = owner
+    active_memory_profiles[pipe] = profile
+    print(f"Applied memory profile '{profile.value}' on {DEVICE}")
 
-def get_available_loras():
-    """List available LoRA files"""
-    lora_path = os.path.join(os.path.dirname(MODEL_PATH), "loras")
-    if not os.path.exists(lora_path):
-        return []
-    return [f for f in os.listdir(lora_path) if f.endswith('.safetensors')]
+# Per-model backend load time and parity results, reported by /v1/backend
+backend_status = {"backend": INFERENCE_BACKEND.value, "models": {}}
 
-@app.get("/v1/loras")
-async def list_loras():
-    """Endpoint to list available LoRAs"""
-    return {"loras": get_available_loras()}
+# Modules already compiled or quantized; shared components must not be processed twice
+accelerated_modules = weakref.WeakSet()
 
-def load_loras(pipeline, lora_configs: List[LoraConfig]):
-    """Load and apply LoRA weights"""
-    available_loras = get_available_loras()
-    for lora in lora_configs:
-        if lora.filename not in available_loras:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"LoRA file {lora.filename} not found. Available: {available_loras}"
-            )
-        
-        lora_path = os.path.join(os.path.dirname(MODEL_PATH), "loras", lora.filename)
-        pipeline.load_lora_weights(lora_path, weight=lora.weight)
-    return pipeline 
+def configure_compile_cache() -> None:
+    """Persist Inductor compile artifacts on disk so restarts reuse them"""
+    os.makedirs(COMPILE_CACHE_DIR, exist_ok=True)
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", COMPILE_CACHE_DIR)
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    os.environ.setdefault("TORCHINDUCTOR_AUTOGRAD_CACHE", "1")
+    import torch._inductor.config as inductor_config
+    inductor_config.fx_graph_cache = True
 
-def get_available_models():
-    """List available models in the models directory"""
-    models_base_path = "/app/models/sdxl"
-    if not os.path.exists(models_base_path):
-        return []
-    
-    models = []
-    for item in os.listdir(models_base_path):
-        item_path = os.path.join(models_base_path, item)
-        if os.path.isdir(item_path):
-            # Check if it's a diffusers format model (has model_index.json)
-            if os.path.exists(os.path.join(item_path, "model_index.json")):
-                models.append(item)
-    return models
+def apply_inference_backend(pipe, backend: InferenceBackend) -> None:
+    """Switch a loaded PyTorch pipeline to the compile or int8 backend in place"""
+    if backend == InferenceBackend.COMPILE:
+        configure_compile_cache()
+        if pipe.unet not in accelerated_modules:
+            accelerated_modules.add(pipe.unet)
+            pipe.unet = torch.compile(pipe.unet, mode=COMPILE_MODE)
+        if pipe.vae not in accelerated_modules:
+            accelerated_modules.add(pipe.vae)
+            pipe.vae.decode = torch.compile(pipe.vae.decode, mode=COMPILE_MODE)
+    elif backend == InferenceBackend.INT8:
+        if DEVICE.startswith("cuda"):
+            raise ValueError("The int8 backend uses dynamic quantization, which runs on CPU only")
+        for name in ("unet", "text_encoder", "text_encoder_2"):
+            module = getattr(pipe, name, None)
+            if module is None or module in accelerated_modules:
+                continue
+            torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+            accelerated_modules.add(module)
 
-@app.get("/v1/models")
-async def list_models():
-    """Endpoint to list available models"""
-    return {
-        "models": get_available_models(),
-        "current_model": os.path.basename(MODEL_PATH)
-    }
+def load_onnx_pipeline(name: str, path: str):
+    """Load an ONNX Runtime CPU pipeline, exporting the model on first use"""
+    try:
+        from optimum.onnxruntime import ORTStableDiffusionXLPipeline
+    except ImportError:
+        raise RuntimeError("The onnx backend needs optimum with onnxruntime: pip install 'optimum[onnxruntime]'")
+    export_dir = os.path.join(ONNX_CACHE_DIR, name)
+    if os.path.exists(os.path.join(export_dir, "model_index.json")):
+        return ORTStableDiffusionXLPipeline.from_pretrained(export_dir, provider="CPUExecutionProvider")
+    print(f"Exporting model '{name}' to ONNX in {export_dir}, this takes several minutes")
+    pipe = ORTStableDiffusionXLPipeline.from_pretrained(path, export=True, provider="CPUExecutionProvider")
+    pipe.save_pretrained(export_dir)
+    return pipe
 
-@app.get("/v1/samplers")
-async def list_samplers():
-    """Endpoint to list available samplers"""
+def image_similarity(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    """PSNR and mean absolute error between two float images in [0, 1]"""
+    mse = float(np.mean((reference - candidate) ** 2))
     return {
-        "samplers": [
-            {
-                "name": sampler.value,
-                "type": sampler.name,
-                "description": {
-                    "dpm solver ++": "DPM-Solver++: Fast with good quality",
-                    "euler a": "Euler Ancestral: Good for creative variations",
-                    "ddim": "DDIM: Deterministic, good for consistency"
-                }.get(sampler.value, "")
-            }
-            for sampler in SamplerType
-        ]
+        "psnr_db": round(10 * math.log10(1.0 / mse), 2) if mse > 0 else float("inf"),
+        "mean_abs_error": round(float(np.mean(np.abs(reference - candidate))), 5)
     }
 
-@app.get("/v1/styles")
-async def list_styles():
-    """Endpoint to list all available SDXL styles"""
-    if not AVAILABLE_STYLES:
-        return {"styles": [], "total": 0}
-    
-    styles_list = []
-    for name, style in AVAILABLE_STYLES.items():
-        styles_list.append({
-            "name": style.name,
-            "has_prompt_template": bool(style.prompt and '{prompt}' in style.prompt),
-            "has_negative_prompt": bool(style.negative_prompt),
-            "source_file": style.source_file,
-            "preview_prompt": style.prompt[:100] + "..." if style.prompt and len(style.prompt) > 100 else style.prompt
-        })
-    
+def render_parity_image(pipe) -> np.ndarray:
+    """Small fixed-seed render used to compare a backend against eager mode"""
+    output = pipe(
+        prompt="a red cube on a wooden table, studio lighting",
+        num_inference_steps=4,
+        width=512,
+        height=512,
+        generator=torch.Generator(device=DEVICE).manual_seed(0),
+        output_type="np"
+    )
+    return output.images[0]
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool
+}
+
+def mmap_safetensors(path: str) -> dict:
+    """Map a safetensors file and return tensors that point into the mapping.
+
+    The mapping is copy-on-write: pages come from the shared page cache and
+    only become private to this process if a tensor is modified in place.
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    header_len = struct.unpack("<Q", buffer[:8])[0]
+    header = json.loads(buffer[8:8 + header_len])
+    data_start = 8 + header_len
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        if end == begin:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        # frombuffer keeps a reference to the mapping, so it lives as long as the tensors
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=(end - begin) // dtype.itemsize, offset=data_start + begin)
+        tensors[name] = tensor.view(info["shape"])
+    return tensors
+
+def weight_files(component_dir: str) -> List[str]:
+    """Full-precision safetensors shards of a component, skipping variants like *.fp16.safetensors"""
+    return sorted(
+        path for path in glob.glob(os.path.join(component_dir, "*.safetensors"))
+        if os.path.basename(path).count(".") == 1
+    )
+
+def load_module_mmap(component_dir: str, module_class, dtype: Optional[torch.dtype] = None):
+    """Build a module on the meta device and assign memory-mapped weights to it.
+
+    Returns None when the checkpoint cannot be used zero-copy (no safetensors
+    files, a dtype other than the requested one, or mismatched keys), in
+    which case the caller falls back to a regular from_pretrained() load.
+    """
+    files = weight_files(component_dir)
+    if not files:
+        return None
+    state_dict = {}
+    for path in files:
+        state_dict.update(mmap_safetensors(path))
+    stored = {t.dtype for t in state_dict.values() if t.is_floating_point()}
+    if dtype is not None and stored != {dtype}:
+        print(f"Not memory-mapping {component_dir}: stored as {sorted(map(str, stored))}, need {dtype}")
+        return None
+
+    # Buffers stay real, only parameters start on the meta device
+    with init_empty_weights():
+        if hasattr(module_class, "load_config"):
+            module = module_class.from_config(module_class.load_config(component_dir))
+        else:
+            module = module_class(module_class.config_class.from_pretrained(component_dir))
+    expected = module.state_dict()
+    if any(key not in expected or expected[key].shape != tensor.shape for key, tensor in state_dict.items()):
+        print(f"Not memory-mapping {component_dir}: checkpoint keys do not match {module_class.__name__}")
+        return None
+    module.load_state_dict(state_dict, strict=False, assign=True)
+    if hasattr(module, "tie_weights"):
+        module.tie_weights()
+    if any(p.is_meta for p in module.parameters()):
+        print(f"Not memory-mapping {component_dir}: checkpoint is missing weights")
+        return None
+    return module.eval()
+
+def load_pipeline_components_mmap(path: str, skip) -> dict:
+    """Memory-map every torch component of a diffusers pipeline directory"""
+    with open(os.path.join(path, "model_index.json")) as f:
+        model_index = json.load(f)
+    components = {}
+    for component, spec in model_index.items():
+        if component in skip or not isinstance(spec, list) or spec[0] not in ("diffusers", "transformers"):
+            continue
+        module_class = getattr(importlib.import_module(spec[0]), spec[1], None)
+        if module_class is None or not issubclass(module_class, torch.nn.Module):
+            continue
+        module = load_module_mmap(os.path.join(path, component), module_class, TORCH_DTYPE)
+        if module is not None:
+            components[component] = module
+    return components
+
+def process_memory() -> dict:
+    """Resident, proportional (PSS) and unique (USS) memory of this process in MB"""
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        return {"available": False}
+    uss = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
     return {
-        "styles": sorted(styles_list, key=lambda x: x["name"]),
-        "total": len(styles_list)
+        "available": True,
+        "rss_mb": round(fields.get("Rss", 0) / 1024, 1),
+        "pss_mb": round(fields.get("Pss", 0) / 1024, 1),
+        "uss_mb": round(uss / 1024, 1),
+        "shared_mb": round((fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)) / 1024, 1)
     }
 
-@app.get("/v1/styles/{style_name}")
-async def get_style(style_name: str):
-    """Get details for a specific style"""
-    if style_name not in AVAILABLE_STYLES:
-        raise HTTPException(status_code=404, detail=f"Style '{style_name}' not found")
+# Components that fine-tuned checkpoints frequently leave untouched
+SHAREABLE_COMPONENTS = ("vae", "text_encoder", "text_encoder_2")
+# Tensor data read from each weight file for its fingerprint, in evenly spaced blocks
+FINGERPRINT_SAMPLES = 8
+FINGERPRINT_SAMPLE_BYTES = 2**20
+
+def fingerprint_weight_file(digest, path: str) -> None:
+    """Add a safetensors file's size, header and sampled tensor data to a digest.
+
+    The header lists every tensor's name, dtype, shape and offsets, and the
+    sampled blocks tell fine-tuned weights from the base ones, since
+    fine-tuning changes almost every tensor. Only a few MB are read per file,
+    and the result does not depend on the file's path or modification time,
+    so copies of the same component in different model directories match.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        digest.update(f"{size}:".encode())
+        digest.update(f.read(header_len))
+        data_start = 8 + header_len
+        span = max(size - data_start - FINGERPRINT_SAMPLE_BYTES, 0)
+        for i in range(FINGERPRINT_SAMPLES):
+            f.seek(data_start + span * i // (FINGERPRINT_SAMPLES - 1))
+            digest.update(f.read(FINGERPRINT_SAMPLE_BYTES))
+
+def fingerprint_component(component_dir: str) -> Optional[str]:
+    """Fingerprint a component from its config and the weight files that get loaded.
+
+    Only the full-precision files are used: those are what from_pretrained()
+    loads here, so *.fp16.safetensors duplicates are never read.
+    """
+    if not os.path.isdir(component_dir):
+        return None
+    files = weight_files(component_dir)
+    if not files:
+        return None
+    digest = hashlib.sha256()
+    config_file = os.path.join(component_dir, "config.json")
+    if os.path.exists(config_file):
+        with open(config_file, "rb") as f:
+            digest.update(f.read())
+    for weight_file in files:
+        digest.update(os.path.basename(weight_file).encode())
+        fingerprint_weight_file(digest, weight_file)
+    return digest.hexdigest()
+
+class ModelRegistry:
+    """Lazily loads SDXL pipelines by name and keeps at most N on the device.
+
+    Least recently used pipelines are evicted to CPU RAM or dropped entirely
+    (reloaded from disk on next use). Components with identical weights
+    across models are loaded once and shared between pipelines.
+    """
+
+    def __init__(self, base_path: str, max_resident: int, eviction: str):
+        self.base_path = base_path
+        self.max_resident = max(1, max_resident)
+        # Parking weights in RAM only makes sense when they normally live on a GPU
+        self.eviction = eviction if DEVICE.startswith("cuda") else "disk"
+        self.resident = OrderedDict()  # name -> pipeline, least recently used first
+        self.offloaded = {}  # name -> pipeline parked in CPU RAM
+        self.fingerprints = {}  # name -> {component: fingerprint}
+        self.shared = weakref.WeakValueDictionary()  # fingerprint -> loaded module
+        self.lock = threading.RLock()
+
+    def model_path(self, name: str) -> str:
+        if name not in get_available_models():
+            raise ValueError(f"Model '{name}' not found. Available: {get_available_models()}")
+        return os.path.join(self.base_path, name)
+
+    def get(self, name: Optional[str] = None):
+        """Return a pipeline on the device, loading or restoring it if needed"""
+        name = name or DEFAULT_MODEL
+        with self.lock:
+            if name in self.resident:
+                self.resident.move_to_end(name)
+                return self.resident[name]
+
+            if name in self.offloaded:
+                pipe = self.offloaded.pop(name)
+                print(f"Restoring model '{name}' from CPU RAM")
+                self._move_to_device(pipe)
+            else:
+                pipe = self._load(name)
+
+            self.resident[name] = pipe
+            self._evict_if_needed()
+            return pipe
+
+    def _load(self, name: str):
+        path = self.model_path(name)
+        if INFERENCE_BACKEND == InferenceBackend.ONNX:
+            start = time.perf_counter()
+            pipe = load_onnx_pipeline(name, path)
+            backend_status["models"][name] = {"load_seconds": round(time.perf_counter() - start, 3)}
+            return pipe
+
+        # With a single model there is nothing to share components with
+        fingerprints = {}
+        if len(get_available_models()) > 1:
+            fingerprints = {
+                component: fingerprint_component(os.path.join(path, component))
+                for component in SHAREABLE_COMPONENTS
+            }
+        reused = {}
+        for component, fingerprint in fingerprints.items():
+            module = self.shared.get(fingerprint) if fingerprint else None
+            if module is not None:
+                reused[component] = module
+
+        print(f"Loading model '{name}' from: {path} (sharing: {sorted(reused) or 'none'})")
+        # Weights only stay in the page cache when they are used on CPU as stored
+        if MMAP_WEIGHTS and DEVICE == "cpu":
+            mapped = load_pipeline_components_mmap(path, skip=reused)
+            print(f"Memory-mapped components for '{name}': {sorted(mapped) or 'none'}")
+            reused.update(mapped)
+        pipe = StableDiffusionXLPipeline.from_pretrained(
+            path,
+            torch_dtype=TORCH_DTYPE,
+            use_safetensors=True,
+            local_files_only=True,
+            **reused
+        )
+        for component, fingerprint in fingerprints.items():
+            if fingerprint:
+                self.shared[fingerprint] = getattr(pipe, component)
+        self.fingerprints[name] = fingerprints
+
+        apply_memory_profile(pipe, DEFAULT_MEMORY_PROFILE)
+        if INFERENCE_BACKEND != InferenceBackend.EAGER:
+            self._accelerate(name, pipe)
+        return pipe
+
+    def _accelerate(self, name: str, pipe) -> None:
+        reference = render_parity_image(pipe) if BACKEND_PARITY_CHECK else None
+        start = time.perf_counter()
+        apply_inference_backend(pipe, INFERENCE_BACKEND)
+        status = {"apply_seconds": round(time.perf_counter() - start, 3)}
+        if reference is not None:
+            # The first backend call also pays for compilation, report it separately
+            start = time.perf_counter()
+            status["parity"] = image_similarity(reference, render_parity_image(pipe))
+            status["first_call_seconds"] = round(time.perf_counter() - start, 3)
+            if status["parity"]["psnr_db"] < BACKEND_PARITY_MIN_PSNR:
+                print(f"Warning: backend '{INFERENCE_BACKEND.value}' diverges from eager mode "
+                      f"for model '{name}': {status['parity']}")
+        backend_status["models"][name] = status
+
+    def _move_to_device(self, pipe) -> None:
+        if not is_torch_pipeline(pipe):
+            return
+        profile = active_memory_profiles.get(pipe, DEFAULT_MEMORY_PROFILE)
+        if not owns_memory_profile(pipe):
+            # A shared component was set up for another model's profile meanwhile
+            apply_memory_profile(pipe, profile)
+            return
+        # Offloaded profiles move sub-models on demand already
+        if not (MEMORY_PROFILES[profile]["offload"] and DEVICE.startswith("cuda")):
+            pipe.to(DEVICE)
+
+    def _evict_if_needed(self) -> None:
+        while len(self.resident) > self.max_resident:
+            name, pipe = self.resident.popitem(last=False)
+            if self.eviction == "cpu":
+                print(f"Evicting model '{name}' to CPU RAM")
+                # Keep components still used by a resident model on the device
+                in_use = {
+                    fingerprint
+                    for other in self.resident
+                    for fingerprint in self.fingerprints.get(other, {}).values()
+                    if fingerprint
+                }
+                for component, module in pipe.components.items():
+                    if not isinstance(module, torch.nn.Module):
+                        continue
+                    if self.fingerprints[name].get(component) in in_use:
+                        continue
+                    module.to("cpu")
+                self.offloaded[name] = pipe
+            else:
+                print(f"Evicting model '{name}', it will be reloaded from disk")
+                self.fingerprints.pop(name, None)
+            del pipe
+        if DEVICE.startswith("cuda"):
+            torch.cuda.empty_cache()
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "resident": list(self.resident),
+                "offloaded": list(self.offloaded),
+                "max_resident": self.max_resident,
+                "eviction": self.eviction,
+                "shared_components": len(self.shared)
+            }
+
+model_registry = ModelRegistry(MODELS_BASE_PATH, MAX_RESIDENT_MODELS, MODEL_EVICTION)
+
+def load_replica_pipeline(model_name: str, device: str):
+    """Default worker replica factory: the replica's own model registry"""
+    return model_registry.get(model_name)
+
+def resolve_factory(factory_path: str):
+    """Import a "module:function" pipeline factory"""
+    module_name, _, function_name = factory_path.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+def replica_worker_main(replica_id: int, device: str, factory_path: str, jobs, results):
+    """Entry point of a worker replica process: one pipeline on one device"""
+    global DEVICE, TORCH_DTYPE, model_registry
+    DEVICE = device
+    TORCH_DTYPE = torch.float16 if device.startswith("cuda") else torch.float32
+    model_registry = ModelRegistry(MODELS_BASE_PATH, MAX_RESIDENT_MODELS, MODEL_EVICTION)
+
+    try:
+        factory = resolve_factory(factory_path)
+        pipe = factory(DEFAULT_MODEL, device)
+        if WARMUP_ON_STARTUP:
+            pipe(prompt="warm-up", num_inference_steps=WARMUP_STEPS)
+    except Exception as e:
+        results.put(("failed", replica_id, None, str(e)))
+        return
+    results.put(("ready", replica_id, None, None))
+
+    # LoRA set loaded on each pipeline the factory has returned, "" for none
+    loaded_loras = weakref.WeakKeyDictionary()
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, spec = job
+        start = time.perf_counter()
+        try:
+            pipe = factory(spec["model"], device)
+            # Replicas keep their LoRAs loaded so sticky routing can skip reloads
+            spec_lora_key = json.dumps(spec["loras"], sort_keys=True) if spec["loras"] else ""
+            # Text encoders may be shared between models, so only one pipeline keeps LoRAs loaded
+            for other, key in list(loaded_loras.items()):
+                if other is not pipe and key:
+                    other.unload_lora_weights()
+                    loaded_loras[other] = ""
+            if loaded_loras.get(pipe, "") != spec_lora_key:
+                if loaded_loras.get(pipe, "") and hasattr(pipe, "unload_lora_weights"):
+                    pipe.unload_lora_weights()
+                # Until the new set is fully loaded, treat the pipe as holding unknown LoRAs
+                loaded_loras[pipe] = "partial"
+                if spec["loras"] and isinstance(pipe, StableDiffusionXLPipeline):
+                    load_loras(pipe, [LoraConfig(**l) for l in spec["loras"]])
+                elif spec["loras"]:
+                    # Stand-in pipelines resolve LoRA files themselves
+                    for l in spec["loras"]:
+                        pipe.load_lora_weights(l["filename"], weight=l["weight"])
+                loaded_loras[pipe] = spec_lora_key
+            if isinstance(pipe, StableDiffusionXLPipeline):
+                apply_memory_profile(pipe, MemoryProfile(spec["memory_profile"]))
+            rendered = render_images(pipe, spec, device)
+            results.put(("done", replica_id, job_id, {
+                **rendered,
+                "device": device,
+                "seconds": time.perf_counter() - start
+            }))
+        except Exception as e:
+            results.put(("error", replica_id, job_id, {
+                "error": str(e),
+                "seconds": time.perf_counter() - start
+            }))
+
+class ReplicaState:
+    """Dispatcher-side view of one worker replica"""
+
+    def __init__(self, replica_id: int, device: str):
+        self.replica_id = replica_id
+        self.device = device
+        self.process = None
+        self.jobs = None
+        self.state = "starting"  # starting -> healthy -> failed
+        self.in_flight = set()
+        self.lora_key = None
+        self.completed = 0
+        self.errors = 0
+        self.restarts = 0
+        self.busy_seconds = 0.0
+        self.started_at = time.time()
+        self.last_error = None
+
+    def status(self) -> dict:
+        uptime = max(time.time() - self.started_at, 1e-9)
+        return {
+            "id": self.replica_id,
+            "device": self.device,
+            "state": self.state,
+            "in_flight": len(self.in_flight),
+            "completed": self.completed,
+            "errors": self.errors,
+            "restarts": self.restarts,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "utilization": round(min(self.busy_seconds / uptime, 1.0), 3),
+            "lora_key": self.lora_key,
+            "last_error": self.last_error
+        }
+
+class WorkerPool:
+    """Runs one pipeline replica per device in separate processes.
+
+    A dispatcher routes each render to the least loaded healthy replica, or
+    with sticky routing to a replica that already has the request's LoRAs
+    loaded. Jobs on a replica that dies are retried on another one, and dead
+    replicas are restarted up to MAX_REPLICA_RESTARTS times.
+    """
+
+    def __init__(self, devices: List[str], factory_path: str, routing: str = "least_loaded"):
+        self.factory_path = factory_path
+        self.routing = routing
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        self.replicas = [ReplicaState(i, device) for i, device in enumerate(devices)]
+        self.pending = {}  # job_id -> {"future", "spec", "replica", "attempts"}
+        self.job_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.running = False
+        self.collector = None
+
+    def start(self, timeout: Optional[float] = None) -> None:
+        """Spawn all replicas and wait until at least one is ready"""
+        self.running = True
+        for replica in self.replicas:
+            self._spawn(replica)
+        self.collector = threading.Thread(target=self._collect, name="worker-pool-collector", daemon=True)
+        self.collector.start()
+        if not self.ready.wait(timeout) or not any(r.state == "healthy" for r in self.replicas):
+            raise RuntimeError(f"No worker replica became ready: {[r.last_error for r in self.replicas]}")
+
+    def stop(self) -> None:
+        self.running = False
+        for replica in self.replicas:
+            if replica.process is not None and replica.process.is_alive():
+                replica.jobs.put(None)
+                replica.process.join(timeout=10)
+                if replica.process.is_alive():
+                    replica.process.kill()
+
+    def _spawn(self, replica: ReplicaState) -> None:
+        replica.jobs = self.context.Queue()
+        replica.process = self.context.Process(
+            target=replica_worker_main,
+            args=(replica.replica_id, replica.device, self.factory_path, replica.jobs, self.results),
+            name=f"diffusion-replica-{replica.replica_id}",
+            daemon=True
+        )
+        replica.state = "starting"
+        replica.process.start()
+
+    def render(self, spec: dict, timeout: Optional[float] = None) -> dict:
+        """Render a spec on a replica, blocking until the result arrives.
+
+        timeout bounds each attempt. A replica that misses it is treated as
+        hung and killed; the liveness check then fails its jobs over to the
+        other replicas and restarts it.
+        """
+        future = concurrent.futures.Future()
+        with self.lock:
+            job_id = next(self.job_ids)
+            self.pending[job_id] = {"future": future, "spec": spec, "replica": None, "attempts": 0}
+            self._dispatch(job_id)
+        while True:
+            try:
+                return future.result(timeout)
+            except concurrent.futures.TimeoutError:
+                with self.lock:
+                    job = self.pending.get(job_id)
+                    if job is None:
+                        continue  # Finished or failed while the lock was taken
+                    replica = self.replicas[job["replica"]]
+                    if job["attempts"] >= len(self.replicas):
+                        del self.pending[job_id]
+                        replica.in_flight.discard(job_id)
+                        # Recycle the last replica too; its other jobs fail over once it exits
+                        replica.process.kill()
+                        raise HTTPException(status_code=504, detail=f"Render timed out after {timeout}s on every replica it was tried on")
+                    print(f"Worker replica {replica.replica_id} did not finish job {job_id} within {timeout}s, restarting it")
+                    replica.process.kill()
+
+    def _pick_replica(self, spec: dict, exclude: set) -> Optional[ReplicaState]:
+        candidates = [r for r in self.replicas if r.state == "healthy" and r.replica_id not in exclude]
+        if not candidates:
+            return None
+        least_loaded = min(candidates, key=lambda r: (len(r.in_flight), r.busy_seconds))
+        if self.routing == "sticky_lora" and spec["loras"]:
+            lora_key = json.dumps(spec["loras"], sort_keys=True)
+            sticky = [r for r in candidates if r.lora_key == lora_key]
+            if sticky:
+                best = min(sticky, key=lambda r: len(r.in_flight))
+                # Stay sticky unless that replica is clearly busier than the rest
+                if len(best.in_flight) <= len(least_loaded.in_flight) + 1:
+                    return best
+        return least_loaded
+
+    def _dispatch(self, job_id: int, exclude: Optional[set] = None) -> None:
+        """Send a pending job to a replica; caller holds self.lock"""
+        job = self.pending[job_id]
+        replica = self._pick_replica(job["spec"], exclude or set())
+        if replica is None:
+            del self.pending[job_id]
+            job["future"].set_exception(HTTPException(status_code=503, detail="No healthy worker replicas"))
+            return
+        job["replica"] = replica.replica_id
+        job["attempts"] += 1
+        replica.in_flight.add(job_id)
+        # The replica unloads its LoRAs for a job without any, so it no longer matches a LoRA set
+        replica.lora_key = json.dumps(job["spec"]["loras"], sort_keys=True) if job["spec"]["loras"] else None
+        replica.jobs.put((job_id, job["spec"]))
+
+    def _collect(self) -> None:
+        """Receive replica results and watch replica liveness"""
+        last_check = time.monotonic()
+        while self.running:
+            if time.monotonic() - last_check >= 1.0:
+                self._check_liveness()
+                last_check = time.monotonic()
+            try:
+                kind, replica_id, job_id, payload = self.results.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            with self.lock:
+                replica = self.replicas[replica_id]
+                if kind == "ready":
+                    replica.state = "healthy"
+                    replica.started_at = time.time()
+                    replica.busy_seconds = 0.0
+                    self.ready.set()
+                    print(f"Worker replica {replica_id} ready on {replica.device}")
+                elif kind == "failed":
+                    replica.state = "failed"
+                    replica.last_error = payload
+                    print(f"Worker replica {replica_id} failed to start: {payload}")
+                    if all(r.state == "failed" for r in self.replicas):
+                        self.ready.set()
+                else:
+                    replica.in_flight.discard(job_id)
+                    replica.busy_seconds += payload["seconds"]
+                    job = self.pending.pop(job_id, None)
+                    if job is None:
+                        continue
+                    if kind == "done":
+                        replica.completed += 1
+                        job["future"].set_result(payload)
+                    else:
+                        replica.errors += 1
+                        replica.last_error = payload["error"]
+                        job["future"].set_exception(RuntimeError(payload["error"]))
+
+    def _check_liveness(self) -> None:
+        with self.lock:
+            for replica in self.replicas:
+                if replica.state == "failed" or replica.process.is_alive():
+                    continue
+                print(f"Worker replica {replica.replica_id} exited with code {replica.process.exitcode}")
+                replica.state = "failed"
+                replica.last_error = f"exited with code {replica.process.exitcode}"
+
+                # Fail over in-flight jobs to the remaining replicas
+                orphaned, replica.in_flight = replica.in_flight, set()
+                for job_id in orphaned:
+                    job = self.pending.get(job_id)
+                    if job is None:
+                        continue
+                    if job["attempts"] >= len(self.replicas):
+                        del self.pending[job_id]
+                        job["future"].set_exception(RuntimeError("Job failed on every replica it was tried on"))
+                    else:
+                        self._dispatch(job_id, exclude={replica.replica_id})
+
+                if replica.restarts < MAX_REPLICA_RESTARTS:
+                    replica.restarts += 1
+                    self._spawn(replica)
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "routing": self.routing,
+                "factory": self.factory_path,
+                "pending_jobs": len(self.pending),
+                "replicas": [replica.status() for replica in self.replicas]
+            }
+
+# Set at startup when WORKER_DEVICES is configured
+worker_pool = None
+
+class EmbeddingCache:
+    """Byte-bounded LRU of SDXL text-encoder outputs.
+
+    Entries are (prompt_embeds, pooled_prompt_embeds) pairs kept on the
+    device, keyed by model, LoRA set and text.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _size(value) -> int:
+        return sum(t.element_size() * t.nelement() for t in value)
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        size = self._size(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self._size(self.entries.pop(key))
+            self.entries[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= self._size(evicted)
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_MB * 2**20)
+
+PROMPT_WEIGHT_PATTERN = re.compile(r"\(([^()]+?):\s*(-?\d+(?:\.\d+)?)\)")
+
+def parse_prompt_weights(text: str) -> List[tuple]:
+    """Split a prompt into (fragment, weight) pairs; "(red hair:1.3)" weights "red hair" by 1.3"""
+    fragments = []
+    position = 0
+    for match in PROMPT_WEIGHT_PATTERN.finditer(text):
+        if match.start() > position:
+            fragments.append((text[position:match.start()], 1.0))
+        fragments.append((match.group(1), float(match.group(2))))
+        position = match.end()
+    if position < len(text):
+        fragments.append((text[position:], 1.0))
+    return [(fragment, weight) for fragment, weight in fragments if fragment.strip()]
+
+def tokenize_windows(tokenizer, fragments: List[tuple]) -> tuple:
+    """Token ids and weights split into MAX_TOKENS windows, each with its own BOS/EOS"""
+    ids, weights = [], []
+    for fragment, weight in fragments:
+        fragment_ids = tokenizer(fragment, add_special_tokens=False).input_ids
+        ids += fragment_ids
+        weights += [weight] * len(fragment_ids)
+    body = MAX_TOKENS - 2
+    starts = range(0, max(len(ids), 1), body)
+    window_ids, window_weights = [], []
+    for start in starts:
+        chunk, chunk_weights = ids[start:start + body], weights[start:start + body]
+        padding = body - len(chunk)
+        window_ids.append([tokenizer.bos_token_id] + chunk + [tokenizer.eos_token_id] + [tokenizer.pad_token_id] * padding)
+        window_weights.append([1.0] + chunk_weights + [1.0] + [1.0] * padding)
+    return window_ids, window_weights
+
+def encode_prompt_chunked(pipe, text: str) -> tuple:
+    """SDXL embeddings for a prompt of any length.
+
+    Both tokenizers split the prompt into 77-token windows, each encoder runs
+    all windows in one batch, and the penultimate hidden states are scaled by
+    the token weights (keeping each window's mean) and concatenated along the
+    sequence axis. The pooled embedding comes from the first window.
+    """
+    fragments = parse_prompt_weights(text)
+    device = pipe._execution_device
+    hidden_states = []
+    pooled_prompt_embeds = None
+    with torch.no_grad():
+        for tokenizer, text_encoder in ((pipe.tokenizer, pipe.text_encoder), (pipe.tokenizer_2, pipe.text_encoder_2)):
+            window_ids, window_weights = tokenize_windows(tokenizer, fragments)
+            output = text_encoder(torch.tensor(window_ids, device=device), output_hidden_states=True)
+            hidden = output.hidden_states[-2]
+            weights = torch.tensor(window_weights, device=device, dtype=hidden.dtype).unsqueeze(-1)
+            original_mean = hidden.mean(dim=(1, 2), keepdim=True)
+            hidden = hidden * weights
+            hidden = hidden * (original_mean / hidden.mean(dim=(1, 2), keepdim=True))
+            hidden_states.append(hidden.reshape(1, -1, hidden.shape[-1]))
+            pooled_prompt_embeds = output[0][:1]
+    return torch.cat(hidden_states, dim=-1), pooled_prompt_embeds
+
+def encode_text_cached(pipe, model_name: str, lora_key: str, text: str):
+    """Return (prompt_embeds, pooled_prompt_embeds) for one text, encoding on a miss"""
+    key = (model_name, lora_key, text)
+    cached = embedding_cache.get(key)
+    if cached is not None:
+        return cached
+    if PROMPT_MODE == PromptMode.CHUNKED:
+        prompt_embeds, pooled_prompt_embeds = encode_prompt_chunked(pipe, text)
+    else:
+        with torch.no_grad():
+            prompt_embeds, _, pooled_prompt_embeds, _ = pipe.encode_prompt(
+                prompt=text,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=False
+            )
+    value = (prompt_embeds, pooled_prompt_embeds)
+    embedding_cache.put(key, value)
+    return value
+
+def get_prompt_embeddings(pipe, model_name: str, lora_key: str, prompt: str, negative_prompt: str) -> dict:
+    """Pipeline keyword arguments with cached embeddings for a prompt pair"""
+    prompt_embeds, pooled_prompt_embeds = encode_text_cached(pipe, model_name, lora_key, prompt)
+    if not negative_prompt and pipe.config.force_zeros_for_empty_prompt:
+        # Same as the pipeline's own handling of an empty negative prompt
+        negative_embeds = torch.zeros_like(prompt_embeds)
+        negative_pooled = torch.zeros_like(pooled_prompt_embeds)
+    else:
+        negative_embeds, negative_pooled = encode_text_cached(pipe, model_name, lora_key, negative_prompt or "")
+    if negative_embeds.shape[1] != prompt_embeds.shape[1]:
+        # Chunked prompts of different lengths: pad the shorter one with empty windows
+        empty_window, _ = encode_text_cached(pipe, model_name, lora_key, "")
+        def pad(embeds):
+            missing = (max(prompt_embeds.shape[1], negative_embeds.shape[1]) - embeds.shape[1]) // MAX_TOKENS
+            return torch.cat([embeds] + [empty_window] * missing, dim=1)
+        prompt_embeds, negative_embeds = pad(prompt_embeds), pad(negative_embeds)
+    return {
+        "prompt_embeds": prompt_embeds,
+        "pooled_prompt_embeds": pooled_prompt_embeds,
+        "negative_prompt_embeds": negative_embeds,
+        "negative_pooled_prompt_embeds": negative_pooled
+    }
+
+def precompute_style_embeddings():
+    """Pre-encode the negative prompt of every style for the default model"""
+    if worker_pool is not None:
+        return
+    require_component("sdxl_pipeline")
+    require_component("clip_tokenizer")
+    # Encode the merged form a request with only this style produces, so the cache keys match
+    negatives = {
+        merge_negative_prompts("", [name], style_token_budget())
+        for name, style in AVAILABLE_STYLES.items() if style.negative_prompt
+    }
+    with pipeline_lock:
+        pipe = model_registry.get(DEFAULT_MODEL)
+        for negative_prompt in negatives:
+            encode_text_cached(pipe, DEFAULT_MODEL, "null", negative_prompt)
+    print(f"Pre-encoded {len(negatives)} style negative prompts")
+
+def run_warmup():
+    """Run a short generation to prime kernels and the memory allocator"""
+    settings = QUALITY_PRESETS[QualityTier.STANDARD]
+    with pipeline_lock:
+        model_registry.get(DEFAULT_MODEL)(
+            prompt="warm-up",
+            num_inference_steps=WARMUP_STEPS,
+            width=settings["width"],
+            height=settings["height"]
+        )
+
+def load_styles():
+    global AVAILABLE_STYLES
+    print("Loading SDXL styles...")
+    AVAILABLE_STYLES = load_all_styles()
+    print(f"Loaded {len(AVAILABLE_STYLES)} styles")
+
+async def load_heavy_components():
+    """Load tokenizers, the prompt rewriter and SDXL concurrently, then warm up"""
+    loaders = {
+        "clip_tokenizer": load_clip_tokenizer,
+        "prompt_rewriter": load_prompt_rewriter,
+        "sdxl_pipeline": load_sdxl_pipeline
+    }
+    await asyncio.gather(*(
+        asyncio.to_thread(run_startup_phase, name, loader)
+        for name, loader in loaders.items()
+        if name in component_status
+    ))
+    if PRECOMPUTE_STYLE_EMBEDDINGS:
+        await asyncio.to_thread(run_startup_phase, "style_embeddings", precompute_style_embeddings)
+    if WARMUP_ON_STARTUP:
+        if worker_pool is not None:
+            # Replicas warm themselves up before reporting ready
+            component_status["warmup"].update(state="ready", seconds=0.0)
+        elif component_status["sdxl_pipeline"]["state"] == "ready":
+            await asyncio.to_thread(run_startup_phase, "warmup", run_warmup)
+        else:
+            component_status["warmup"].update(state="failed", error="SDXL pipeline not loaded")
+    if AUTOTUNE_ON_STARTUP:
+        await asyncio.to_thread(run_startup_phase, "autotune", run_startup_autotune)
+    startup_timings["total_seconds"] = round(time.perf_counter() - startup_timings["started_at"], 3)
+    print(f"Startup finished in {startup_timings['total_seconds']}s")
+
+@app.on_event("startup")
+async def startup_event():
+    startup_timings["started_at"] = time.perf_counter()
+    # Styles are small JSON files: load them inline so /v1/styles works immediately
+    run_startup_phase("styles", load_styles)
+    # Heavy components load in the background so health checks answer right away
+    app.state.startup_task = asyncio.create_task(load_heavy_components())
+
+def png_with_metadata(image, metadata_fields: dict) -> bytes:
+    """Encode an image as PNG with generation metadata in text chunks"""
+    metadata = PngInfo()
+    for key, value in metadata_fields.items():
+        metadata.add_text(key, value)
+
+    buffered = BytesIO()
+    image.save(buffered, format="PNG", pnginfo=metadata)
+    return buffered.getvalue()
+
+def encode_image_with_metadata(image, metadata_fields: dict) -> str:
+    """Encode an image as base64 PNG with generation metadata in text chunks"""
+    return base64.b64encode(png_with_metadata(image, metadata_fields)).decode()
+
+IMAGE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+def store_image(png: bytes, latents: Optional[torch.Tensor] = None) -> str:
+    """Save a generated PNG (and its final latents, if known) to OUTPUT_DIR and return its id"""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    image_id = uuid.uuid4().hex
+    with open(os.path.join(OUTPUT_DIR, f"{image_id}.png"), "wb") as f:
+        f.write(png)
+    if latents is not None:
+        save_safetensors({"latents": latents.contiguous()}, os.path.join(OUTPUT_DIR, f"{image_id}.latents.safetensors"))
+    try:
+        history_index.record(os.path.join(OUTPUT_DIR, f"{image_id}.png"), read_png_text_chunks(BytesIO(png)), image_id)
+    except Exception as e:
+        print(f"Failed to index image {image_id}: {e}")
+    prune_outputs()
+    return image_id
+
+output_prune_lock = threading.Lock()
+last_output_prune = 0.0
+
+def prune_outputs(force: bool = False) -> int:
+    """Delete stored images past OUTPUT_TTL_SECONDS or beyond OUTPUT_MAX_MB, oldest first.
+
+    An image's latents go with it, and its history row is dropped. Runs at
+    most once per OUTPUT_PRUNE_INTERVAL unless forced; returns the number of
+    images deleted.
+    """
+    global last_output_prune
+    if not output_prune_lock.acquire(blocking=False):
+        return 0
+    try:
+        if not force and time.monotonic() - last_output_prune < OUTPUT_PRUNE_INTERVAL:
+            return 0
+        last_output_prune = time.monotonic()
+        outputs = {}  # image_id -> [newest mtime, bytes, paths]
+        try:
+            entries = list(os.scandir(OUTPUT_DIR))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            image_id = entry.name.split(".", 1)[0]
+            if not IMAGE_ID_PATTERN.match(image_id):
+                continue
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            output = outputs.setdefault(image_id, [stat.st_mtime, 0, []])
+            output[0] = max(output[0], stat.st_mtime)
+            output[1] += stat.st_size
+            output[2].append(entry.path)
+
+        cutoff = time.time() - OUTPUT_TTL_SECONDS if OUTPUT_TTL_SECONDS > 0 else None
+        total = sum(size for _, size, _ in outputs.values())
+        pruned = []
+        for image_id, (mtime, size, paths) in sorted(outputs.items(), key=lambda item: item[1][0]):
+            expired = cutoff is not None and mtime < cutoff
+            over_budget = OUTPUT_MAX_MB > 0 and total > OUTPUT_MAX_MB * 2**20
+            if not expired and not over_budget:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            pruned.append(os.path.join(OUTPUT_DIR, f"{image_id}.png"))
+    finally:
+        output_prune_lock.release()
+
+    if pruned:
+        print(f"Pruned {len(pruned)} stored images from {OUTPUT_DIR}")
+        try:
+            # Imports index absolute paths, store_image the OUTPUT_DIR-relative form
+            history_index.forget(set(pruned) | {os.path.abspath(path) for path in pruned})
+        except Exception as e:
+            print(f"Failed to drop pruned images from the history index: {e}")
+    return len(pruned)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def read_png_text_chunks(f) -> dict:
+    """Read tEXt/zTXt/iTXt chunks from a PNG file object without decoding pixels.
+
+    Only chunk headers are read for everything else; image data is skipped
+    with seek().
+    """
+    if f.read(8) != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file")
+    chunks = {}
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type == b"IEND":
+            break
+        if chunk_type not in (b"tEXt", b"zTXt", b"iTXt"):
+            f.seek(length + 4, os.SEEK_CUR)  # data and CRC
+            continue
+        data = f.read(length)
+        f.seek(4, os.SEEK_CUR)
+        key, _, rest = data.partition(b"\0")
+        if chunk_type == b"tEXt":
+            value = rest.decode("latin-1")
+        elif chunk_type == b"zTXt":
+            value = zlib.decompress(rest[1:]).decode("latin-1")
+        else:
+            compressed, rest = rest[0], rest[2:]
+            _, _, rest = rest.partition(b"\0")  # language tag
+            _, _, text = rest.partition(b"\0")  # translated keyword
+            value = (zlib.decompress(text) if compressed else text).decode("utf-8")
+        chunks[key.decode("latin-1")] = value
+    return chunks
+
+def normalize_sampler(value: Optional[str]) -> Optional[str]:
+    """Sampler as its API value; metadata stores str(SamplerType.X)"""
+    if not value:
+        return None
+    if value.startswith("SamplerType."):
+        member = SamplerType.__members__.get(value.split(".", 1)[1])
+        return member.value if member else value
+    return value
+
+def parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+class HistoryIndex:
+    """SQLite index of generation metadata with full-text search over prompts.
+
+    New generations are recorded as they are stored; existing PNG folders can
+    be bulk imported from their text chunks. The database is opened on first
+    use so a read-only OUTPUT_DIR does not stop the API from starting.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS generations (
+            id INTEGER PRIMARY KEY,
+            image_id TEXT,
+            path TEXT UNIQUE NOT NULL,
+            created_at TEXT,
+            created_ts REAL,
+            mode TEXT,
+            original_prompt TEXT,
+            styled_prompt TEXT,
+            negative_prompt TEXT,
+            style TEXT,
+            sampler TEXT,
+            seed INTEGER,
+            guidance_scale REAL,
+            num_inference_steps INTEGER,
+            width INTEGER,
+            height INTEGER,
+            model TEXT,
+            loras TEXT,
+            metadata TEXT
+        );
+        CREATE INDEX IF NOT EXISTS generations_created ON generations(created_ts);
+        CREATE INDEX IF NOT EXISTS generations_seed ON generations(seed);
+        CREATE INDEX IF NOT EXISTS generations_style ON generations(style);
+        CREATE INDEX IF NOT EXISTS generations_sampler ON generations(sampler);
+        CREATE TABLE IF NOT EXISTS generation_loras (
+            generation_id INTEGER NOT NULL REFERENCES generations(id) ON DELETE CASCADE,
+            filename TEXT NOT NULL,
+            weight REAL
+        );
+        CREATE INDEX IF NOT EXISTS generation_loras_filename ON generation_loras(filename);
+        CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(
+            original_prompt, styled_prompt, negative_prompt,
+            content='generations', content_rowid='id'
+        );
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            connection.executescript(self.SCHEMA)
+            self.connection = connection
+        return self.connection
+
+    def _insert(self, connection, path: str, metadata: dict, image_id: Optional[str], mtime: Optional[float]) -> bool:
+        created_at = metadata.get("generation_time")
+        try:
+            created_ts = datetime.fromisoformat(created_at).timestamp()
+        except (TypeError, ValueError):
+            created_ts = mtime
+            created_at = datetime.fromtimestamp(mtime).isoformat() if mtime is not None else None
+        style = metadata.get("style_applied")
+        try:
+            loras = json.loads(metadata.get("loras") or "[]")
+        except ValueError:
+            loras = []
+        try:
+            guidance_scale = float(metadata["guidance_scale"])
+        except (KeyError, ValueError):
+            guidance_scale = None
+        cursor = connection.execute(
+            """INSERT OR IGNORE INTO generations (
+                image_id, path, created_at, created_ts, mode, original_prompt, styled_prompt,
+                negative_prompt, style, sampler, seed, guidance_scale, num_inference_steps,
+                width, height, model, loras, metadata
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                image_id, path, created_at, created_ts, metadata.get("mode", "txt2img"),
+                metadata.get("original_prompt"), metadata.get("styled_prompt", metadata.get("modified_prompt")),
+                metadata.get("negative_prompt"), None if style in (None, "none") else style,
+                normalize_sampler(metadata.get("sampler")), parse_int(metadata.get("seed")), guidance_scale,
+                parse_int(metadata.get("num_inference_steps")), parse_int(metadata.get("width")),
+                parse_int(metadata.get("height")), metadata.get("model"), json.dumps(loras), json.dumps(metadata)
+            )
+        )
+        if cursor.rowcount == 0:
+            return False
+        row_id = cursor.lastrowid
+        # External-content FTS rows must mirror the generations row exactly
+        connection.execute(
+            """INSERT INTO generations_fts(rowid, original_prompt, styled_prompt, negative_prompt)
+               SELECT id, original_prompt, styled_prompt, negative_prompt FROM generations WHERE id = ?""",
+            (row_id,)
+        )
+        connection.executemany(
+            "INSERT INTO generation_loras (generation_id, filename, weight) VALUES (?, ?, ?)",
+            [(row_id, l.get("file"), l.get("weight")) for l in loras if isinstance(l, dict)]
+        )
+        return True
+
+    def record(self, path: str, metadata: dict, image_id: Optional[str] = None) -> None:
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                self._insert(connection, path, metadata, image_id, time.time())
+
+    def forget(self, paths) -> int:
+        """Drop the rows of deleted images; returns how many were removed"""
+        removed = 0
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                for path in paths:
+                    row = connection.execute(
+                        "SELECT id, original_prompt, styled_prompt, negative_prompt FROM generations WHERE path = ?",
+                        (path,)
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    # External-content FTS rows are removed with the values they were indexed with
+                    connection.execute(
+                        """INSERT INTO generations_fts(generations_fts, rowid, original_prompt, styled_prompt, negative_prompt)
+                           VALUES ('delete', ?, ?, ?, ?)""",
+                        tuple(row)
+                    )
+                    connection.execute("DELETE FROM generations WHERE id = ?", (row["id"],))
+                    removed += 1
+        return removed
+
+    def import_directories(self, directories: List[str], recursive: bool = True) -> dict:
+        """Index every PNG with generation metadata under the given directories.
+
+        Files whose real path (after symlinks) is outside HISTORY_IMPORT_ROOTS are skipped.
+        """
+        start = time.perf_counter()
+        stats = {"scanned": 0, "imported": 0, "skipped": 0, "errors": 0}
+        pattern = os.path.join("**", "*.png") if recursive else "*.png"
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                for directory in directories:
+                    for path in glob.iglob(os.path.join(directory, pattern), recursive=recursive):
+                        stats["scanned"] += 1
+                        if not within_import_roots(path):
+                            stats["skipped"] += 1
+                            continue
+                        try:
+                            with open(path, "rb") as f:
+                                metadata = read_png_text_chunks(f)
+                        except (OSError, ValueError, zlib.error):
+                            stats["errors"] += 1
+                            continue
+                        if "seed" not in metadata and "original_prompt" not in metadata:
+                            stats["skipped"] += 1
+                            continue
+                        stem = os.path.splitext(os.path.basename(path))[0]
+                        image_id = stem if IMAGE_ID_PATTERN.match(stem) else None
+                        path = os.path.abspath(path)
+                        if self._insert(connection, path, metadata, image_id, os.path.getmtime(path)):
+                            stats["imported"] += 1
+                        else:
+                            stats["skipped"] += 1
+        stats["seconds"] = round(time.perf_counter() - start, 3)
+        return stats
+
+    def search(self, query: Optional[str] = None, style: Optional[str] = None, sampler: Optional[str] = None,
+               model: Optional[str] = None, lora: Optional[str] = None, seed_min: Optional[int] = None,
+               seed_max: Optional[int] = None, since: Optional[datetime] = None, until: Optional[datetime] = None,
+               limit: int = 50, offset: int = 0) -> dict:
+        conditions, params = [], []
+        joins = ""
+        if query:
+            joins += " JOIN generations_fts ON generations_fts.rowid = g.id"
+            conditions.append("generations_fts MATCH ?")
+            params.append(query)
+        for column, value in (("style", style), ("sampler", sampler), ("model", model)):
+            if value is not None:
+                conditions.append(f"g.{column} = ?")
+                params.append(value)
+        if lora:
+            conditions.append("g.id IN (SELECT generation_id FROM generation_loras WHERE filename = ?)")
+            params.append(lora)
+        if seed_min is not None:
+            conditions.append("g.seed >= ?")
+            params.append(seed_min)
+        if seed_max is not None:
+            conditions.append("g.seed <= ?")
+            params.append(seed_max)
+        if since is not None:
+            conditions.append("g.created_ts >= ?")
+            params.append(since.timestamp())
+        if until is not None:
+            conditions.append("g.created_ts <= ?")
+            params.append(until.timestamp())
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = "bm25(generations_fts), g.created_ts DESC" if query else "g.created_ts DESC"
+
+        with self.lock:
+            connection = self._connect()
+            total = connection.execute(f"SELECT COUNT(*) FROM generations g{joins}{where}", params).fetchone()[0]
+            rows = connection.execute(
+                f"""SELECT g.image_id, g.path, g.created_at, g.mode, g.original_prompt, g.styled_prompt,
+                           g.negative_prompt, g.style, g.sampler, g.seed, g.guidance_scale,
+                           g.num_inference_steps, g.width, g.height, g.model, g.loras
+                    FROM generations g{joins}{where} ORDER BY {order} LIMIT ? OFFSET ?""",
+                params + [limit, offset]
+            ).fetchall()
+        results = []
+        for row in rows:
+            result = dict(row)
+            result["loras"] = json.loads(result["loras"] or "[]")
+            results.append(result)
+        return {"total": total, "limit": limit, "offset": offset, "results": results}
+
+history_index = HistoryIndex(HISTORY_DB_PATH)
+
+def load_stored_latents(image_id: str) -> Optional[torch.Tensor]:
+    """Final latents saved with a stored image; None for uploads and upscaled images"""
+    path = os.path.join(OUTPUT_DIR, f"{image_id}.latents.safetensors")
+    if not IMAGE_ID_PATTERN.match(image_id) or not os.path.exists(path):
+        return None
+    return load_safetensors(path)["latents"]
+
+def stored_image_path(image_id: str) -> str:
+    if not IMAGE_ID_PATTERN.match(image_id):
+        raise HTTPException(status_code=400, detail=f"Invalid image id '{image_id}'")
+    path = os.path.join(OUTPUT_DIR, f"{image_id}.png")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"Image '{image_id}' not found")
+    return path
+
+def load_source_image(image_id: Optional[str], image_b64: Optional[str]) -> bytes:
+    """Image bytes from the store or from a base64 upload"""
+    if bool(image_id) == bool(image_b64):
+        raise HTTPException(status_code=400, detail="Provide exactly one of image_id or image")
+    if image_id:
+        with open(stored_image_path(image_id), "rb") as f:
+            return f.read()
+    try:
+        data = base64.b64decode(image_b64, validate=True)
+        Image.open(BytesIO(data)).verify()
+    except Exception:
+        raise HTTPException(status_code=400, detail="image must be a base64 encoded PNG or JPEG")
+    return data
+
+# Approximate SDXL latent -> RGB projection, good enough for progress previews
+SDXL_LATENT_RGB_FACTORS = [
+    [0.3651, 0.4232, 0.4341],
+    [-0.2533, -0.0042, 0.1068],
+    [0.1076, 0.1111, -0.0362],
+    [-0.3165, -0.2492, -0.2188],
+]
+SDXL_LATENT_RGB_BIAS = [0.1084, -0.0175, -0.0011]
+
+preview_decoders = {}
+
+def get_preview_decoder(device, dtype):
+    """Load the tiny autoencoder once per device, or None when not installed"""
+    key = (str(device), dtype)
+    if key not in preview_decoders:
+        decoder = None
+        if os.path.exists(os.path.join(TAESD_PATH, "config.json")):
+            decoder = AutoencoderTiny.from_pretrained(TAESD_PATH, torch_dtype=dtype, local_files_only=True).to(device)
+        preview_decoders[key] = decoder
+    return preview_decoders[key]
+
+def latents_to_preview(latents: torch.Tensor, use_tiny_decoder: bool = True) -> bytes:
+    """Decode the first latent of a batch into a small JPEG frame"""
+    with torch.no_grad():
+        latent = latents[:1]
+        decoder = get_preview_decoder(latent.device, latent.dtype) if use_tiny_decoder else None
+        if decoder is not None:
+            rgb = decoder.decode(latent).sample[0]
+        else:
+            factors = torch.tensor(SDXL_LATENT_RGB_FACTORS, device=latent.device, dtype=latent.dtype)
+            bias = torch.tensor(SDXL_LATENT_RGB_BIAS, device=latent.device, dtype=latent.dtype)
+            rgb = torch.einsum("chw,cr->rhw", latent[0], factors) + bias[:, None, None]
+        pixels = ((rgb.clamp(-1, 1) + 1) * 127.5).to(torch.uint8).permute(1, 2, 0).cpu().numpy()
+
+    buffered = BytesIO()
+    Image.fromarray(pixels).save(buffered, format="JPEG", quality=PREVIEW_JPEG_QUALITY)
+    return buffered.getvalue()
+
+# Previews are decoded off the denoising thread; a single worker keeps frames in order
+preview_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview")
+
+class PreviewCallback:
+    """Pipeline step-end callback that emits a preview every `every` steps.
+
+    The step only snapshots the first latent; decoding, the copy to the host
+    and JPEG encoding run on preview_executor, so denoising does not wait for
+    them. A preview step is skipped while the previous frame is still being
+    decoded, so a slow decoder lowers the frame rate instead of queueing work.
+    """
+
+    def __init__(self, on_preview, image_index: int, every: int, total_steps: int):
+        self.on_preview = on_preview
+        self.image_index = image_index
+        self.every = every
+        self.total_steps = total_steps
+        self.pending = None  # Future of the frame being decoded
+
+    def __call__(self, pipe, step, timestep, callback_kwargs):
+        done = step + 1
+        if done % self.every == 0 and done < self.total_steps:
+            if self.pending is None or self.pending.done():
+                latents = callback_kwargs["latents"][:1].detach().clone()
+                self.pending = preview_executor.submit(self._emit, done, latents)
+        return callback_kwargs
+
+    def _emit(self, step: int, latents: torch.Tensor) -> None:
+        try:
+            self.on_preview(self.image_index, step, self.total_steps, latents_to_preview(latents))
+        except Exception as e:
+            print(f"Failed to render preview at step {step}: {e}")
+
+    def wait(self) -> None:
+        """Block until the last frame has been emitted, so it precedes the result"""
+        if self.pending is not None:
+            concurrent.futures.wait([self.pending])
+
+def capture_latents_callback(captured: list, inner=None):
+    """Step-end callback that keeps the most recent latents, optionally chaining another callback"""
+    def callback(pipe, step, timestep, callback_kwargs):
+        captured[:] = [callback_kwargs["latents"]]
+        if inner is not None:
+            return inner(pipe, step, timestep, callback_kwargs)
+        return callback_kwargs
+    return callback
+
+def resolve_upscale(width: int, height: int, target_width: Optional[int], target_height: Optional[int],
+                    tile_size: int, tile_overlap: int, strength: float) -> Optional[dict]:
+    """Upscale options for a spec, keeping the aspect ratio when one side is omitted"""
+    if not target_width and not target_height:
+        return None
+    if not target_width:
+        target_width = round(width * target_height / height)
+    if not target_height:
+        target_height = round(height * target_width / width)
+    # The VAE works on multiples of 8 pixels
+    target_width, target_height = target_width // 8 * 8, target_height // 8 * 8
+    if target_width < width or target_height < height:
+        raise HTTPException(status_code=400, detail=f"Target size {target_width}x{target_height} is smaller than {width}x{height}")
+    if max(target_width, target_height) > MAX_UPSCALE_SIZE:
+        raise HTTPException(status_code=400, detail=f"Target size is limited to {MAX_UPSCALE_SIZE} pixels per side")
+    if tile_overlap * 2 >= tile_size:
+        raise HTTPException(status_code=400, detail="tile_overlap must be less than half of tile_size")
+    return {
+        "width": target_width,
+        "height": target_height,
+        "tile_size": tile_size // 8 * 8,
+        "tile_overlap": tile_overlap,
+        "strength": strength
+    }
+
+# img2img views over the loaded text-to-image pipelines, sharing all their modules
+img2img_pipelines = weakref.WeakKeyDictionary()
+
+def get_img2img_pipeline(pipe) -> StableDiffusionXLImg2ImgPipeline:
+    if not is_torch_pipeline(pipe):
+        raise ValueError("Image-to-image stages need a PyTorch SDXL pipeline")
+    img2img = img2img_pipelines.get(pipe)
+    if img2img is None:
+        img2img = StableDiffusionXLImg2ImgPipeline(**pipe.components)
+        img2img.set_progress_bar_config(disable=True)
+        img2img_pipelines[pipe] = img2img
+    img2img.scheduler = pipe.scheduler
+    return img2img
+
+def tile_origins(length: int, tile: int, overlap: int) -> List[int]:
+    """Tile start offsets covering [0, length) with at least `overlap` pixels shared"""
+    if length <= tile:
+        return [0]
+    return list(range(0, length - tile, tile - overlap)) + [length - tile]
+
+def feather_mask(width: int, height: int, overlap: int) -> np.ndarray:
+    """Blend weights that ramp up over the overlap so tile seams fade out"""
+    def ramp(length):
+        up = np.minimum(1.0, (np.arange(length) + 1) / (overlap + 1))
+        return np.minimum(up, up[::-1])
+    return np.outer(ramp(height), ramp(width)).astype(np.float32)[..., None]
+
+def upscale_image(pipe, image, spec: dict, seed: int, device: str, prompt_kwargs: dict):
+    """Resize to the target size, then refine overlapping tiles with img2img and blend them"""
+    options = spec["upscale"]
+    width, height = options["width"], options["height"]
+    upscaled = image.convert("RGB").resize((width, height), Image.LANCZOS)
+    img2img = get_img2img_pipeline(pipe)
+
+    tile_width, tile_height = min(options["tile_size"], width), min(options["tile_size"], height)
+    overlap = options["tile_overlap"]
+    boxes = [
+        (x, y, x + tile_width, y + tile_height)
+        for y in tile_origins(height, tile_height, overlap)
+        for x in tile_origins(width, tile_width, overlap)
+    ]
+    mask = feather_mask(tile_width, tile_height, overlap)
+    canvas = np.zeros((height, width, 3), dtype=np.float32)
+    weights = np.zeros((height, width, 1), dtype=np.float32)
+
+    # Tiles in a batch denoise together; batches run one after another
+    for start in range(0, len(boxes), UPSCALE_TILE_BATCH):
+        batch = boxes[start:start + UPSCALE_TILE_BATCH]
+        output = img2img(
+            **prompt_kwargs,
+            image=[upscaled.crop(box) for box in batch],
+            strength=options["strength"],
+            num_inference_steps=spec["num_inference_steps"],
+            guidance_scale=spec["guidance_scale"],
+            num_images_per_prompt=len(batch),
+            generator=[torch.Generator(device=device).manual_seed(seed + start + i) for i in range(len(batch))],
+            output_type="np"
+        )
+        for (x0, y0, x1, y1), tile in zip(batch, output.images):
+            canvas[y0:y1, x0:x1] += tile * mask
+            weights[y0:y1, x0:x1] += mask
+    return Image.fromarray(np.clip(canvas / weights * 255 + 0.5, 0, 255).astype(np.uint8))
+
+# Square sides that resolutions are rounded up to when looking up a tuned batch size
+AUTOTUNE_BUCKETS = [512, 768, 1024, 1280, 1536, 2048, 3072, 4096]
+
+def resolution_bucket(width: int, height: int) -> int:
+    pixels = width * height
+    return next((side for side in AUTOTUNE_BUCKETS if side * side >= pixels), AUTOTUNE_BUCKETS[-1])
+
+def is_out_of_memory(error: Exception) -> bool:
+    if isinstance(error, torch.cuda.OutOfMemoryError):
+        return True
+    # CPU allocations fail with a plain RuntimeError
+    message = str(error).lower()
+    return isinstance(error, RuntimeError) and ("out of memory" in message or "can't allocate memory" in message)
+
+def device_fingerprint(device: str) -> str:
+    """Name and size of a device, so cached batch sizes are not reused on different hardware"""
+    if device.startswith("cuda"):
+        properties = torch.cuda.get_device_properties(torch.device(device))
+        return f"{properties.name} {properties.total_memory // 2**30}GB"
+    total_kb = 0
+    try:
+        with open("/proc/meminfo") as f:
+            total_kb = next(int(line.split()[1]) for line in f if line.startswith("MemTotal:"))
+    except (OSError, StopIteration):
+        pass
+    return f"cpu {total_kb // 2**20}GB"
+
+def memory_capacity(device: str) -> int:
+    """Bytes this process may use on the device: what it holds now plus what is free"""
+    if device.startswith("cuda"):
+        free, _ = torch.cuda.mem_get_info(torch.device(device))
+        return free + torch.cuda.memory_reserved(torch.device(device))
+    with open("/proc/meminfo") as f:
+        available_kb = next(int(line.split()[1]) for line in f if line.startswith("MemAvailable:"))
+    return available_kb * 1024 + int(process_memory().get("rss_mb", 0) * 2**20)
+
+def reset_peak_memory(device: str) -> bool:
+    """Start a new peak memory measurement; False if the device's peak cannot be reset"""
+    if device.startswith("cuda"):
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(torch.device(device))
+        return True
+    # Writing 5 to clear_refs resets the process's peak RSS (VmHWM) on Linux 4.0+
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_memory(device: str) -> int:
+    """Peak memory since the last successful reset_peak_memory"""
+    if device.startswith("cuda"):
+        return torch.cuda.max_memory_reserved(torch.device(device))
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmHWM:")) * 1024
+
+class BatchAutotuner:
+    """Largest safe batch size per device, model, memory profile, LoRA use and resolution bucket.
+
+    Sizes come from probing peak memory with short runs at increasing batch
+    sizes, or from out-of-memory errors seen while generating, and are saved
+    to a JSON file so a restart on the same hardware does not probe again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+        self.fingerprints = {}
+
+    def key(self, device: str, model: str, memory_profile: str, width: int, height: int, loras) -> str:
+        if device not in self.fingerprints:
+            self.fingerprints[device] = device_fingerprint(device)
+        bucket = resolution_bucket(width, height)
+        return f"{self.fingerprints[device]}|{model}|{memory_profile}|{bucket}x{bucket}|{'lora' if loras else 'base'}"
+
+    def batch_size(self, key: str) -> int:
+        with self.lock:
+            entry = self.entries.get(key)
+        return max(1, entry["batch_size"] if entry else DEFAULT_BATCH_SIZE)
+
+    def record(self, key: str, entry: dict) -> None:
+        with self.lock:
+            self.entries[key] = dict(entry, tuned_at=datetime.now().isoformat())
+            snapshot = json.dumps(self.entries, indent=2, sort_keys=True)
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # Replicas share the file, so replace it atomically
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, "w") as f:
+                f.write(snapshot)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            print(f"Failed to save batch autotune cache: {e}")
+
+    def record_oom(self, key: str, failed_batch: int) -> int:
+        """Lower a bucket's size after an out-of-memory error and return the size to retry with"""
+        retry = max(1, failed_batch // 2)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or entry["batch_size"] > retry:
+            self.record(key, {"batch_size": retry, "source": "oom", "failed_batch": failed_batch})
+        return retry
+
+    def probe(self, pipe, device: str, key: str, width: int, height: int) -> dict:
+        """Find the largest batch whose peak memory stays within AUTOTUNE_MEMORY_FRACTION of the device"""
+        capacity = memory_capacity(device)
+        peaks = {}
+        best = 1
+        batch = 1
+        while batch <= AUTOTUNE_MAX_BATCH:
+            if not reset_peak_memory(device):
+                raise HTTPException(status_code=501, detail=f"Peak memory cannot be measured on {device} here "
+                                    "(/proc/self/clear_refs is not writable); autotuning is unsupported")
+            try:
+                pipe(
+                    prompt="autotune",
+                    num_inference_steps=AUTOTUNE_STEPS,
+                    width=width,
+                    height=height,
+                    num_images_per_prompt=batch,
+                    generator=torch.Generator(device=device).manual_seed(0)
+                )
+            except Exception as e:
+                if not is_out_of_memory(e):
+                    raise
+                reset_peak_memory(device)
+                peaks[batch] = None
+                break
+            peaks[batch] = round(peak_memory(device) / 2**20, 1)
+            if peaks[batch] * 2**20 > capacity * AUTOTUNE_MEMORY_FRACTION:
+                break
+            best = batch
+            batch *= 2
+        entry = {"batch_size": best, "source": "probe", "peak_mb": peaks, "capacity_mb": round(capacity / 2**20, 1)}
+        self.record(key, entry)
+        print(f"Autotuned batch size {best} for {key} (peaks {peaks})")
+        return entry
+
+    def status(self) -> dict:
+        with self.lock:
+            return {"path": self.path, "default_batch_size": DEFAULT_BATCH_SIZE, "entries": dict(self.entries)}
+
+batch_autotuner = BatchAutotuner(AUTOTUNE_CACHE_PATH)
+
+def autotune(model_name: str, memory_profile: MemoryProfile, width: int, height: int,
+             loras: Optional[List[dict]] = None, force: bool = False) -> dict:
+    """Probe (or look up) the batch size for one bucket on this process's device"""
+    bucket = resolution_bucket(width, height)
+    key = batch_autotuner.key(DEVICE, model_name, memory_profile.value, width, height, loras)
+    with batch_autotuner.lock:
+        cached = batch_autotuner.entries.get(key)
+    if cached is not None and cached.get("source") == "probe" and not force:
+        return {"key": key, **cached}
+    with pipeline_lock:
+        pipe = model_registry.get(model_name)
+        # Loaded in place for the probe and unloaded afterwards, as render_locally does
+        try:
+            if loras:
+                load_loras(pipe, [LoraConfig(**l) for l in loras])
+            apply_memory_profile(pipe, memory_profile)
+            return {"key": key, **batch_autotuner.probe(pipe, DEVICE, key, bucket, bucket)}
+        finally:
+            if loras:
+                pipe.unload_lora_weights()
+
+def run_startup_autotune():
+    """Tune the default model at every quality preset's resolution, reusing cached results"""
+    if worker_pool is not None:
+        # Replicas learn their sizes from out-of-memory errors on their own devices
+        return
+    require_component("sdxl_pipeline")
+    for settings in QUALITY_PRESETS.values():
+        autotune(DEFAULT_MODEL, DEFAULT_MEMORY_PROFILE, settings["width"], settings["height"])
+
+def run_generation(request: GenerationRequest, on_preview=None) -> GenerationResponse:
+    """Render the images for a generation request"""
+    require_component("sdxl_pipeline")
+    rewrite_request_prompts(request)
+    return _run_generation(request, on_preview)
+
+def render_images(pipe, spec: dict, device: str, on_preview=None) -> dict:
+    """Denoise one image per seed in the spec; shared by local and replica rendering.
+
+    Returns the images and, for PyTorch pipelines, each image's final latents
+    (on CPU) so later img2img stages can skip the VAE encode.
+    """
+    base_config = base_scheduler_configs.setdefault(pipe, pipe.scheduler.config)
+    pipe.scheduler = get_scheduler(SamplerType(spec["sampler"]), base_config, few_steps=spec["few_step_scheduler"])
+
+    # Encode the prompts once per request, reusing cached embeddings across requests
+    if is_torch_pipeline(pipe) and getattr(pipe, "tokenizer", None) is not None:
+        lora_key = json.dumps(spec["loras"], sort_keys=True)
+        prompt_kwargs = get_prompt_embeddings(pipe, spec["model"], lora_key, spec["prompt"], spec["negative_prompt"])
+    else:
+        prompt_kwargs = {"prompt": spec["prompt"], "negative_prompt": spec["negative_prompt"]}
+
+    # Stages on an existing image start from its stored latents or its pixels (one source per spec)
+    if spec.get("img2img"):
+        denoiser = get_img2img_pipeline(pipe)
+        source_latents = (spec.get("source_latents") or [None])[0]
+        if source_latents is not None:
+            init = {"image": source_latents.unsqueeze(0).to(device=device, dtype=pipe.unet.dtype)}
+        else:
+            init = {"image": Image.open(BytesIO(spec["source_images"][0])).convert("RGB")}
+        init["strength"] = spec["img2img"]["strength"]
+    else:
+        denoiser = pipe
+        init = {"width": spec["width"], "height": spec["height"]}
+
+    # Seeds denoise together in micro-batches, each seed with its own generator. The size is
+    # the spec's batch_size or the autotuned one; an out-of-memory error halves it and retries.
+    autotune_key = batch_autotuner.key(device, spec["model"], spec["memory_profile"], spec["width"], spec["height"], spec["loras"])
+    batch_size = spec.get("batch_size") or batch_autotuner.batch_size(autotune_key)
+    if not is_torch_pipeline(pipe) or spec.get("source_images") and not spec.get("img2img"):
+        batch_size = 1
+    seeds = spec["seeds"]
+    images = []
+    latents = []
+    start = 0
+    while start < len(seeds):
+        batch = seeds[start:start + batch_size]
+        if spec.get("source_images") and not spec.get("img2img"):
+            # Upscaling an existing image skips denoising entirely
+            images.append(Image.open(BytesIO(spec["source_images"][0])))
+            latents.append(None)
+            start += 1
+            continue
+        generators = [torch.Generator(device=device).manual_seed(seed) for seed in batch]
+        captured = []
+        preview = None
+        if is_torch_pipeline(pipe):
+            if on_preview is not None:
+                preview = PreviewCallback(on_preview, start, spec["preview_every"], spec["num_inference_steps"])
+            prompt_kwargs["callback_on_step_end"] = capture_latents_callback(captured, preview)
+        try:
+            output = denoiser(
+                **prompt_kwargs,
+                **init,
+                guidance_scale=spec["guidance_scale"],
+                generator=generators if len(batch) > 1 else generators[0],
+                num_images_per_prompt=len(batch),
+                num_inference_steps=spec["num_inference_steps"]
+            )
+        except Exception as e:
+            if len(batch) == 1 or not is_out_of_memory(e):
+                raise
+            captured.clear()
+            reset_peak_memory(device)
+            batch_size = batch_autotuner.record_oom(autotune_key, len(batch))
+            print(f"Out of memory with a batch of {len(batch)} on {device}, retrying with {batch_size}")
+            continue
+        finally:
+            if preview is not None:
+                preview.wait()
+        images.extend(output.images)
+        latents.extend(captured[0][i].detach().cpu() if captured else None for i in range(len(batch)))
+        start += len(batch)
+
+    if spec.get("upscale"):
+        prompt_kwargs.pop("callback_on_step_end", None)
+        images = [
+            upscale_image(pipe, image, spec, seed, device, prompt_kwargs)
+            for image, seed in zip(images, spec["seeds"])
+        ]
+        # The tiles were refined separately, so no latents describe the whole image
+        latents = [None] * len(images)
+    return {"images": images, "latents": latents}
+
+def dispatch_render(spec: dict, on_preview=None) -> dict:
+    """Render a spec on a worker replica or, without a pool, in this process"""
+    # Replicas run in other processes and do not stream previews
+    if worker_pool is not None:
+        return worker_pool.render(spec, timeout=WORKER_RENDER_TIMEOUT)
+    with pipeline_lock:
+        return render_locally(spec, on_preview)
+
+def render_locally(spec: dict, on_preview=None) -> dict:
+    """Render a spec with this process's pipelines; caller holds pipeline_lock"""
+    pipe = model_registry.get(spec["model"])
+
+    # LoRAs are loaded into the shared pipeline for this render only; pipeline_lock keeps others out meanwhile
+    try:
+        if spec["loras"]:
+            load_loras(pipe, [LoraConfig(**l) for l in spec["loras"]])
+
+        # Switch memory profile if the request asks for a different one
+        apply_memory_profile(pipe, MemoryProfile(spec["memory_profile"]))
+
+        rendered = render_images(pipe, spec, DEVICE, on_preview)
+    finally:
+        if spec["loras"]:
+            pipe.unload_lora_weights()
+    return {**rendered, "device": str(pipe.device)}
+
+def _run_generation(request: GenerationRequest, on_preview=None) -> GenerationResponse:
+    settings = resolve_generation_settings(request)
+    num_inference_steps = settings["num_inference_steps"]
+
+    # Resolve the requested model
+    model_name = request.model or DEFAULT_MODEL
+    try:
+        model_path = model_registry.model_path(model_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    memory_profile = request.memory_profile or DEFAULT_MEMORY_PROFILE
+
+    # Store original prompt before any modification
+    original_prompt = request.prompt
+
+    # Apply styles if specified, trimmed to fit the CLIP token budget
+    styled = apply_request_styles(request.prompt, request.negative_prompt, request.style_name, request.style_names)
+    final_prompt = styled["prompt"]
+    negative_prompt = styled["negative_prompt"]
+    style_applied = ", ".join(styled["styles"]) or None
+    if style_applied:
+        print(f"Applied styles '{style_applied}': '{request.prompt}' -> '{final_prompt}' ({styled['fragments_dropped']} fragments trimmed)")
+
+    # Generate seeds
+    seeds = []
+    if request.seed is not None:
+        seeds = [request.seed] + [random.randint(0, 2**32 - 1) for _ in range(request.num_images - 1)]
+    else:
+        seeds = [random.randint(0, 2**32 - 1) for _ in range(request.num_images)]
+
+    # Everything needed to render, in a picklable form for worker replicas
+    spec = {
+        "model": model_name,
+        "prompt": final_prompt,
+        "negative_prompt": negative_prompt,
+        "guidance_scale": request.guidance_scale,
+        "sampler": request.sampler.value,
+        "few_step_scheduler": settings["few_step_scheduler"],
+        "num_inference_steps": num_inference_steps,
+        "width": settings["width"],
+        "height": settings["height"],
+        "memory_profile": memory_profile.value,
+        "seeds": seeds,
+        "loras": [{"filename": l.filename, "weight": l.weight} for l in request.loras] if request.loras else None,
+        "preview_every": getattr(request, "preview_every", None),
+        "upscale": resolve_upscale(
+            settings["width"], settings["height"], request.target_width, request.target_height,
+            request.tile_size, request.tile_overlap, request.upscale_strength
+        ),
+    }
+
+    rendered = dispatch_render(spec, on_preview)
+    scheduler_type = SCHEDULER_CLASSES[request.sampler].__name__
+
+    # Convert to base64 with metadata
+    images = []
+    image_ids = []
+    for seed, image, latents in zip(seeds, rendered["images"], rendered["latents"]):
+        metadata = {
+            # Generation parameters
+            "original_prompt": original_prompt,
+            "styled_prompt": final_prompt,
+            "style_applied": style_applied or "none",
+            "negative_prompt": negative_prompt or "",
+            "sampler": str(request.sampler),
+            "guidance_scale": str(request.guidance_scale),
+            "seed": str(seed),
+            "num_inference_steps": str(num_inference_steps),
+            "quality": settings["quality"].value,
+            "width": str(settings["width"]),
+            "height": str(settings["height"]),
+            "memory_profile": memory_profile.value,
+        }
+        if spec["upscale"]:
+            metadata["upscale"] = json.dumps(spec["upscale"])
+
+        # LoRA information
+        if request.loras:
+            metadata["loras"] = json.dumps([
+                {"file": l.filename, "weight": l.weight}
+                for l in request.loras
+            ])
+
+        # Model information
+        metadata["model"] = model_name
+        metadata["model_path"] = model_path
+        metadata["model_type"] = "SDXL"
+        metadata["scheduler_type"] = scheduler_type
+
+        # System information
+        metadata["torch_version"] = torch.__version__
+        metadata["device"] = rendered["device"]
+        metadata["generation_time"] = datetime.now().isoformat()
+
+        png = png_with_metadata(image, metadata)
+        image_ids.append(store_image(png, latents))
+        images.append(base64.b64encode(png).decode())
+
+    return GenerationResponse(
+        images=images,
+        seeds=seeds,
+        image_ids=image_ids,
+        parameters={
+            "original_prompt": original_prompt,
+            "styled_prompt": final_prompt,
+            "style_applied": style_applied,
+            "styles": styled["styles"],
+            "style_fragments_dropped": styled["fragments_dropped"],
+            "negative_prompt": negative_prompt,
+            "sampler": request.sampler,
+            "guidance_scale": request.guidance_scale,
+            "num_inference_steps": num_inference_steps,
+            "quality": settings["quality"],
+            "width": settings["width"],
+            "height": settings["height"],
+            "memory_profile": memory_profile,
+            "model": model_name,
+            "scheduler_type": scheduler_type,
+            "upscale": spec["upscale"],
+            "loras": [{"file": l.filename, "weight": l.weight} for l in request.loras] if request.loras else None
+        }
+    )
+
+def run_upscale(request: UpscaleRequest) -> GenerationResponse:
+    """Upscale one existing image with the tiled img2img stage"""
+    require_component("sdxl_pipeline")
+    rewrite_request_prompts(request)
+    source = load_source_image(request.image_id, request.image)
+    source_image = Image.open(BytesIO(source))
+    source_metadata = dict(getattr(source_image, "text", {}))
+    width, height = source_image.size
+
+    model_name = request.model or source_metadata.get("model") or DEFAULT_MODEL
+    try:
+        model_path = model_registry.model_path(model_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not request.target_width and not request.target_height:
+        target_width, target_height = round(width * request.scale), round(height * request.scale)
+    else:
+        target_width, target_height = request.target_width, request.target_height
+    upscale = resolve_upscale(width, height, target_width, target_height,
+                              request.tile_size, request.tile_overlap, request.strength)
+
+    # Reuse the prompts the image was generated with unless new ones are given
+    prompt = request.prompt if request.prompt is not None else source_metadata.get("styled_prompt", "")
+    negative_prompt = request.negative_prompt if request.negative_prompt is not None else source_metadata.get("negative_prompt", "")
+    seed = request.seed if request.seed is not None else random.randint(0, 2**32 - 1)
+    spec = {
+        "model": model_name,
+        "prompt": prompt,
+        "negative_prompt": negative_prompt,
+        "guidance_scale": request.guidance_scale,
+        "sampler": request.sampler.value,
+        "few_step_scheduler": False,
+        "num_inference_steps": request.num_inference_steps,
+        "width": width,
+        "height": height,
+        "memory_profile": DEFAULT_MEMORY_PROFILE.value,
+        "seeds": [seed],
+        "loras": None,
+        "preview_every": None,
+        "source_images": [source],
+        "upscale": upscale,
+    }
+    rendered = dispatch_render(spec)
+
+    metadata = {
+        **source_metadata,
+        "styled_prompt": prompt,
+        "negative_prompt": negative_prompt or "",
+        "upscaled_from": request.image_id or "upload",
+        "upscale": json.dumps(upscale),
+        "upscale_seed": str(seed),
+        "upscale_sampler": str(request.sampler),
+        "width": str(upscale["width"]),
+        "height": str(upscale["height"]),
+        "model": model_name,
+        "model_path": model_path,
+        "device": rendered["device"],
+        "generation_time": datetime.now().isoformat()
+    }
+    png = png_with_metadata(rendered["images"][0], metadata)
+    return GenerationResponse(
+        images=[base64.b64encode(png).decode()],
+        seeds=[seed],
+        image_ids=[store_image(png)],
+        parameters={
+            "source": request.image_id or "upload",
+            "source_size": [width, height],
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "sampler": request.sampler,
+            "guidance_scale": request.guidance_scale,
+            "num_inference_steps": request.num_inference_steps,
+            "model": model_name,
+            "upscale": upscale
+        }
+    )
+
+SINGLEFLIGHT_REQUESTS = Counter(
+    "diffusion_singleflight_requests_total",
+    "Generation requests by single-flight outcome: leader renders, coalesced awaits a leader",
+    ["outcome"]
+)
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key so they share one result"""
+
+    def __init__(self):
+        self.in_flight = {}  # key -> asyncio.Task
+
+    async def run(self, key: str, fn):
+        task = self.in_flight.get(key)
+        if task is not None:
+            SINGLEFLIGHT_REQUESTS.labels(outcome="coalesced").inc()
+        else:
+            SINGLEFLIGHT_REQUESTS.labels(outcome="leader").inc()
+            task = asyncio.create_task(fn())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        # Every caller, the leader included, shields the shared task so a disconnect cannot cancel it
+        return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        # Mark retrieved so an exception whose callers all went away is not logged as lost
+        if not task.cancelled():
+            task.exception()
+
+generation_singleflight = SingleFlight()
+
+def canonical_request_key(request: GenerationRequest) -> str:
+    """Hash the validated generation parameters independent of field order"""
+    payload = json.dumps(request.dict(), sort_keys=True, default=str)
+    return hashlib.sha256(f"{type(request).__name__}:{payload}".encode()).hexdigest()
+
+async def generate_coalesced(request: GenerationRequest) -> GenerationResponse:
+    """Run a generation, sharing the result with identical in-flight requests.
+
+    Only requests with an explicit seed are coalesced: without one, every
+    request is expected to produce different images.
+    """
+    if request.seed is None:
+        return await asyncio.to_thread(run_generation, request)
+    return await generation_singleflight.run(
+        canonical_request_key(request),
+        lambda: asyncio.to_thread(run_generation, request)
+    )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if worker_pool is not None:
+        worker_pool.stop()
+
+@app.post("/v1/generate", response_model=GenerationResponse)
+async def generate_images(request: GenerationRequest):
+    try:
+        return await generate_coalesced(request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/v1/generate/stream")
+async def generate_images_stream(request: StreamGenerationRequest):
+    """Generate images, streaming approximate previews as Server-Sent Events.
+
+    Emits `preview` events (base64 JPEG of the current latents every
+    `preview_every` steps), then a single `result` event carrying the normal
+    generation response, or an `error` event.
+    """
+    require_component("sdxl_pipeline")
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def on_preview(image_index: int, step: int, total_steps: int, frame: bytes):
+        loop.call_soon_threadsafe(events.put_nowait, ("preview", {
+            "image_index": image_index,
+            "step": step,
+            "total_steps": total_steps,
+            "image": base64.b64encode(frame).decode()
+        }))
+
+    async def produce():
+        try:
+            result = await asyncio.to_thread(run_generation, request, on_preview)
+            await events.put(("result", jsonable_encoder(result)))
+        except HTTPException as e:
+            await events.put(("error", {"status_code": e.status_code, "detail": e.detail}))
+        except Exception as e:
+            await events.put(("error", {"status_code": 500, "detail": str(e)}))
+        finally:
+            await events.put(None)
+
+    async def stream():
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                item = await events.get()
+                if item is None:
+                    break
+                event, data = item
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            await producer
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+@app.post("/v1/refine", response_model=GenerationResponse)
+async def refine_image(request: RefineRequest):
+    """Re-render a seed picked from a draft generation at full quality.
+
+    Pass the draft's prompt, style, sampler, LoRAs and seed unchanged. The
+    seed is rendered at the draft's resolution with the standard tier's steps
+    and scheduler, so it starts from the same noise and keeps the draft's
+    composition with more detail. Use target_width/target_height to upscale
+    the result. quality and num_inference_steps cannot be overridden.
+    """
+    try:
+        return await generate_coalesced(request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def estimate_sweep_cost(cells: int, steps: int, width: int, height: int) -> float:
+    """Sweep cost in 1024x1024 denoising steps; UNet time scales with steps and pixel count"""
+    return round(cells * steps * width * height / (1024 * 1024), 1)
+
+def build_contact_sheet(rows: List[List[Image.Image]], labels: List[str], columns: List[str], thumbnail_size: int) -> Image.Image:
+    """Stitch thumbnails into a grid with a label above each row and column"""
+    sample = rows[0][0]
+    scale = thumbnail_size / max(sample.width, sample.height)
+    cell_width, cell_height = round(sample.width * scale), round(sample.height * scale)
+    label_height, padding = 14, 4
+    sheet = Image.new(
+        "RGB",
+        (padding + len(columns) * (cell_width + padding), padding + label_height + len(rows) * (label_height + cell_height + padding)),
+        "white"
+    )
+    draw = ImageDraw.Draw(sheet)
+    for column, text in enumerate(columns):
+        draw.text((padding + column * (cell_width + padding), padding), text, fill="black")
+    for row, (images, label) in enumerate(zip(rows, labels)):
+        top = padding + label_height + row * (label_height + cell_height + padding)
+        draw.text((padding, top), label, fill="black")
+        for column, image in enumerate(images):
+            sheet.paste(image.convert("RGB").resize((cell_width, cell_height), Image.LANCZOS),
+                        (padding + column * (cell_width + padding), top + label_height))
+    return sheet
+
+def run_sweep(request: SweepRequest) -> SweepResponse:
+    """Render every combination of the sweep axes and stitch them into a contact sheet.
+
+    Each sampler/style/guidance row is one spec, so the scheduler is built and
+    the (styled) prompt encoded once per row, with embeddings shared between
+    rows through the embedding cache. Within a row the seeds denoise together
+    in batches of SWEEP_BATCH_SIZE, or the autotuned size when it is 0.
+    """
+    settings = resolve_generation_settings(request)
+    num_inference_steps = settings["num_inference_steps"]
+    seeds = request.seeds or [random.randint(0, 2**32 - 1) for _ in range(request.num_seeds)]
+    rows = list(itertools.product(request.samplers, request.styles, request.guidance_scales))
+    cost = estimate_sweep_cost(len(rows) * len(seeds), num_inference_steps, settings["width"], settings["height"])
+    if cost > SWEEP_MAX_COST:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Sweep of {len(rows) * len(seeds)} images costs {cost} 1024x1024 steps, over the budget of {SWEEP_MAX_COST}; "
+                   f"use fewer seeds or axis values, fewer steps or the draft quality"
+        )
+    cells = [
+        SweepCell(row=row, column=column, seed=seed, guidance_scale=guidance_scale, sampler=sampler, style=style)
+        for row, (sampler, style, guidance_scale) in enumerate(rows)
+        for column, seed in enumerate(seeds)
+    ]
+    parameters = {
+        "prompt": request.prompt,
+        "negative_prompt": request.negative_prompt,
+        "seeds": seeds,
+        "guidance_scales": request.guidance_scales,
+        "samplers": request.samplers,
+        "styles": request.styles,
+        "num_inference_steps": num_inference_steps,
+        "quality": settings["quality"],
+        "width": settings["width"],
+        "height": settings["height"],
+        "batch_size": SWEEP_BATCH_SIZE or "auto",
+    }
+    if request.estimate_only:
+        return SweepResponse(cells=cells, estimated_cost=cost, max_cost=SWEEP_MAX_COST, parameters=parameters)
+
+    require_component("sdxl_pipeline")
+    rewrite_request_prompts(request)
+    parameters.update(prompt=request.prompt, negative_prompt=request.negative_prompt)
+    model_name = request.model or DEFAULT_MODEL
+    try:
+        model_path = model_registry.model_path(model_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    memory_profile = request.memory_profile or DEFAULT_MEMORY_PROFILE
+    loras = [{"filename": l.filename, "weight": l.weight} for l in request.loras] if request.loras else None
+    styled = {style: apply_request_styles(request.prompt, request.negative_prompt, style, None) for style in request.styles}
+    sweep_id = uuid.uuid4().hex
+
+    start = time.perf_counter()
+    sheet_rows, labels = [], []
+    for row, (sampler, style, guidance_scale) in enumerate(rows):
+        spec = {
+            "model": model_name,
+            "prompt": styled[style]["prompt"],
+            "negative_prompt": styled[style]["negative_prompt"],
+            "guidance_scale": guidance_scale,
+            "sampler": sampler.value,
+            "few_step_scheduler": settings["few_step_scheduler"],
+            "num_inference_steps": num_inference_steps,
+            "width": settings["width"],
+            "height": settings["height"],
+            "memory_profile": memory_profile.value,
+            "seeds": seeds,
+            "batch_size": SWEEP_BATCH_SIZE or None,
+            "loras": loras,
+            "preview_every": None,
+            "upscale": None,
+        }
+        rendered = dispatch_render(spec)
+        for column, (seed, image, latents) in enumerate(zip(seeds, rendered["images"], rendered["latents"])):
+            metadata = {
+                "mode": "sweep",
+                "sweep_id": sweep_id,
+                "original_prompt": request.prompt,
+                "styled_prompt": spec["prompt"],
+                "style_applied": style or "none",
+                "negative_prompt": spec["negative_prompt"] or "",
+                "sampler": str(sampler),
+                "guidance_scale": str(guidance_scale),
+                "seed": str(seed),
+                "num_inference_steps": str(num_inference_steps),
+                "quality": settings["quality"].value,
+                "width": str(settings["width"]),
+                "height": str(settings["height"]),
+                "model": model_name,
+                "model_path": model_path,
+                "model_type": "SDXL",
+                "scheduler_type": SCHEDULER_CLASSES[sampler].__name__,
+                "device": rendered["device"],
+                "generation_time": datetime.now().isoformat()
+            }
+            if loras:
+                metadata["loras"] = json.dumps([{"file": l["filename"], "weight": l["weight"]} for l in loras])
+            cells[row * len(seeds) + column].image_id = store_image(png_with_metadata(image, metadata), latents)
+        sheet_rows.append(rendered["images"])
+        labels.append(f"{sampler.value} / {style or 'no style'} / cfg {guidance_scale}")
+
+    sheet = build_contact_sheet(sheet_rows, labels, [f"seed {seed}" for seed in seeds], request.thumbnail_size)
+    png = png_with_metadata(sheet, {
+        "mode": "contact_sheet",
+        "sweep_id": sweep_id,
+        "original_prompt": request.prompt,
+        "sweep": json.dumps(jsonable_encoder(parameters)),
+        "cells": json.dumps([cell.image_id for cell in cells]),
+    })
+    parameters.update(model=model_name, sweep_id=sweep_id, seconds=round(time.perf_counter() - start, 3))
+    return SweepResponse(
+        contact_sheet=base64.b64encode(png).decode(),
+        contact_sheet_id=store_image(png),
+        cells=cells,
+        estimated_cost=cost,
+        max_cost=SWEEP_MAX_COST,
+        parameters=parameters
+    )
+
+@app.post("/v1/sweep", response_model=SweepResponse)
+async def sweep_endpoint(request: SweepRequest):
+    """Explore a prompt over seeds x guidance scales x samplers x styles in one call.
+
+    Returns a stitched contact sheet (one row per sampler/style/guidance, one
+    column per seed) and the image_id of every cell. Sweeps whose estimated
+    cost exceeds SWEEP_MAX_COST are rejected; set estimate_only to check first.
+    """
+    try:
+        return await asyncio.to_thread(run_sweep, request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def run_image_to_image(request: ImageToImageRequest, mode: str) -> GenerationResponse:
+    """Img2img or variations of an existing image, sharing the loaded SDXL modules"""
+    require_component("sdxl_pipeline")
+    rewrite_request_prompts(request)
+    source = load_source_image(request.image_id, request.image)
+    source_image = Image.open(BytesIO(source))
+    source_metadata = dict(getattr(source_image, "text", {}))
+    # Stored latents skip the VAE encode; uploads are encoded by the pipeline
+    source_latents = load_stored_latents(request.image_id) if request.image_id else None
+    width, height = source_image.size
+
+    model_name = request.model or source_metadata.get("model") or DEFAULT_MODEL
+    try:
+        model_path = model_registry.model_path(model_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Without a new prompt, restyle the source's own prompt: its styled prompt would get the styles twice.
+    # The source's styles carry over unless the request names its own.
+    style_name, style_names = request.style_name, request.style_names
+    source_styles = [s for s in source_metadata.get("style_applied", "none").split(", ") if s and s != "none"]
+    if request.prompt:
+        original_prompt = request.prompt
+    elif "original_prompt" in source_metadata and all(s in AVAILABLE_STYLES for s in source_styles):
+        original_prompt = source_metadata["original_prompt"]
+        if not style_name and not style_names:
+            style_names = source_styles
+    else:
+        # Uploads from elsewhere, or styles no longer installed: keep the final text as it was
+        original_prompt = source_metadata.get("styled_prompt", "")
+    negative_prompt = request.negative_prompt if request.negative_prompt is not None else source_metadata.get("negative_prompt", "")
+    styled = apply_request_styles(original_prompt, negative_prompt, style_name, style_names)
+    final_prompt = styled["prompt"]
+    negative_prompt = styled["negative_prompt"]
+
+    # Variations keep the source's LoRAs unless the request names its own
+    loras = [{"filename": l.filename, "weight": l.weight} for l in request.loras] if request.loras else None
+    if loras is None and mode == "variation" and source_metadata.get("loras"):
+        loras = [{"filename": l["file"], "weight": l["weight"]} for l in json.loads(source_metadata["loras"])]
+
+    if request.seed is not None:
+        seeds = [request.seed] + [random.randint(0, 2**32 - 1) for _ in range(request.num_images - 1)]
+    else:
+        seeds = [random.randint(0, 2**32 - 1) for _ in range(request.num_images)]
+
+    spec = {
+        "model": model_name,
+        "prompt": final_prompt,
+        "negative_prompt": negative_prompt,
+        "guidance_scale": request.guidance_scale,
+        "sampler": request.sampler.value,
+        "few_step_scheduler": False,
+        "num_inference_steps": request.num_inference_steps,
+        "width": width,
+        "height": height,
+        "memory_profile": DEFAULT_MEMORY_PROFILE.value,
+        "seeds": seeds,
+        "loras": loras,
+        "preview_every": None,
+        "source_images": [source],
+        "source_latents": [source_latents] if source_latents is not None else None,
+        "img2img": {"strength": request.strength},
+        "upscale": None,
+    }
+    rendered = dispatch_render(spec)
+    scheduler_type = SCHEDULER_CLASSES[request.sampler].__name__
+    init = "latents" if source_latents is not None else "vae_encode"
+
+    images = []
+    image_ids = []
+    for seed, image, latents in zip(seeds, rendered["images"], rendered["latents"]):
+        metadata = {
+            "mode": mode,
+            "original_prompt": original_prompt,
+            "styled_prompt": final_prompt,
+            "style_applied": ", ".join(styled["styles"]) or "none",
+            "negative_prompt": negative_prompt or "",
+            "sampler": str(request.sampler),
+            "guidance_scale": str(request.guidance_scale),
+            "seed": str(seed),
+            "num_inference_steps": str(request.num_inference_steps),
+            "strength": str(request.strength),
+            "source_image": request.image_id or "upload",
+            "init": init,
+            "width": str(image.width),
+            "height": str(image.height),
+            "model": model_name,
+            "model_path": model_path,
+            "model_type": "SDXL",
+            "scheduler_type": scheduler_type,
+            "torch_version": torch.__version__,
+            "device": rendered["device"],
+            "generation_time": datetime.now().isoformat()
+        }
+        if loras:
+            metadata["loras"] = json.dumps([{"file": l["filename"], "weight": l["weight"]} for l in loras])
+        png = png_with_metadata(image, metadata)
+        image_ids.append(store_image(png, latents))
+        images.append(base64.b64encode(png).decode())
+
+    return GenerationResponse(
+        images=images,
+        seeds=seeds,
+        image_ids=image_ids,
+        parameters={
+            "mode": mode,
+            "source": request.image_id or "upload",
+            "init": init,
+            "original_prompt": original_prompt,
+            "styled_prompt": final_prompt,
+            "styles": styled["styles"],
+            "style_fragments_dropped": styled["fragments_dropped"],
+            "negative_prompt": negative_prompt,
+            "sampler": request.sampler,
+            "guidance_scale": request.guidance_scale,
+            "num_inference_steps": request.num_inference_steps,
+            # Only this many denoising steps actually run
+            "denoising_steps": int(request.num_inference_steps * request.strength),
+            "strength": request.strength,
+            "model": model_name,
+            "scheduler_type": scheduler_type,
+            "loras": [{"file": l["filename"], "weight": l["weight"]} for l in loras] if loras else None
+        }
+    )
+
+@app.post("/v1/img2img", response_model=GenerationResponse)
+async def img2img_endpoint(request: Img2ImgRequest):
+    """Re-render a previous generation (by image_id) or an uploaded image towards a new prompt.
+
+    Stored images start from their saved latents, uploads from a VAE encode;
+    either way only the last `strength` fraction of the schedule runs.
+    """
+    try:
+        return await asyncio.to_thread(run_image_to_image, request, "img2img")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/v1/variations", response_model=GenerationResponse)
+async def variations_endpoint(request: VariationsRequest):
+    """Variations of an image: same prompt, LoRAs and model, new seeds, partial schedule"""
+    try:
+        return await asyncio.to_thread(run_image_to_image, request, "variation")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/v1/upscale", response_model=GenerationResponse)
+async def upscale_endpoint(request: UpscaleRequest):
+    """Upscale a previous generation (by image_id) or an uploaded image.
+
+    The image is resized to the target size, then refined in overlapping
+    tiles with img2img at the given strength and blended back together, so
+    peak memory depends on the tile size rather than the output size.
+    """
+    try:
+        return await asyncio.to_thread(run_upscale, request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/v1/history")
+async def search_history(
+    q: Optional[str] = None,
+    style: Optional[str] = None,
+    sampler: Optional[SamplerType] = None,
+    model: Optional[str] = None,
+    lora: Optional[str] = None,
+    seed_min: Optional[int] = None,
+    seed_max: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    offset: int = Query(default=0, ge=0)
+):
+    """Search past generations.
+
+    `q` is an SQLite FTS5 query over the original, styled and negative
+    prompts (e.g. `lighthouse AND sunset`, `"oil painting"`, `cyber*`);
+    results are ranked by relevance when given, otherwise newest first.
+    """
+    try:
+        return await asyncio.to_thread(
+            history_index.search, q, style, sampler.value if sampler else None, model, lora,
+            seed_min, seed_max, since, until, limit, offset
+        )
+    except sqlite3.OperationalError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid history query: {e}")
+
+def within_import_roots(path: str) -> bool:
+    """Whether path resolves, after symlinks, to somewhere inside one of HISTORY_IMPORT_ROOTS"""
+    real = os.path.realpath(path)
+    for root in HISTORY_IMPORT_ROOTS:
+        root = os.path.realpath(root)
+        if real == root or real.startswith(root + os.sep):
+            return True
+    return False
+
+@app.post("/v1/history/import")
+async def import_history(request: HistoryImportRequest):
+    """Index existing PNG folders under HISTORY_IMPORT_ROOTS by reading their metadata chunks (pixels are not decoded)"""
+    outside = [d for d in request.directories if not within_import_roots(d)]
+    if outside:
+        raise HTTPException(status_code=403, detail=f"Imports are limited to {', '.join(HISTORY_IMPORT_ROOTS)}")
+    missing = [d for d in request.directories if not os.path.isdir(d)]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Not a directory: {', '.join(missing)}")
+    return await asyncio.to_thread(history_index.import_directories, request.directories, request.recursive)
+
+def analyze_prompts(request: PromptAnalyzeRequest) -> PromptAnalyzeResponse:
+    require_component("clip_tokenizer")
+    # Styles are assembled as generation would, trimmed to the budget being analyzed
+    assembled = [
+        apply_request_styles(p, None, request.style_name, request.style_names, request.max_tokens)
+        for p in request.prompts
+    ]
+    styled = [a["prompt"] for a in assembled]
+
+    # Room left for content once BOS/EOS are counted
+    limit = request.max_tokens - 2
+    results = []
+    for prompt, text, a, (ids, offsets) in zip(request.prompts, styled, assembled, tokenize_prompts(styled)):
+        overflow = max(0, len(ids) - limit)
+        cut = offsets[limit][0] if overflow else len(text)
+        results.append(PromptAnalysis(
+            prompt=prompt,
+            styled_prompt=text,
+            style_fragments_dropped=a["fragments_dropped"],
+            token_count=len(ids) + 2,
+            max_tokens=request.max_tokens,
+            fits=overflow == 0,
+            overflow_tokens=overflow,
+            overflow_token_index=limit if overflow else None,
+            overflow_char_offset=cut if overflow else None,
+            truncated_prompt=text[:cut].rstrip(),
+            overflow_text=text[cut:].strip(),
+            windows=max(1, math.ceil(len(ids) / (MAX_TOKENS - 2))),
+            would_rewrite=PROMPT_MODE == PromptMode.REWRITE and len(ids) + 2 > MAX_TOKENS
+        ))
+    return PromptAnalyzeResponse(prompt_mode=PROMPT_MODE, results=results)
+
+@app.post("/v1/prompt/analyze", response_model=PromptAnalyzeResponse, operation_id="analyze_prompts")
+async def analyze_prompts_endpoint(request: PromptAnalyzeRequest):
+    """Count CLIP tokens for a batch of prompts before generating.
+
+    Optionally applies a stack of styles first. For each prompt, returns the token count,
+    where it overflows the limit, and the text CLIP would actually see.
+    Use this to keep prompts within budget and avoid the T5 rewrite.
+    """
+    return analyze_prompts(request)
+
+@app.get("/v1/health")
+async def health_check():
+    return {"status": "healthy", "model_loaded": component_status["sdxl_pipeline"]["state"] == "ready"}
+
+@app.get("/v1/memory")
+async def memory_usage():
+    """Report this process's memory, including the share of mapped weights"""
+    return {
+        "pid": os.getpid(),
+        "mmap_weights": MMAP_WEIGHTS and DEVICE == "cpu",
+        "process": process_memory(),
+        "load_seconds": {
+            name: status["seconds"]
+            for name, status in component_status.items()
+            if name in ("prompt_rewriter", "sdxl_pipeline")
+        }
+    }
+
+@app.get("/v1/workers")
+async def list_workers():
+    """Report worker replicas, their health and utilization"""
+    if worker_pool is None:
+        return {"enabled": False, "replicas": []}
+    return {"enabled": True, **worker_pool.status()}
+
+@app.get("/v1/embedding-cache")
+async def embedding_cache_status():
+    """Report text-encoder embedding cache usage and hit rate"""
+    return embedding_cache.status()
+
+@app.get("/v1/ready")
+async def readiness_check():
+    """Report the load state and timing of every startup component"""
+    ready = all(status["state"] == "ready" for status in component_status.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "components": component_status,
+            "startup_seconds": startup_timings["total_seconds"]
+        }
+    )
+
+def get_available_loras():
+    """List available LoRA files"""
+    lora_path = os.path.join(os.path.dirname(MODEL_PATH), "loras")
+    if not os.path.exists(lora_path):
+        return []
+    return [f for f in os.listdir(lora_path) if f.endswith('.safetensors')]
+
+@app.get("/v1/loras")
+async def list_loras():
+    """Endpoint to list available LoRAs"""
+    return {"loras": get_available_loras()}
+
+def load_loras(pipeline, lora_configs: List[LoraConfig]):
+    """Load and apply LoRA weights"""
+    available_loras = get_available_loras()
+    for lora in lora_configs:
+        if lora.filename not in available_loras:
+            raise HTTPException(
+                status_code=400, 
+                detail=f"LoRA file {lora.filename} not found. Available: {available_loras}"
+            )
+        
+        lora_path = os.path.join(os.path.dirname(MODEL_PATH), "loras", lora.filename)
+        pipeline.load_lora_weights(lora_path, weight=lora.weight)
+    return pipeline 
+
+def get_available_models():
+    """List available models in the models directory"""
+    if not os.path.exists(MODELS_BASE_PATH):
+        return []
+    
+    models = []
+    for item in os.listdir(MODELS_BASE_PATH):
+        item_path = os.path.join(MODELS_BASE_PATH, item)
+        if os.path.isdir(item_path):
+            # Check if it's a diffusers format model (has model_index.json)
+            if os.path.exists(os.path.join(item_path, "model_index.json")):
+                models.append(item)
+    return models
+
+@app.get("/v1/models")
+async def list_models():
+    """Endpoint to list available models"""
+    return {
+        "models": get_available_models(),
+        "current_model": DEFAULT_MODEL,
+        "registry": model_registry.status()
+    }
+
+@app.get("/v1/samplers")
+async def list_samplers():
+    """Endpoint to list available samplers"""
+    return {
+        "samplers": [
+            {
+                "name": sampler.value,
+                "type": sampler.name,
+                "description": {
+                    "dpm solver ++": "DPM-Solver++: Fast with good quality",
+                    "euler a": "Euler Ancestral: Good for creative variations",
+                    "ddim": "DDIM: Deterministic, good for consistency"
+                }.get(sampler.value, "")
+            }
+            for sampler in SamplerType
+        ],
+        "quality_tiers": {
+            tier.value: {
+                "num_inference_steps": preset["num_inference_steps"],
+                "width": preset["width"],
+                "height": preset["height"]
+            }
+            for tier, preset in QUALITY_PRESETS.items()
+        },
+        "num_inference_steps_range": [MIN_INFERENCE_STEPS, MAX_INFERENCE_STEPS]
+    }
+
+@app.get("/v1/memory-profiles")
+async def list_memory_profiles():
+    """Endpoint to list memory profiles and their tradeoffs"""
+    return {
+        "profiles": [
+            {"name": profile.value, **config}
+            for profile, config in MEMORY_PROFILES.items()
+        ],
+        "default": DEFAULT_MEMORY_PROFILE.value,
+        "device": DEVICE
+    }
+
+@app.get("/v1/backend")
+async def get_backend():
+    """Report the inference backend with per-model load time and parity results"""
+    return backend_status
+
+@app.get("/v1/autotune")
+async def get_autotune():
+    """Report the cached batch size per device, model, memory profile, LoRA use and resolution bucket"""
+    return batch_autotuner.status()
+
+def run_autotune(request: AutotuneRequest) -> dict:
+    require_component("sdxl_pipeline")
+    if worker_pool is not None:
+        raise HTTPException(status_code=409, detail="Worker replicas tune their batch sizes from out-of-memory errors")
+    model_name = request.model or DEFAULT_MODEL
+    try:
+        model_registry.model_path(model_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if request.width or request.height:
+        sizes = [(request.width or request.height, request.height or request.width)]
+    else:
+        sizes = [(settings["width"], settings["height"]) for settings in QUALITY_PRESETS.values()]
+    loras = [{"filename": l.filename, "weight": l.weight} for l in request.loras] if request.loras else None
+    memory_profile = request.memory_profile or DEFAULT_MEMORY_PROFILE
+    return {"results": [autotune(model_name, memory_profile, w, h, loras, request.force) for w, h in sizes]}
+
+@app.post("/v1/autotune")
+async def autotune_endpoint(request: AutotuneRequest):
+    """Probe peak memory at increasing batch sizes and cache the largest safe one.
+
+    Generation splits num_images into micro-batches of the tuned size for the
+    request's resolution bucket. Probing runs short generations and holds the
+    pipeline meanwhile.
+    """
+    try:
+        return await asyncio.to_thread(run_autotune, request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/v1/styles")
+async def list_styles():
+    """Endpoint to list all available SDXL styles"""
+    if not AVAILABLE_STYLES:
+        return {"styles": [], "total": 0}
+    
+    styles_list = []
+    for name, style in AVAILABLE_STYLES.items():
+        styles_list.append({
+            "name": style.name,
+            "has_prompt_template": bool(style.prompt and '{prompt}' in style.prompt),
+            "has_negative_prompt": bool(style.negative_prompt),
+            "source_file": style.source_file,
+            "preview_prompt": style.prompt[:100] + "..." if style.prompt and len(style.prompt) > 100 else style.prompt
+        })
+    
+    return {
+        "styles": sorted(styles_list, key=lambda x: x["name"]),
+        "total": len(styles_list)
+    }
+
+@app.get("/v1/styles/{style_name}")
+async def get_style(style_name: str):
+    """Get details for a specific style"""
+    if style_name not in AVAILABLE_STYLES:
+        raise HTTPException(status_code=404, detail=f"Style '{style_name}' not found")
     
     style = AVAILABLE_STYLES[style_name]
     return {
@@ -572,4 +3745,10 @@ async def suggest_styles_endpoint(request: StyleSuggestionRequest):
         request.max_suggestions
     )
     
-    return StyleSuggestionResponse(suggestions=suggestions) 
\ No newline at end of file
+    return StyleSuggestionResponse(suggestions=suggestions) 
+
+# Initialize FastAPI-MCP after every route is defined, so all endpoints become tools
+mcp = FastApiMCP(app)
+
+# Mount the MCP server to make endpoints available as tools
+mcp.mount()
@@ -56,6 +56,18 @@ def download_tokenizers():
         print(f"❌ Error downloading tokenizers: {e}")
         raise
 
+def download_taesd():
+    """Download the tiny SDXL autoencoder used for live previews"""
+    print("📥 Downloading TAESD-XL preview decoder...")
+    os.makedirs("models/taesdxl", exist_ok=True)
+    snapshot_download(
+        repo_id="madebyollin/taesdxl",
+        local_dir="models/taesdxl",
+        local_dir_use_symlinks=False,
+        resume_download=True,
+    )
+    print("✅ TAESD-XL downloaded!")
+
 def main():
     """Main download function"""
     print("🚀 Starting optimized model download...")
@@ -68,6 +80,9 @@ def main():
         
         # Download tokenizers
         download_tokenizers()
+
+        # Download the preview decoder (a few MB)
+        download_taesd()
         
         print("-" * 50)
         print("🎉 All models downloaded successfully!")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Compare inference backends against eager mode.
+
+Builds a fresh pipeline per backend, applies it with the same code the API
+uses, and reports first-call time (which includes compilation), steady-state
+latency and image parity with eager mode. The tiny CPU pipeline is used by
+default; pass --model-path for a real SDXL checkpoint, which is also required
+for the onnx backend.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "app"))
+sys.path.insert(0, HERE)
+
+import torch
+import main as api
+from tiny_pipeline import build_tiny_sdxl_pipeline, tiny_prompt_kwargs
+
+def build_pipeline(backend: api.InferenceBackend, model_path: str):
+    """Fresh pipeline with the backend applied, plus the kwargs to call it with"""
+    if backend == api.InferenceBackend.ONNX:
+        return api.load_onnx_pipeline(os.path.basename(model_path.rstrip("/")), model_path), {"prompt": "a lighthouse on a cliff at sunset"}
+    if model_path:
+        from diffusers import StableDiffusionXLPipeline
+        pipe = StableDiffusionXLPipeline.from_pretrained(model_path, torch_dtype=api.TORCH_DTYPE, local_files_only=True)
+        call_kwargs = {"prompt": "a lighthouse on a cliff at sunset"}
+    else:
+        pipe = build_tiny_sdxl_pipeline(dtype=api.TORCH_DTYPE)
+        call_kwargs = {k: v.to(api.DEVICE) for k, v in tiny_prompt_kwargs(dtype=api.TORCH_DTYPE).items()}
+    pipe = pipe.to(api.DEVICE)
+    if backend != api.InferenceBackend.EAGER:
+        api.apply_inference_backend(pipe, backend)
+    return pipe, call_kwargs
+
+def render(pipe, call_kwargs: dict, steps: int, size: int):
+    output = pipe(num_inference_steps=steps, width=size, height=size, output_type="np",
+                  generator=torch.Generator(device=api.DEVICE).manual_seed(0), **call_kwargs)
+    return output.images[0]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark diffusion-api inference backends')
+    parser.add_argument('--backends', nargs='+', default=None, help='Backends to measure (default: eager compile int8, plus onnx with --model-path)')
+    parser.add_argument('--model-path', default=None, help='Diffusers SDXL directory; defaults to the tiny CPU pipeline')
+    parser.add_argument('--steps', type=int, default=8, help='Inference steps per run')
+    parser.add_argument('--size', type=int, default=None, help='Image width and height')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed runs per backend')
+
+    args = parser.parse_args()
+    size = args.size or (1024 if args.model_path else 64)
+    backends = args.backends or ["eager", "compile", "int8"] + (["onnx"] if args.model_path else [])
+
+    reference = None
+    print(f"Compile cache: {api.COMPILE_CACHE_DIR}\n")
+    print("| backend | device | first call (s) | latency (s) | PSNR vs eager (dB) | mean abs error |")
+    print("|---|---|---|---|---|---|")
+    for name in ["eager"] + [b for b in backends if b != "eager"]:
+        backend = api.InferenceBackend(name)
+        try:
+            pipe, call_kwargs = build_pipeline(backend, args.model_path)
+            start = time.perf_counter()
+            image = render(pipe, call_kwargs, args.steps, size)
+            first_call = time.perf_counter() - start
+            timings = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                render(pipe, call_kwargs, args.steps, size)
+                timings.append(time.perf_counter() - start)
+        except Exception as e:
+            print(f"| {name} | failed: {e} | | | | |")
+            continue
+        if reference is None:
+            reference = image
+        parity = api.image_similarity(reference, image)
+        if name in backends:
+            print(f"| {name} | {api.DEVICE} | {first_call:.3f} | {statistics.median(timings):.3f} | "
+                  f"{parity['psnr_db']} | {parity['mean_abs_error']} |")
+
+if __name__ == "__main__":
+    main()
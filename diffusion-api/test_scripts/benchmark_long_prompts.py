@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Compare the T5 rewrite path with chunked CLIP encoding for long prompts.
+
+Each mode runs in its own process. Both load the SDXL text encoders from
+--model-path; the rewrite mode also loads the T5 rewriter. Reports model load
+time, unique memory (USS) once everything is loaded, latency from prompt to
+embeddings, and how many of the prompt's CLIP tokens reach the encoders.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "app"))
+
+LONG_PROMPTS = [
+    "a sprawling cyberpunk night market under heavy rain, neon signs in japanese and english reflecting "
+    "on wet asphalt, street food stalls with steaming bowls of ramen, crowds in translucent raincoats, "
+    "drones carrying packages overhead, holographic koi fish swimming between buildings, a lone detective "
+    "in a long coat looking at the camera, cinematic lighting, shallow depth of field, 35mm film grain, "
+    "ultra detailed, volumetric fog, teal and orange color grading",
+    "an ancient library carved into the inside of a giant tree, spiral staircases made of living roots, "
+    "thousands of leather bound books glowing faintly, fireflies drifting between the shelves, a reading "
+    "nook with a velvet armchair and a sleeping cat, warm candle light, dust particles in sunbeams coming "
+    "through knot holes, intricate wood carvings of forest animals, fantasy concept art, painterly style, "
+    "highly detailed, golden hour, (moss covered bark:1.3), (glowing runes:1.2)",
+    "portrait of an elderly fisherwoman with deep wrinkles and kind eyes, wearing a hand knitted wool "
+    "sweater and a yellow oilskin hat, standing on a wooden pier at dawn, fishing nets and buoys behind "
+    "her, seagulls in the distance, soft overcast light, shot on medium format film, 80mm lens, natural "
+    "skin texture, subtle smile, muted color palette, documentary photography, award winning",
+]
+
+def load_text_encoders(api, model_path: str):
+    from types import SimpleNamespace
+    from transformers import CLIPTokenizer, CLIPTextModel, CLIPTextModelWithProjection
+    pipe = SimpleNamespace(
+        tokenizer=CLIPTokenizer.from_pretrained(model_path, subfolder="tokenizer"),
+        tokenizer_2=CLIPTokenizer.from_pretrained(model_path, subfolder="tokenizer_2"),
+        text_encoder=CLIPTextModel.from_pretrained(model_path, subfolder="text_encoder", torch_dtype=api.TORCH_DTYPE),
+        text_encoder_2=CLIPTextModelWithProjection.from_pretrained(model_path, subfolder="text_encoder_2", torch_dtype=api.TORCH_DTYPE),
+        _execution_device=api.DEVICE,
+    )
+    pipe.text_encoder.to(api.DEVICE)
+    pipe.text_encoder_2.to(api.DEVICE)
+    return pipe
+
+def run_mode(mode: str, model_path: str, prompts: list, repeats: int) -> dict:
+    """Load the models one mode needs and time prompt -> embeddings; runs in the child"""
+    import main as api
+
+    start = time.perf_counter()
+    pipe = load_text_encoders(api, model_path)
+    api.load_clip_tokenizer()
+    api.component_status["clip_tokenizer"]["state"] = "ready"
+    if mode == "rewrite":
+        api.load_prompt_rewriter()
+        api.component_status["prompt_rewriter"]["state"] = "ready"
+    load_seconds = time.perf_counter() - start
+    memory = api.process_memory()
+
+    timings, kept = [], []
+    for prompt in prompts:
+        original_tokens = len(api.tokenizer.encode(prompt))
+        for _ in range(repeats):
+            start = time.perf_counter()
+            text = api.rewrite_prompt(prompt)
+            api.encode_prompt_chunked(pipe, text)
+            timings.append(time.perf_counter() - start)
+        kept.append(min(1.0, len(api.tokenizer.encode(text)) / original_tokens))
+    return {
+        "mode": mode,
+        "load_s": round(load_seconds, 2),
+        "uss_mb": memory.get("uss_mb"),
+        "latency_ms": round(statistics.median(timings) * 1000, 1),
+        "tokens_kept": f"{statistics.mean(kept):.0%}",
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark long-prompt handling: T5 rewrite vs chunked CLIP')
+    parser.add_argument('--model-path', default="/app/models/sdxl/base", help='Diffusers SDXL directory with text encoders')
+    parser.add_argument('--prompts-file', default=None, help='File with one prompt per line (default: built-in long prompts)')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed runs per prompt')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    prompts = LONG_PROMPTS
+    if args.prompts_file:
+        with open(args.prompts_file) as f:
+            prompts = [line.strip() for line in f if line.strip()]
+
+    if args.child:
+        print(json.dumps(run_mode(args.child, args.model_path, prompts, args.repeats)))
+        return
+
+    print("| mode | load (s) | USS (MB) | latency per prompt (ms) | tokens kept |")
+    print("|---|---|---|---|---|")
+    for mode in ("rewrite", "chunked"):
+        cmd = [sys.executable, __file__, "--child", mode, "--model-path", args.model_path, "--repeats", str(args.repeats)]
+        if args.prompts_file:
+            cmd += ["--prompts-file", args.prompts_file]
+        completed = subprocess.run(cmd, capture_output=True, text=True, env=dict(os.environ, PROMPT_MODE=mode))
+        if completed.returncode != 0:
+            print(f"| {mode} | failed: {completed.stderr.strip().splitlines()[-1]} | | | |")
+            continue
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        print(f"| {result['mode']} | {result['load_s']} | {result['uss_mb']} | {result['latency_ms']} | {result['tokens_kept']} |")
+
+if __name__ == "__main__":
+    main()
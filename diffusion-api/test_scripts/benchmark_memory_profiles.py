@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Measure latency and peak memory for each memory profile.
+
+Every profile runs in a fresh subprocess so peak RSS is not polluted by the
+previous run. On CPU the tiny pipeline from tiny_pipeline.py is used; pass
+--model-path to benchmark a real SDXL checkpoint on GPU instead.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+def run_profile(profile_name: str, model_path: str, steps: int, size: int, repeats: int) -> dict:
+    """Apply one profile and time generation; runs inside the child process"""
+    import torch
+    import main as api
+    from tiny_pipeline import build_tiny_sdxl_pipeline, tiny_prompt_kwargs
+
+    if model_path:
+        from diffusers import StableDiffusionXLPipeline
+        pipe = StableDiffusionXLPipeline.from_pretrained(model_path, torch_dtype=api.TORCH_DTYPE, local_files_only=True)
+        call_kwargs = {"prompt": "a lighthouse on a cliff at sunset"}
+    else:
+        pipe = build_tiny_sdxl_pipeline(dtype=api.TORCH_DTYPE)
+        call_kwargs = tiny_prompt_kwargs(dtype=api.TORCH_DTYPE)
+
+    api.apply_memory_profile(pipe, api.MemoryProfile(profile_name))
+    if api.DEVICE.startswith("cuda"):
+        torch.cuda.reset_peak_memory_stats()
+
+    # First call includes one-off allocations, report it separately
+    timings = []
+    for _ in range(repeats + 1):
+        start = time.perf_counter()
+        pipe(num_inference_steps=steps, width=size, height=size,
+             generator=torch.Generator(device=api.DEVICE).manual_seed(0), **call_kwargs)
+        timings.append(time.perf_counter() - start)
+
+    if api.DEVICE.startswith("cuda"):
+        peak_mb = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        # ru_maxrss is reported in kilobytes on Linux
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        "profile": profile_name,
+        "device": api.DEVICE,
+        "first_call_s": round(timings[0], 3),
+        "latency_s": round(min(timings[1:]), 3),
+        "peak_memory_mb": round(peak_mb, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark diffusion-api memory profiles')
+    parser.add_argument('--profiles', nargs='+', default=None, help='Profiles to measure (default: all)')
+    parser.add_argument('--model-path', default=None, help='Diffusers SDXL directory; defaults to the tiny CPU pipeline')
+    parser.add_argument('--steps', type=int, default=4, help='Inference steps per run')
+    parser.add_argument('--size', type=int, default=None, help='Image width and height')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed runs per profile')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    size = args.size or (1024 if args.model_path else 64)
+
+    if args.child:
+        print(json.dumps(run_profile(args.child, args.model_path, args.steps, size, args.repeats)))
+        return
+
+    profiles = args.profiles or ["full", "channels_last", "balanced", "low_vram", "minimal"]
+    print("| profile | device | first call (s) | latency (s) | peak memory (MB) |")
+    print("|---|---|---|---|---|")
+    for profile in profiles:
+        cmd = [sys.executable, __file__, "--child", profile, "--steps", str(args.steps),
+               "--size", str(size), "--repeats", str(args.repeats)]
+        if args.model_path:
+            cmd += ["--model-path", args.model_path]
+        completed = subprocess.run(cmd, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"| {profile} | failed: {completed.stderr.strip().splitlines()[-1]} | | | |")
+            continue
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        print(f"| {result['profile']} | {result['device']} | {result['first_call_s']} | "
+              f"{result['latency_s']} | {result['peak_memory_mb']} |")
+
+if __name__ == "__main__":
+    main()
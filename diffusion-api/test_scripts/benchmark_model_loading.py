@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Compare memory-mapped and copied model loading on CPU.
+
+For each mode, evicts the weights from the page cache (cold start), loads the
+model once, then starts --processes loaders side by side (warm start) and
+reports their load times and RSS/PSS/USS while all of them hold the model.
+With memory mapping the weights stay in the shared page cache, so PSS and USS
+per process should fall as processes are added. Uses a tiny pipeline saved to
+a temporary directory unless --model-path is given.
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "app"))
+sys.path.insert(0, HERE)
+
+def load_in_child(model_path: str):
+    """Load the model through the registry, report, then hold it until stdin closes"""
+    os.environ["DEVICE"] = "cpu"
+    import main as api
+
+    start = time.perf_counter()
+    registry = api.ModelRegistry(os.path.dirname(model_path), 1, "disk")
+    api.MODELS_BASE_PATH = os.path.dirname(model_path)
+    registry.get(os.path.basename(model_path))
+    load_seconds = time.perf_counter() - start
+    print(json.dumps({"pid": os.getpid(), "load_s": round(load_seconds, 3)}), flush=True)
+    sys.stdin.read()
+
+def evict_page_cache(model_path: str) -> None:
+    """Drop the model's files from the page cache without needing root"""
+    for path in glob.glob(os.path.join(model_path, "**", "*.safetensors"), recursive=True):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+def smaps_rollup(pid: int) -> dict:
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+def run_loaders(model_path: str, mmap_weights: bool, processes: int) -> list:
+    """Start loaders concurrently and measure them while all hold the model"""
+    env = dict(os.environ, MMAP_WEIGHTS="true" if mmap_weights else "false", OMP_NUM_THREADS="1")
+    children = [
+        subprocess.Popen([sys.executable, __file__, "--child", model_path],
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, text=True)
+        for _ in range(processes)
+    ]
+    reports = []
+    for child in children:
+        line = child.stdout.readline()
+        if not line:
+            raise RuntimeError("loader process exited before reporting")
+        reports.append(json.loads(line))
+    for report in reports:
+        report.update(smaps_rollup(report["pid"]))
+    for child in children:
+        child.stdin.close()
+        child.wait()
+    return reports
+
+def save_tiny_model(directory: str) -> str:
+    from tiny_pipeline import build_tiny_sdxl_pipeline
+    model_path = os.path.join(directory, "tiny")
+    build_tiny_sdxl_pipeline().save_pretrained(model_path, safe_serialization=True)
+    return model_path
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark memory-mapped vs copied model loading')
+    parser.add_argument('--model-path', default=None, help='Diffusers SDXL directory; defaults to a tiny saved pipeline')
+    parser.add_argument('--processes', type=int, default=2, help='Loader processes running side by side')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.child:
+        load_in_child(args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model_path or save_tiny_model(tmp)
+        print("| mode | start | processes | load (s) | RSS (MB) | PSS (MB) | USS (MB) |")
+        print("|---|---|---|---|---|---|---|")
+        for mmap_weights in (False, True):
+            mode = "mmap" if mmap_weights else "copy"
+            evict_page_cache(model_path)
+            runs = [("cold", run_loaders(model_path, mmap_weights, 1)),
+                    ("warm", run_loaders(model_path, mmap_weights, args.processes))]
+            for start, reports in runs:
+                avg = lambda key: sum(r[key] for r in reports) / len(reports)
+                print(f"| {mode} | {start} | {len(reports)} | {avg('load_s'):.3f} | "
+                      f"{avg('rss'):.1f} | {avg('pss'):.1f} | {avg('uss'):.1f} |")
+
+if __name__ == "__main__":
+    main()
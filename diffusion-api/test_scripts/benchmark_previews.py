@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Measure what live previews add to the denoise loop.
+
+Times the preview decoder on SDXL-sized latents (128x128 for a 1024px image),
+then runs the tiny CPU pipeline with and without the preview callback and
+reports the end-to-end overhead. Pass --model-path to use a real checkpoint.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "app"))
+sys.path.insert(0, HERE)
+
+import torch
+import main as api
+from tiny_pipeline import build_tiny_sdxl_pipeline, tiny_prompt_kwargs
+
+def time_decoder(latent_size: int, use_tiny_decoder: bool, repeats: int) -> float:
+    """Median milliseconds to turn one latent into a JPEG preview"""
+    latents = torch.randn(1, 4, latent_size, latent_size, dtype=api.TORCH_DTYPE, device=api.DEVICE)
+    api.latents_to_preview(latents, use_tiny_decoder)  # load decoder, warm caches
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        api.latents_to_preview(latents, use_tiny_decoder)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def time_pipeline(pipe, call_kwargs: dict, steps: int, size: int, preview_every: int, repeats: int):
+    """Median seconds for a full render and the number of previews emitted.
+
+    Frames are dropped while the previous one is still decoding, so the count
+    can be lower than steps / preview_every.
+    """
+    frames = []
+    def on_preview(image_index, step, total_steps, frame):
+        frames.append(len(frame))
+
+    timings = []
+    for _ in range(repeats + 1):
+        kwargs = dict(call_kwargs)
+        preview = None
+        if preview_every:
+            preview = api.PreviewCallback(on_preview, 0, preview_every, steps)
+            kwargs["callback_on_step_end"] = preview
+        start = time.perf_counter()
+        pipe(num_inference_steps=steps, width=size, height=size,
+             generator=torch.Generator(device=api.DEVICE).manual_seed(0), **kwargs)
+        if preview is not None:
+            # The render is not done for the client until the last frame is out
+            preview.wait()
+        timings.append(time.perf_counter() - start)
+    # Drop the first, warm-up run
+    return statistics.median(timings[1:]), len(frames) // (repeats + 1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark live preview overhead')
+    parser.add_argument('--model-path', default=None, help='Diffusers SDXL directory; defaults to the tiny CPU pipeline')
+    parser.add_argument('--steps', type=int, default=20, help='Inference steps per render')
+    parser.add_argument('--size', type=int, default=None, help='Image width and height')
+    parser.add_argument('--preview-every', type=int, default=5, help='Preview interval in steps')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed runs per configuration')
+
+    args = parser.parse_args()
+
+    print("Preview decode cost on a 128x128 latent:")
+    print(f"  linear projection: {time_decoder(128, False, 20):.2f} ms")
+    if api.get_preview_decoder(api.DEVICE, api.TORCH_DTYPE) is not None:
+        print(f"  tiny autoencoder:  {time_decoder(128, True, 20):.2f} ms")
+    else:
+        print(f"  tiny autoencoder:  not installed at {api.TAESD_PATH}")
+
+    if args.model_path:
+        from diffusers import StableDiffusionXLPipeline
+        pipe = StableDiffusionXLPipeline.from_pretrained(args.model_path, torch_dtype=api.TORCH_DTYPE, local_files_only=True)
+        pipe = pipe.to(api.DEVICE)
+        call_kwargs = {"prompt": "a lighthouse on a cliff at sunset"}
+        size = args.size or 1024
+    else:
+        pipe = build_tiny_sdxl_pipeline(dtype=api.TORCH_DTYPE).to(api.DEVICE)
+        call_kwargs = {k: v.to(api.DEVICE) for k, v in tiny_prompt_kwargs(dtype=api.TORCH_DTYPE).items()}
+        # The tiny VAE downsamples by 2, so 256px gives SDXL-sized 128x128 latents
+        size = args.size or 256
+
+    baseline, _ = time_pipeline(pipe, call_kwargs, args.steps, size, 0, args.repeats)
+    with_previews, frames = time_pipeline(pipe, call_kwargs, args.steps, size, args.preview_every, args.repeats)
+    overhead = (with_previews - baseline) / baseline * 100
+    print(f"\n{args.steps} steps at {size}px on {api.DEVICE}:")
+    print(f"  without previews: {baseline:.3f} s")
+    print(f"  with previews:    {with_previews:.3f} s ({frames} frames, {overhead:+.1f}%)")
+
+if __name__ == "__main__":
+    main()
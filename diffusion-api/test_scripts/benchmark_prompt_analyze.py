@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Measure prompt tokenization throughput in prompts per second.
+
+Compares the slow Python CLIPTokenizer (one prompt at a time, as the old
+rewrite path did), the Rust-backed fast tokenizer in batches, and the cached
+path used by /v1/prompt/analyze. Pass --url to also time the HTTP endpoint.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "app"))
+
+WORDS = ("portrait landscape cinematic lighting detailed castle forest neon city rain fog golden hour "
+         "oil painting watercolor 35mm film bokeh dramatic sky ancient ruins dragon spaceship ocean "
+         "sunset mountains reflection intricate ornate minimalist studio macro wide angle").split()
+
+def make_prompts(count: int, min_words: int, max_words: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))) for _ in range(count)]
+
+def throughput(fn, prompts: list, batch_size: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(prompts), batch_size):
+        fn(prompts[i:i + batch_size])
+    return len(prompts) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark prompt tokenization throughput')
+    parser.add_argument('--tokenizer-path', default="/app/models/tokenizers/clip", help='CLIP tokenizer directory')
+    parser.add_argument('--prompts', type=int, default=5000, help='Number of prompts')
+    parser.add_argument('--batch-size', type=int, default=64, help='Prompts per batch')
+    parser.add_argument('--url', default=None, help='Also benchmark POST {url}/v1/prompt/analyze')
+
+    args = parser.parse_args()
+    from transformers import CLIPTokenizer, CLIPTokenizerFast
+    import main as api
+
+    prompts = make_prompts(args.prompts, 10, 120)
+    slow = CLIPTokenizer.from_pretrained(args.tokenizer_path)
+    api.tokenizer = CLIPTokenizerFast.from_pretrained(args.tokenizer_path)
+
+    results = [
+        ("slow tokenizer, one at a time", throughput(lambda batch: [slow.encode(p) for p in batch], prompts, 1)),
+        ("fast tokenizer, one at a time", throughput(lambda batch: [api.tokenizer.encode(p) for p in batch], prompts, 1)),
+        (f"fast tokenizer, batches of {args.batch_size}",
+         throughput(lambda batch: api.tokenizer(batch, add_special_tokens=False, return_offsets_mapping=True), prompts, args.batch_size)),
+    ]
+    api.token_cache.clear()
+    results.append(("analyze path, cold cache", throughput(api.tokenize_prompts, prompts, args.batch_size)))
+    results.append(("analyze path, warm cache", throughput(api.tokenize_prompts, prompts, args.batch_size)))
+
+    if args.url:
+        import requests
+        def post(batch):
+            requests.post(f"{args.url}/v1/prompt/analyze", json={"prompts": batch}).raise_for_status()
+        results.append((f"HTTP endpoint, batches of {args.batch_size}", throughput(post, prompts, args.batch_size)))
+
+    print("| path | prompts/s |")
+    print("|---|---|")
+    for name, rate in results:
+        print(f"| {name} | {rate:,.0f} |")
+
+if __name__ == "__main__":
+    main()
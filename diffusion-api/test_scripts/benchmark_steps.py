@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import requests
+import argparse
+import time
+from typing import List
+
+SAMPLERS = ['dpm solver ++', 'euler a', 'ddim']
+
+def time_generation(url: str, prompt: str, sampler: str, steps: int, quality: str, seed: int) -> float:
+    """Time a single generation request in seconds"""
+    payload = {
+        "prompt": prompt,
+        "sampler": sampler,
+        "num_images": 1,
+        "seed": seed,
+        "num_inference_steps": steps,
+        "quality": quality,
+    }
+    start = time.perf_counter()
+    response = requests.post(url, json=payload)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+def benchmark(url: str, prompt: str, steps_list: List[int], quality: str, repeats: int, seed: int) -> None:
+    """Print a markdown table of latency vs steps for every sampler"""
+    # Warm up once so model loading and kernel selection are not measured
+    time_generation(url, prompt, SAMPLERS[0], min(steps_list), quality, seed)
+
+    header = "| steps | " + " | ".join(SAMPLERS) + " |"
+    print(f"\nLatency in seconds ({quality} quality, best of {repeats}):\n")
+    print(header)
+    print("|" + "---|" * (len(SAMPLERS) + 1))
+    for steps in steps_list:
+        row = []
+        for sampler in SAMPLERS:
+            timings = [time_generation(url, prompt, sampler, steps, quality, seed) for _ in range(repeats)]
+            row.append(f"{min(timings):.2f}")
+        print(f"| {steps} | " + " | ".join(row) + " |")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark latency vs inference steps per sampler')
+    parser.add_argument('--url', default="http://localhost:8000/v1/generate", help='Generate endpoint URL')
+    parser.add_argument('--prompt', default="a lighthouse on a cliff at sunset", help='Prompt to render')
+    parser.add_argument('--steps', type=int, nargs='+', default=[4, 8, 12, 20, 30, 50], help='Step counts to measure')
+    parser.add_argument('--quality', choices=['standard', 'draft'], default='standard', help='Quality tier')
+    parser.add_argument('--repeats', type=int, default=2, help='Runs per cell, the fastest is reported')
+    parser.add_argument('--seed', type=int, default=1234, help='Fixed seed for all runs')
+
+    args = parser.parse_args()
+
+    benchmark(args.url, args.prompt, args.steps, args.quality, args.repeats, args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Exercise the worker pool on CPU with tiny stand-in pipelines.
+
+Starts one replica process per --devices entry, fires concurrent renders
+through the dispatcher, optionally kills a replica mid-run to check failover,
+and prints throughput plus per-replica utilization.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "app"))
+sys.path.insert(0, HERE)
+
+import main as api
+
+def make_spec(index: int, steps: int, lora_sets: int) -> dict:
+    """Render spec in the shape produced by the generate endpoint"""
+    loras = None
+    if lora_sets:
+        loras = [{"filename": f"style_{index % lora_sets}.safetensors", "weight": 0.8}]
+    return {
+        "model": api.DEFAULT_MODEL,
+        "prompt": f"benchmark prompt {index}",
+        "negative_prompt": "",
+        "guidance_scale": 7.0,
+        "sampler": api.SamplerType.EULER_A.value,
+        "few_step_scheduler": False,
+        "num_inference_steps": steps,
+        "width": 64,
+        "height": 64,
+        "memory_profile": api.MemoryProfile.FULL.value,
+        "seeds": [random.randint(0, 2**32 - 1)],
+        "loras": loras,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the diffusion-api worker pool with tiny CPU replicas')
+    parser.add_argument('--devices', default="cpu,cpu", help='Comma separated replica devices')
+    parser.add_argument('--routing', choices=['least_loaded', 'sticky_lora'], default='least_loaded')
+    parser.add_argument('--jobs', type=int, default=24, help='Number of renders to submit')
+    parser.add_argument('--concurrency', type=int, default=8, help='Renders in flight at once')
+    parser.add_argument('--steps', type=int, default=4, help='Inference steps per render')
+    parser.add_argument('--lora-sets', type=int, default=0, help='Distinct LoRA sets to rotate through')
+    parser.add_argument('--kill-replica', type=int, default=None, help='Kill this replica after half the jobs')
+
+    args = parser.parse_args()
+
+    # Replica processes run single threaded so they do not fight over cores
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+    pool = api.WorkerPool(
+        [d.strip() for d in args.devices.split(",")],
+        "tiny_pipeline:build_tiny_replica",
+        args.routing
+    )
+    start = time.perf_counter()
+    pool.start(timeout=300)
+    print(f"Pool ready in {time.perf_counter() - start:.2f}s")
+
+    failures = 0
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [
+            executor.submit(pool.render, make_spec(i, args.steps, args.lora_sets))
+            for i in range(args.jobs)
+        ]
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            if args.kill_replica is not None and i == args.jobs // 2:
+                victim = pool.replicas[args.kill_replica].process
+                print(f"Killing replica {args.kill_replica} (pid {victim.pid})")
+                victim.kill()
+            try:
+                future.result()
+            except Exception as e:
+                failures += 1
+                print(f"Job failed: {e}")
+    elapsed = time.perf_counter() - start
+
+    print(f"\n{args.jobs - failures}/{args.jobs} renders in {elapsed:.2f}s "
+          f"({(args.jobs - failures) / elapsed:.2f} renders/s)\n")
+    print(json.dumps(pool.status(), indent=2))
+    pool.stop()
+
+if __name__ == "__main__":
+    main()
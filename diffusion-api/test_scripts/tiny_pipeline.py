@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Tiny randomly initialised SDXL pipeline for CPU benchmarks.
+
+The architecture mirrors SDXL (two text encoders, text_time conditioning) at a
+fraction of the size, so pipeline features can be exercised on any machine
+without downloading weights. Tokenizers are omitted: callers pass prompt
+embeddings from tiny_prompt_kwargs() instead of text prompts.
+"""
+
+import zlib
+
+import torch
+from diffusers import AutoencoderKL, EulerDiscreteScheduler, StableDiffusionXLPipeline, UNet2DConditionModel
+from transformers import CLIPTextConfig, CLIPTextModel, CLIPTextModelWithProjection
+
+TEXT_HIDDEN_SIZE = 32
+SEQUENCE_LENGTH = 77
+DEFAULT_SIZE = 64
+
+def build_tiny_sdxl_pipeline(seed: int = 0, dtype: torch.dtype = torch.float32) -> StableDiffusionXLPipeline:
+    """Build a tiny SDXL pipeline with deterministic random weights"""
+    torch.manual_seed(seed)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=2,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4),
+        use_linear_projection=True,
+        addition_embed_type="text_time",
+        addition_time_embed_dim=8,
+        transformer_layers_per_block=(1, 2),
+        projection_class_embeddings_input_dim=6 * 8 + TEXT_HIDDEN_SIZE,
+        cross_attention_dim=2 * TEXT_HIDDEN_SIZE,
+        norm_num_groups=1,
+    )
+    scheduler = EulerDiscreteScheduler(
+        beta_start=0.00085,
+        beta_end=0.012,
+        steps_offset=1,
+        beta_schedule="scaled_linear",
+        timestep_spacing="leading",
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D", "DownEncoderBlock2D"],
+        up_block_types=["UpDecoderBlock2D", "UpDecoderBlock2D"],
+        latent_channels=4,
+        sample_size=128,
+    )
+    text_config = CLIPTextConfig(
+        bos_token_id=0,
+        eos_token_id=2,
+        hidden_size=TEXT_HIDDEN_SIZE,
+        intermediate_size=37,
+        layer_norm_eps=1e-05,
+        num_attention_heads=4,
+        num_hidden_layers=5,
+        pad_token_id=1,
+        vocab_size=1000,
+        hidden_act="gelu",
+        projection_dim=TEXT_HIDDEN_SIZE,
+    )
+    pipe = StableDiffusionXLPipeline(
+        vae=vae,
+        text_encoder=CLIPTextModel(text_config),
+        text_encoder_2=CLIPTextModelWithProjection(text_config),
+        tokenizer=None,
+        tokenizer_2=None,
+        unet=unet,
+        scheduler=scheduler,
+    )
+    pipe.set_progress_bar_config(disable=True)
+    return pipe.to(dtype=dtype)
+
+def tiny_prompt_kwargs(batch_size: int = 1, seed: int = 0, dtype: torch.dtype = torch.float32) -> dict:
+    """Random prompt embeddings shaped for the tiny pipeline"""
+    generator = torch.Generator().manual_seed(seed)
+    def embeds():
+        return torch.randn(batch_size, SEQUENCE_LENGTH, 2 * TEXT_HIDDEN_SIZE, generator=generator, dtype=dtype)
+    def pooled():
+        return torch.randn(batch_size, TEXT_HIDDEN_SIZE, generator=generator, dtype=dtype)
+    return {
+        "prompt_embeds": embeds(),
+        "negative_prompt_embeds": embeds(),
+        "pooled_prompt_embeds": pooled(),
+        "negative_pooled_prompt_embeds": pooled(),
+    }
+
+class TinyTextPipeline:
+    """Stand-in for a full SDXL pipeline that accepts text prompts.
+
+    Prompts are mapped to deterministic random embeddings, so the wrapper can
+    be driven by the same code paths as the real pipeline.
+    """
+
+    def __init__(self, device: str = "cpu"):
+        self.pipe = build_tiny_sdxl_pipeline().to(device)
+        self.device = device
+        self.loaded_loras = []
+
+    @property
+    def scheduler(self):
+        return self.pipe.scheduler
+
+    @scheduler.setter
+    def scheduler(self, value):
+        self.pipe.scheduler = value
+
+    def load_lora_weights(self, path: str, **kwargs):
+        self.loaded_loras.append(path)
+
+    def unload_lora_weights(self):
+        self.loaded_loras = []
+
+    def __call__(self, prompt: str, negative_prompt: str = "", width: int = DEFAULT_SIZE,
+                 height: int = DEFAULT_SIZE, **kwargs):
+        embeds = tiny_prompt_kwargs(seed=zlib.crc32(f"{prompt}\0{negative_prompt or ''}".encode()))
+        embeds = {key: value.to(self.device) for key, value in embeds.items()}
+        # Keep stand-in renders cheap regardless of the requested resolution
+        return self.pipe(width=min(width, DEFAULT_SIZE), height=min(height, DEFAULT_SIZE), **embeds, **kwargs)
+
+_replicas = {}
+
+def build_tiny_replica(model_name: str, device: str) -> TinyTextPipeline:
+    """Worker pool factory (WORKER_PIPELINE_FACTORY=tiny_pipeline:build_tiny_replica)"""
+    if model_name not in _replicas:
+        _replicas[model_name] = TinyTextPipeline(device)
+    return _replicas[model_name]
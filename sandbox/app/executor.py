@@ -0,0 +1,586 @@
+"""Code execution core and the zygote that forks a clean child per execution.
+
+The zygote is spawned once from a fresh interpreter (never forked from the
+multi-threaded API process). It imports this module and ZYGOTE_PRELOAD, then
+forks one child per job, so imported modules are shared copy-on-write and
+every execution starts from the same pristine state.
+"""
+import gc
+import importlib
+import io
+import json
+import logging
+import marshal
+import multiprocessing
+import os
+import resource
+import select
+import signal
+import sys
+import threading
+import time
+import uuid
+from contextlib import ExitStack, redirect_stderr, redirect_stdout
+from enum import Enum
+from multiprocessing import reduction
+from pathlib import Path
+from types import CodeType
+from typing import Dict, Any, Iterator, Optional, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+WORKSPACE_DIR = Path(os.environ.get("WORKSPACE_DIR", "/app/workspace"))
+
+# Binary exports of execution results, downloadable by handle
+EXPORTS_DIR = WORKSPACE_DIR / "exports"
+EXPORT_TTL_SECONDS = int(os.environ.get("EXPORT_TTL_SECONDS", "3600"))
+
+# Workspace sessions; Python file APIs in an execution may only touch its own session's directory
+SESSIONS_DIR = WORKSPACE_DIR / "sessions"
+# Executions may start other programs; those are not subject to the session guard
+ALLOW_SUBPROCESS = os.environ.get("ALLOW_SUBPROCESS", "false").lower() in ("1", "true", "yes")
+
+# Audit events that take filesystem paths, and the positions of those arguments
+PATH_AUDIT_EVENTS = {
+    "open": (0,),
+    "os.listdir": (0,),
+    "os.scandir": (0,),
+    "os.mkdir": (0,),
+    "os.remove": (0,),
+    "os.rmdir": (0,),
+    "os.truncate": (0,),
+    "os.chmod": (0,),
+    "os.chown": (0,),
+    "os.utime": (0,),
+    "os.rename": (0, 1),
+    "os.link": (0, 1),
+    "os.symlink": (0, 1),
+    "shutil.copyfile": (0, 1),
+    "shutil.copytree": (0, 1),
+    "shutil.move": (0, 1),
+    "shutil.rmtree": (0,),
+}
+
+# Audit events that start another program (os.fork is left alone: the child keeps the hook)
+SPAWN_AUDIT_EVENTS = {"subprocess.Popen", "os.system", "os.exec", "os.posix_spawn", "os.spawn", "os.forkpty", "pty.spawn"}
+
+# Modules the zygote imports once so forked children start with them loaded
+ZYGOTE_PRELOAD = [m.strip() for m in os.environ.get("ZYGOTE_PRELOAD", "numpy,pyarrow,pyarrow.parquet").split(",") if m.strip()]
+
+# Per-child rlimits; memory is counted on top of what the zygote already maps
+MAX_MEMORY_MB = int(os.environ.get("MAX_MEMORY_MB", "512"))
+MAX_OPEN_FILES = int(os.environ.get("MAX_OPEN_FILES", "256"))
+# Captured stdout/stderr per execution; a snippet printing more is stopped
+MAX_OUTPUT_BYTES = int(os.environ.get("MAX_OUTPUT_BYTES", str(2**20)))
+
+# CPU usage of the calling thread only, for executions sharing the API process
+THREAD_USAGE = getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF)
+
+class ExportFormat(str, Enum):
+    ARROW = "arrow"
+    NPY = "npy"
+    PARQUET = "parquet"
+
+EXPORT_EXTENSIONS = {
+    ExportFormat.ARROW: ".arrow",
+    ExportFormat.NPY: ".npy",
+    ExportFormat.PARQUET: ".parquet",
+}
+
+EXPORT_MEDIA_TYPES = {
+    ".arrow": "application/vnd.apache.arrow.file",
+    ".npy": "application/octet-stream",
+    ".parquet": "application/vnd.apache.parquet",
+}
+
+def to_arrow_table(value) -> pa.Table:
+    """Convert common tabular and array values to an Arrow table"""
+    if isinstance(value, pa.Table):
+        return value
+    if isinstance(value, pa.RecordBatch):
+        return pa.Table.from_batches([value])
+    if type(value).__module__.startswith("pandas"):
+        return pa.Table.from_pandas(value, preserve_index=False)
+    if isinstance(value, dict):
+        return pa.table(value)
+    if isinstance(value, np.ndarray):
+        if value.ndim == 1:
+            return pa.table({"value": value})
+        if value.ndim == 2:
+            return pa.table({str(i): value[:, i] for i in range(value.shape[1])})
+        raise TypeError(f"Cannot convert a {value.ndim}-D array to a table, export it as npy")
+    if isinstance(value, (list, tuple)):
+        return pa.table({"value": pa.array(value)})
+    raise TypeError(f"Cannot convert {type(value).__name__} to an Arrow table")
+
+def prune_exports() -> None:
+    """Delete exports older than EXPORT_TTL_SECONDS"""
+    if not EXPORTS_DIR.exists():
+        return
+    cutoff = time.time() - EXPORT_TTL_SECONDS
+    for path in EXPORTS_DIR.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+
+def export_value(value, export_format: ExportFormat) -> Dict[str, Any]:
+    """Write a value to the exports directory and describe the handle.
+
+    Arrow IPC files and .npy files keep buffers uncompressed, so clients can
+    read them zero-copy with pa.memory_map() or np.load(mmap_mode="r").
+    """
+    EXPORTS_DIR.mkdir(parents=True, exist_ok=True)
+    handle = uuid.uuid4().hex
+    path = EXPORTS_DIR / f"{handle}{EXPORT_EXTENSIONS[export_format]}"
+    info = {"handle": handle, "format": export_format.value, "url": f"/exports/{handle}"}
+
+    if export_format == ExportFormat.NPY:
+        array = np.asarray(value)
+        if array.dtype == object:
+            raise TypeError("Object arrays cannot be exported as npy, use arrow or parquet")
+        np.save(path, array, allow_pickle=False)
+        info.update(shape=list(array.shape), dtype=str(array.dtype))
+    else:
+        table = to_arrow_table(value)
+        if export_format == ExportFormat.ARROW:
+            with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        else:
+            pq.write_table(table, path)
+        info.update(num_rows=table.num_rows, schema={f.name: str(f.type) for f in table.schema})
+
+    info["bytes"] = path.stat().st_size
+    return info
+
+class OutputLimitExceeded(BaseException):
+    """Raised on a write past MAX_OUTPUT_BYTES; a BaseException so `except Exception` in the snippet cannot swallow it"""
+
+class CappedOutput(io.TextIOBase):
+    """Collects a snippet's stdout and stderr, up to limit bytes"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.bytes = 0
+        self.parts = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        data = text.encode("utf-8", "replace")
+        if self.bytes + len(data) > self.limit:
+            self.parts.append(data[:self.limit - self.bytes].decode("utf-8", "ignore"))
+            self.bytes = self.limit
+            raise OutputLimitExceeded(f"Output exceeded {self.limit} bytes")
+        self.parts.append(text)
+        self.bytes += len(data)
+        return len(text)
+
+    def getvalue(self) -> str:
+        return "".join(self.parts)
+
+def usage_report(wall_seconds: float, usage=None, before=None, output_bytes: int = 0,
+                 exception: Optional[str] = None) -> Dict[str, Any]:
+    """Resource usage of one execution; CPU and memory are None when the process could not be measured.
+
+    usage is a getrusage()/wait4() result, made relative to before when given.
+    Peak RSS is the high-water mark of the whole process, including what it
+    shares with the zygote.
+    """
+    report = {
+        "wall_seconds": round(wall_seconds, 4),
+        "cpu_user_seconds": None,
+        "cpu_system_seconds": None,
+        "peak_rss_mb": None,
+        "output_bytes": output_bytes,
+        "exception": exception
+    }
+    if usage is not None:
+        report.update(
+            cpu_user_seconds=round(usage.ru_utime - (before.ru_utime if before else 0), 4),
+            cpu_system_seconds=round(usage.ru_stime - (before.ru_stime if before else 0), 4),
+            peak_rss_mb=round(usage.ru_maxrss / 1024, 1)
+        )
+    return report
+
+def run_snippet(code: Union[str, CodeType], namespace: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Execute source or a compiled code object in a fresh namespace (or the given one) and return the namespace"""
+    namespace = {} if namespace is None else namespace
+    exec(code, namespace)
+    return namespace
+
+def execute_request(code: Union[str, CodeType], export: Optional[Dict[str, str]] = None,
+                    namespace: Optional[Dict[str, Any]] = None, own_process: bool = True) -> Dict[str, Any]:
+    """Run a snippet and build the /execute response: str() of every variable plus any exports.
+
+    With a namespace from earlier setup code, only variables the snippet
+    defines or rebinds are reported. The response carries the snippet's
+    resource usage. In its own process, the snippet's stdout and stderr are
+    captured as `output` and CPU time covers all of its threads; otherwise
+    output goes to the API's log and only the calling thread's CPU is counted.
+    """
+    baseline = dict(namespace or {})
+    output = CappedOutput(MAX_OUTPUT_BYTES)
+    result_bytes = 0
+    exception = None
+    who = resource.RUSAGE_SELF if own_process else THREAD_USAGE
+    start = time.perf_counter()
+    before = resource.getrusage(who)
+    try:
+        with ExitStack() as stack:
+            if own_process:
+                stack.enter_context(redirect_stdout(output))
+                stack.enter_context(redirect_stderr(output))
+            namespace = run_snippet(code, namespace)
+
+        # Requested variables are written as binary files instead of strings
+        exports = {}
+        export = export or {}
+        if export:
+            prune_exports()
+        for name, export_format in export.items():
+            if name not in namespace:
+                raise NameError(f"Variable '{name}' requested for export is not defined")
+            exports[name] = export_value(namespace[name], ExportFormat(export_format))
+            logger.info(f"Exported {name} as {export_format} ({exports[name]['bytes']} bytes)")
+
+        # Get any output variables
+        result = {}
+        for key, value in namespace.items():
+            if not key.startswith('__') and key not in exports and (key not in baseline or baseline[key] is not value):
+                result[key] = str(value)
+                result_bytes += len(result[key].encode("utf-8", "replace"))
+
+        response = {
+            "status": "success",
+            "result": result
+        }
+        if exports:
+            response["exports"] = exports
+
+    except (Exception, OutputLimitExceeded) as e:
+        logger.error(f"Error executing code: {type(e).__name__}: {e}")
+        exception = type(e).__name__
+        response = {
+            "status": "error",
+            # MemoryError from the address-space limit has no message
+            "error": str(e) or type(e).__name__
+        }
+
+    response["output"] = output.getvalue()
+    response["usage"] = usage_report(
+        time.perf_counter() - start, resource.getrusage(who), before, output.bytes + result_bytes, exception
+    )
+    return response
+
+def mapped_bytes() -> int:
+    """Virtual memory of this process, the baseline RLIMIT_AS is added to"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+
+def cpu_limit_exceeded(signum, frame):
+    raise TimeoutError("CPU time limit exceeded")
+
+def lower_limit(kind: int, value: int) -> None:
+    """Set a hard and soft rlimit, never above the current hard limit (a batch item inherits its parent's)"""
+    _, hard = resource.getrlimit(kind)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(kind, (value, value))
+
+def apply_limits(cpu_seconds: int, max_file_bytes: Optional[int] = None) -> None:
+    # SIGXCPU at the soft limit raises inside the snippet; the kernel kills the child a second later
+    signal.signal(signal.SIGXCPU, cpu_limit_exceeded)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = cpu_seconds if hard == resource.RLIM_INFINITY else min(cpu_seconds, hard - 1)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, soft + 1))
+    if MAX_MEMORY_MB:
+        lower_limit(resource.RLIMIT_AS, mapped_bytes() + MAX_MEMORY_MB * 2**20)
+    lower_limit(resource.RLIMIT_NOFILE, MAX_OPEN_FILES)
+    if max_file_bytes is not None:
+        # Writing past the limit fails with OSError (EFBIG) instead of killing the child
+        signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+        lower_limit(resource.RLIMIT_FSIZE, max_file_bytes)
+
+def guard_session_access(session: Optional[str]) -> None:
+    """Best-effort guard against touching other sessions' files; not an isolation boundary.
+
+    Refuses Python-level file access under SESSIONS_DIR outside the given
+    session (or all of it without one). Paths are resolved first, so neither
+    `..`, absolute paths nor symlinks reach another session. Unless
+    ALLOW_SUBPROCESS is set, starting other programs is refused too, since
+    they would not be audited. Native code that opens files itself (e.g.
+    pyarrow's C++ filesystem or ctypes) is not seen at all.
+    """
+    sessions = os.path.realpath(SESSIONS_DIR)
+    own = os.path.realpath(session) if session else None
+
+    def inside(path: str, root: str) -> bool:
+        return path == root or path.startswith(root + os.sep)
+
+    def hook(event: str, args: tuple) -> None:
+        if event in SPAWN_AUDIT_EVENTS and not ALLOW_SUBPROCESS:
+            raise PermissionError("Starting other programs is not allowed in the sandbox (ALLOW_SUBPROCESS=false)")
+        positions = PATH_AUDIT_EVENTS.get(event)
+        if positions is None:
+            return
+        for position in positions:
+            if position >= len(args) or args[position] is None or isinstance(args[position], int):
+                continue
+            try:
+                path = os.path.realpath(os.fsdecode(args[position]))
+            except (TypeError, ValueError):
+                continue
+            if inside(path, sessions) and not (own and inside(path, own)):
+                raise PermissionError(f"Access to {path} is not allowed outside this execution's workspace session")
+
+    sys.addaudithook(hook)
+
+def run_child(job: Dict[str, Any], fd: int) -> None:
+    """Body of a forked child: report the pid, run the job, write the result and exit"""
+    status = 0
+    try:
+        # Own process group, so a timeout also kills anything the snippet started
+        os.setsid()
+        with os.fdopen(fd, "w") as out:
+            out.write(json.dumps({"pid": os.getpid()}) + "\n")
+            out.flush()
+            # A session's directory, so its uploaded files can be opened by relative path
+            cwd = Path(job.get("cwd") or WORKSPACE_DIR)
+            cwd.mkdir(parents=True, exist_ok=True)
+            os.chdir(cwd)
+            apply_limits(job["timeout"], job.get("max_file_bytes"))
+            guard_session_access(job.get("cwd"))
+            if job.get("kind") == "batch":
+                run_batch(job, out)
+            else:
+                response = execute_request(marshal.loads(job["bytecode"]), job.get("export"))
+                out.write(json.dumps(response) + "\n")
+    except BaseException:
+        status = 1
+    finally:
+        os._exit(status)
+
+def run_batch_item(code: str, namespace: Dict[str, Any], fd: int, timeout: int) -> None:
+    """Body of a batch item's child: run one snippet on top of the setup namespace"""
+    status = 0
+    try:
+        with os.fdopen(fd, "w") as out:
+            apply_limits(timeout)
+            out.write(json.dumps(execute_request(code, namespace=namespace)))
+    except BaseException:
+        status = 1
+    finally:
+        os._exit(status)
+
+def run_batch(job: Dict[str, Any], out) -> None:
+    """Run setup once, then fork a child per snippet from the resulting state.
+
+    At most job["parallel"] items run at once. Each finished item is written
+    as one JSON line in completion order, with its CPU time taken from the
+    kernel's accounting of the child.
+    """
+    start = time.perf_counter()
+    namespace = {}
+    if job["setup"] is not None:
+        setup = execute_request(marshal.loads(job["setup"]), namespace=namespace)
+    else:
+        setup = {"status": "success", "result": {}}
+    setup["wall_seconds"] = round(time.perf_counter() - start, 3)
+    out.write(json.dumps({"setup": setup}) + "\n")
+    out.flush()
+    if setup["status"] != "success":
+        return
+    # Items only see the setup state; keep the collector off the shared pages
+    gc.collect()
+    gc.freeze()
+
+    timeout = job["timeout"]
+    # Items the API's pre-check rejected are not sent, so indexes may have gaps
+    pending = [(index, marshal.loads(bytecode)) for index, bytecode in job["snippets"]]
+    running = {}  # read fd -> item state
+    while pending or running:
+        while pending and len(running) < job["parallel"]:
+            index, code = pending.pop(0)
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                for fd in running:
+                    os.close(fd)
+                run_batch_item(code, namespace, write_fd, timeout)
+            os.close(write_fd)
+            running[read_fd] = {"index": index, "pid": pid, "start": time.perf_counter(), "chunks": [], "timed_out": False}
+
+        now = time.perf_counter()
+        for item in running.values():
+            if not item["timed_out"] and now - item["start"] > timeout:
+                item["timed_out"] = True
+                os.kill(item["pid"], signal.SIGKILL)
+        wait = max(0.0, min(item["start"] + timeout - now for item in running.values()))
+        ready, _, _ = select.select(list(running), [], [], wait + 0.01)
+        for fd in ready:
+            data = os.read(fd, 1 << 16)
+            if data:
+                running[fd]["chunks"].append(data)
+                continue
+            item = running.pop(fd)
+            os.close(fd)
+            _, _, usage = os.wait4(item["pid"], 0)
+            wall_seconds = time.perf_counter() - item["start"]
+            if item["chunks"]:
+                response = json.loads(b"".join(item["chunks"]))
+            elif item["timed_out"]:
+                response = {"status": "error", "error": f"Item timed out after {timeout}s",
+                            "usage": usage_report(wall_seconds, usage, exception="TimeoutError")}
+            else:
+                response = {"status": "error", "error": "Item was terminated (CPU, memory or file limit exceeded)",
+                            "usage": usage_report(wall_seconds, usage, exception="Killed")}
+            response.update(
+                index=item["index"],
+                wall_seconds=round(wall_seconds, 3),
+                cpu_seconds=round(usage.ru_utime + usage.ru_stime, 3)
+            )
+            out.write(json.dumps(response) + "\n")
+            out.flush()
+
+def zygote_main(conn) -> None:
+    """Zygote loop: preload modules, then fork a child for every job received on conn"""
+    preloaded = []
+    for name in ZYGOTE_PRELOAD:
+        try:
+            importlib.import_module(name)
+            preloaded.append(name)
+        except ImportError as e:
+            logger.warning(f"Zygote could not preload {name}: {e}")
+    # Children are never waited for; the kernel reaps them
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    # Keep the garbage collector from touching (and so copying) the preloaded objects in children
+    gc.collect()
+    gc.freeze()
+    # Top-level modules children start with, so the API can tell which imports are warm
+    modules = sorted({name.split(".")[0] for name in sys.modules})
+    conn.send({"pid": os.getpid(), "preloaded": preloaded, "modules": modules})
+
+    while True:
+        try:
+            job = conn.recv()
+            fd = reduction.recv_handle(conn)
+        except (EOFError, OSError):
+            break
+        pid = os.fork()
+        if pid == 0:
+            conn.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            run_child(job, fd)
+        os.close(fd)
+        conn.send(pid)
+
+class Zygote:
+    """API-side handle on the zygote process, restarted if it dies"""
+
+    def __init__(self):
+        self.process = None
+        self.conn = None
+        self.info = {}
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        context = multiprocessing.get_context("spawn")
+        parent, child = context.Pipe()
+        start = time.perf_counter()
+        self.process = context.Process(target=zygote_main, args=(child,), name="sandbox-zygote", daemon=True)
+        self.process.start()
+        child.close()
+        self.info = dict(parent.recv(), startup_seconds=round(time.perf_counter() - start, 3))
+        self.conn = parent
+        logger.info(f"Zygote {self.info['pid']} ready in {self.info['startup_seconds']}s, preloaded {self.info['preloaded']}")
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(5)
+
+    def restart(self) -> None:
+        with self.lock:
+            self.stop()
+            self.start()
+
+    def spawn(self, job: Dict[str, Any]) -> tuple:
+        """Fork a child for the job; returns (pid, fd the child writes its result to)"""
+        with self.lock:
+            if self.process is None or not self.process.is_alive():
+                self.start()
+            read_fd, write_fd = os.pipe()
+            try:
+                self.conn.send(job)
+                reduction.send_handle(self.conn, write_fd, self.process.pid)
+                pid = self.conn.recv()
+            except BaseException:
+                os.close(read_fd)
+                raise
+            finally:
+                os.close(write_fd)
+        return pid, read_fd
+
+    def stream(self, job: Dict[str, Any], timeout: float) -> Iterator[Dict[str, Any]]:
+        """Yield the JSON lines a child writes as they arrive.
+
+        The child's process group is killed, and TimeoutError raised, once
+        timeout seconds have passed or if the consumer stops early.
+        """
+        pid, fd = self.spawn(job)
+        buffer = b""
+        finished = False
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Execution timed out after {timeout}s")
+                ready, _, _ = select.select([fd], [], [], remaining)
+                if not ready:
+                    continue
+                data = os.read(fd, 1 << 16)
+                if not data:
+                    finished = True
+                    break
+                *lines, buffer = (buffer + data).split(b"\n")
+                for line in lines:
+                    yield json.loads(line)
+        finally:
+            os.close(fd)
+            if not finished:
+                for kill in (os.killpg, os.kill):
+                    try:
+                        kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+
+    def run(self, job: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """Run a job in a fresh child and wait for its result, killing it after timeout seconds"""
+        start = time.perf_counter()
+        response = None
+        pid = None
+        try:
+            # First line is the child's pid, the second its result
+            for message in self.stream(job, timeout):
+                if "pid" in message:
+                    pid = message["pid"]
+                else:
+                    response = message
+        except TimeoutError as e:
+            # The zygote reaps its children, so a killed child's CPU and memory are not known here
+            response = {"status": "error", "error": str(e),
+                        "usage": usage_report(time.perf_counter() - start, exception="TimeoutError")}
+        if response is None:
+            response = {"status": "error", "error": "Execution was terminated (CPU, memory or file limit exceeded)",
+                        "usage": usage_report(time.perf_counter() - start, exception="Killed")}
+        logger.info(f"Child {pid} finished in {time.perf_counter() - start:.3f}s with status {response['status']}")
+        return response
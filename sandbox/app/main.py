@@ -1,15 +1,33 @@
 """Pure code execution sandbox."""
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi_mcp import FastApiMCP
-from pydantic import BaseModel, constr
-import subprocess
+from pydantic import BaseModel, Field, constr
+from prometheus_client import Counter, Histogram, make_asgi_app
 import os
 from pathlib import Path
 import re
 import uvicorn
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional
 import sys
+import time
+import json
+import math
+import uuid
+import asyncio
+import builtins
+import importlib
+import importlib.metadata
+from contextlib import asynccontextmanager
+from executor import (
+    WORKSPACE_DIR, EXPORTS_DIR, ExportFormat, EXPORT_MEDIA_TYPES, Zygote, execute_request, usage_report
+)
+from snippets import CompileCache, SnippetRejected
+from workspace import (
+    SESSION_ID_PATTERN, SESSION_QUOTA_MB, UPLOAD_PREFIX, delete_session, enforce_quota, existing_files, list_files,
+    parse_content_range, prune_sessions, resolve_file, session_path, session_usage, touch_session
+)
 
 # Configure logging
 logging.basicConfig(
@@ -21,10 +39,36 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Code Execution Sandbox")
 
-WORKSPACE_DIR = Path("/app/workspace")
+# Prometheus metrics
+app.mount("/metrics", make_asgi_app())
+
+EXPORT_HANDLE_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+SESSION_ID_REGEX = re.compile(SESSION_ID_PATTERN)
+
+# Each execution runs in a child forked from the zygote; disable to exec in the API process
+USE_ZYGOTE = os.environ.get("USE_ZYGOTE", "true").lower() in ("1", "true", "yes") and hasattr(os, "fork")
+MAX_EXECUTION_TIME = int(os.environ.get("MAX_EXECUTION_TIME", "120"))
+
+# /execute/batch: items per request, and items running at once (default: available cores)
+MAX_BATCH_ITEMS = int(os.environ.get("MAX_BATCH_ITEMS", "256"))
+BATCH_PARALLEL = int(os.environ.get("BATCH_PARALLEL", "0")) or len(os.sched_getaffinity(0))
+
+# Wheels downloaded at runtime; repeat installs are served from here offline
+WHEELHOUSE_DIR = Path(os.environ.get("WHEELHOUSE_DIR", "/app/wheelhouse"))
+# Read-only wheels for the allowlisted packages, baked in at image build time
+WHEELHOUSE_SEED_DIR = Path(os.environ.get("WHEELHOUSE_SEED_DIR", "/app/wheelhouse-seed"))
+PIP_TIMEOUT_SECONDS = int(os.environ.get("PIP_TIMEOUT_SECONDS", "300"))
 
 # Package name validation regex
 PACKAGE_NAME_PATTERN = re.compile(r'^[a-zA-Z0-9\-_\.]+$')
+VERSION_PATTERN = re.compile(r'^[a-zA-Z0-9\.\*\+!_\-]+$')
+
+# Concurrent requests for the same package wait for one install;
+# pip itself only ever runs one install against site-packages at a time
+package_locks = {}  # canonical name -> [lock, requests holding or waiting on it]
+site_packages_lock = asyncio.Lock()
+# Uploads to the same workspace session run one at a time
+upload_locks = {}  # session id -> [lock, uploads holding or waiting on it]
 
 # Known malicious or problematic packages
 BLOCKED_PACKAGES = {
@@ -49,6 +93,19 @@ SUSPICIOUS_PACKAGES = {
 
 class CodeRequest(BaseModel):
     code: str
+    timeout: int = Field(default=30, ge=1, le=MAX_EXECUTION_TIME)  # Wall-clock and CPU seconds
+    # Variables to return as binary files instead of str(), e.g. {"df": "parquet", "arr": "npy"}
+    export: Optional[Dict[str, ExportFormat]] = None
+    # Run in this workspace session's directory, where its uploaded files are
+    session_id: Optional[str] = Field(default=None, pattern=SESSION_ID_PATTERN)
+
+class BatchRequest(BaseModel):
+    snippets: List[str] = Field(min_length=1, max_length=MAX_BATCH_ITEMS)
+    setup: str = ""  # Runs once; every snippet starts from the variables it defines
+    timeout: int = Field(default=30, ge=1, le=MAX_EXECUTION_TIME)  # Per item, and for the setup code
+    parallel: Optional[int] = Field(default=None, ge=1)  # Capped at BATCH_PARALLEL
+    stream: bool = False  # NDJSON lines as items complete instead of one ordered response
+    session_id: Optional[str] = Field(default=None, pattern=SESSION_ID_PATTERN)
 
 class PipRequest(BaseModel):
     package: constr(min_length=1, max_length=100)  # Constrain package name length
@@ -58,6 +115,9 @@ class CodeResponse(BaseModel):
     success: bool
     output: str = ""
     error: str = ""
+    installed_version: str = ""
+    installation_time: float = 0.0
+    source: str = ""  # "installed", "wheelhouse" or "index"
 
 def validate_package_name(package: str) -> bool:
     """Validate package name against security rules."""
@@ -72,79 +132,565 @@ def validate_package_name(package: str) -> bool:
     
     return True
 
+def canonical_package_name(package: str) -> str:
+    """PEP 503 normalized name, so "Foo_Bar" and "foo-bar" share a lock"""
+    return re.sub(r'[-_.]+', '-', package).lower()
+
+@asynccontextmanager
+async def keyed_lock(locks: Dict[str, list], key: str):
+    """Hold the lock for a key in locks; the lock is dropped once nobody holds or waits on it"""
+    entry = locks.setdefault(key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del locks[key]
+
+def installed_version(package: str) -> Optional[str]:
+    try:
+        return importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+async def run_pip(args: list, timeout: int = PIP_TIMEOUT_SECONDS) -> tuple:
+    """Run pip without blocking the event loop; returns (returncode, stdout, stderr)"""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, '-m', 'pip', *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return -1, "", f"pip timed out after {timeout}s"
+    return process.returncode, stdout.decode(), stderr.decode()
+
+def wheelhouse_links() -> list:
+    links = []
+    for directory in (WHEELHOUSE_DIR, WHEELHOUSE_SEED_DIR):
+        if directory.is_dir():
+            links += ['--find-links', str(directory)]
+    return links
+
+async def install_from_wheelhouse(requirement: str) -> tuple:
+    async with site_packages_lock:
+        return await run_pip(['install', '--no-index', *wheelhouse_links(), requirement])
+
+zygote = Zygote() if USE_ZYGOTE else None
+
+# Snippets are checked and compiled here once, before any child is forked
+compile_cache = CompileCache()
+
+# Per-execution accounting; tool_name is "code_execution" for /execute and "code_execution_batch" per batch item
+TOOL_DURATION = Histogram(
+    "mcp_tool_duration_seconds",
+    "Wall time of each code execution, including process startup",
+    ["tool_name", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+TOOL_EXECUTIONS = Counter(
+    "mcp_tool_executions_total",
+    "Code executions by outcome",
+    ["tool_name", "status"]
+)
+EXECUTION_CPU = Histogram(
+    "sandbox_execution_cpu_seconds",
+    "CPU time of each code execution, by user and system mode",
+    ["tool_name", "mode"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120)
+)
+EXECUTION_PEAK_RSS = Histogram(
+    "sandbox_execution_peak_rss_bytes",
+    "Peak resident memory of the process that ran each execution",
+    ["tool_name"],
+    buckets=tuple(2**20 * mb for mb in (32, 64, 128, 256, 512, 1024, 2048, 4096))
+)
+EXECUTION_OUTPUT = Histogram(
+    "sandbox_execution_output_bytes",
+    "Captured stdout/stderr plus str() results of each execution",
+    ["tool_name"],
+    buckets=(0, 256, 1024, 16384, 2**17, 2**20, 2**23, 2**26)
+)
+EXECUTION_EXCEPTIONS = Counter(
+    "sandbox_execution_exceptions_total",
+    "Failed executions by exception type",
+    ["tool_name", "exception"]
+)
+
+def exception_label(name: str) -> str:
+    """Builtin exception names and the sandbox's own; user-defined classes share one label"""
+    if name in ("Killed", "OutputLimitExceeded", "QuotaExceeded") or isinstance(getattr(builtins, name, None), type):
+        return name
+    return "other"
+
+def rejected_response(error: SnippetRejected, wall_seconds: float) -> Dict[str, Any]:
+    """Response for a snippet the pre-check refused; it never reached a child"""
+    return {
+        "status": "error",
+        "error": str(error),
+        "output": "",
+        "usage": usage_report(wall_seconds, exception=error.exception)
+    }
+
+def cold_imports(imports: List[str]) -> List[str]:
+    """Imports a new execution will load from disk rather than find already imported"""
+    if zygote is not None:
+        warm = set(zygote.info.get("modules", []))
+    else:
+        warm = {name.split(".")[0] for name in sys.modules}
+    return [name for name in imports if name not in warm]
+
+def record_execution(tool_name: str, response: Dict[str, Any], wall_seconds: float) -> None:
+    """Export one execution's outcome and resource usage as Prometheus metrics"""
+    status = response["status"]
+    usage = response.get("usage") or usage_report(wall_seconds)
+    TOOL_DURATION.labels(tool_name=tool_name, status=status).observe(wall_seconds)
+    TOOL_EXECUTIONS.labels(tool_name=tool_name, status=status).inc()
+    if usage["cpu_user_seconds"] is not None:
+        EXECUTION_CPU.labels(tool_name=tool_name, mode="user").observe(usage["cpu_user_seconds"])
+        EXECUTION_CPU.labels(tool_name=tool_name, mode="system").observe(usage["cpu_system_seconds"])
+        EXECUTION_PEAK_RSS.labels(tool_name=tool_name).observe(usage["peak_rss_mb"] * 2**20)
+    EXECUTION_OUTPUT.labels(tool_name=tool_name).observe(usage["output_bytes"])
+    if status != "success":
+        EXECUTION_EXCEPTIONS.labels(tool_name=tool_name, exception=exception_label(usage["exception"] or "other")).inc()
+
+def find_export(handle: str) -> Path:
+    if not EXPORT_HANDLE_PATTERN.match(handle):
+        raise HTTPException(status_code=400, detail="Invalid export handle")
+    for extension in EXPORT_MEDIA_TYPES:
+        path = EXPORTS_DIR / f"{handle}{extension}"
+        if path.exists():
+            return path
+    raise HTTPException(status_code=404, detail=f"Export {handle} not found or expired")
+
+def session_job(session_id: Optional[str]) -> Dict[str, Any]:
+    """Job settings that run an execution inside a workspace session"""
+    if session_id is None:
+        return {}
+    cwd = touch_session(session_id)
+    return {
+        "cwd": str(cwd),
+        # No single file may outgrow what is left of the session's quota; the total is checked afterwards
+        "max_file_bytes": max(0, SESSION_QUOTA_MB * 2**20 - session_usage(session_id))
+    }
+
+def check_quota_after(session_id: Optional[str], before, response: Dict[str, Any]) -> None:
+    """Fail an execution that left its session over quota; the files it created are removed"""
+    if session_id is None:
+        return
+    error = enforce_quota(session_id, before)
+    if error:
+        logger.warning(error)
+        response.update(status="error", error=error)
+        response["usage"]["exception"] = "QuotaExceeded"
+
+def check_session_id(session_id: str) -> None:
+    if not SESSION_ID_REGEX.match(session_id):
+        raise HTTPException(status_code=400, detail="Invalid session id")
+
+def find_workspace_file(session_id: str, file_path: str) -> Path:
+    check_session_id(session_id)
+    path = resolve_file(session_id, file_path)
+    if path is None:
+        raise HTTPException(status_code=400, detail="Invalid file path")
+    return path
+
 @app.post("/execute", response_model=Dict[str, Any])
 async def execute_code(request: CodeRequest):
     """
     Execute Python code in a sandboxed environment.
+
+    Each call runs in a child forked from the zygote, with the scientific
+    stack already imported, a fresh namespace and CPU, memory and open-file
+    rlimits. The child is killed after `timeout` seconds, or once it
+    prints more than MAX_OUTPUT_BYTES. Code is pre-checked and compiled
+    before a child is forked; syntax errors and disallowed imports fail
+    without running anything, and repeated code is not compiled again.
+    With `session_id`, the code runs in that workspace session's directory
+    and can open (or mmap) its uploaded files by relative path.
     
     Args:
         request: CodeRequest containing the Python code to execute
         
     Returns:
-        Dict containing execution results or error information
+        Dict containing execution results or error information, the captured
+        `output` and `usage`: wall time, user/system CPU, peak RSS, output
+        bytes and the exception type of a failed run, plus the top-level
+        modules the code `imports` and which of them are `cold_imports`
+        (not already loaded in the zygote)
     """
+    if request.session_id and zygote is None:
+        raise HTTPException(status_code=400, detail="session_id needs the zygote (USE_ZYGOTE=true)")
+    os.makedirs(WORKSPACE_DIR, exist_ok=True)
+    logger.info(f"Executing code in sandbox")
+    export = {name: export_format.value for name, export_format in (request.export or {}).items()}
+    start = time.perf_counter()
     try:
-        # Create a temporary file in the workspace
-        workspace_dir = "/app/workspace"
-        os.makedirs(workspace_dir, exist_ok=True)
-        
-        # Execute the code
-        logger.info(f"Executing code in sandbox")
-        result = {}
-        
-        # Create a new namespace for execution
-        namespace = {}
-        
-        # Execute the code
-        exec(request.code, namespace)
-        
-        # Get any output variables
-        for key, value in namespace.items():
-            if not key.startswith('__'):
-                result[key] = str(value)
-        
-        return {
-            "status": "success",
-            "result": result
-        }
-        
-    except Exception as e:
-        logger.error(f"Error executing code: {str(e)}")
-        return {
-            "status": "error",
-            "error": str(e)
+        snippet = compile_cache.get(request.code)
+    except SnippetRejected as e:
+        logger.info(f"Code rejected before execution: {e.exception}: {e}")
+        response = rejected_response(e, time.perf_counter() - start)
+        record_execution("code_execution", response, time.perf_counter() - start)
+        return response
+    if zygote is None:
+        response = await asyncio.to_thread(execute_request, snippet.code, export, None, False)
+    else:
+        before = existing_files(request.session_id) if request.session_id else None
+        try:
+            response = await asyncio.to_thread(
+                zygote.run,
+                {"bytecode": snippet.bytecode, "export": export, "timeout": request.timeout, **session_job(request.session_id)},
+                request.timeout
+            )
+        except Exception as e:
+            logger.error(f"Error executing code: {str(e)}")
+            response = {
+                "status": "error",
+                "error": str(e),
+                "usage": usage_report(time.perf_counter() - start, exception=type(e).__name__)
+            }
+        check_quota_after(request.session_id, before, response)
+    response["imports"] = snippet.imports
+    response["cold_imports"] = cold_imports(snippet.imports)
+    record_execution("code_execution", response, time.perf_counter() - start)
+    usage = response["usage"]
+    logger.info(f"Execution finished with status {response['status']} in {usage['wall_seconds']}s, "
+                f"cpu {usage['cpu_user_seconds']}s user / {usage['cpu_system_seconds']}s system, "
+                f"peak RSS {usage['peak_rss_mb']} MB, {usage['output_bytes']} output bytes")
+    return response
+
+def batch_messages(request: BatchRequest) -> Iterator[Dict[str, Any]]:
+    """Setup result, then each item as it completes, then a summary.
+
+    Items the pre-check rejects are reported right after the setup and are
+    not sent to the zygote.
+    """
+    parallel = min(request.parallel or BATCH_PARALLEL, BATCH_PARALLEL)
+    start = time.perf_counter()
+    finished = {}
+    cpu_seconds = 0.0
+    reason = "Batch was terminated before this item finished"
+    exception = "Killed"
+    before = existing_files(request.session_id) if request.session_id else None
+
+    items, rejected = [], []
+    for index, code in enumerate(request.snippets):
+        try:
+            items.append([index, compile_cache.get(code).bytecode])
+        except SnippetRejected as e:
+            message = dict(rejected_response(e, 0.0), index=index, wall_seconds=0.0, cpu_seconds=0.0)
+            finished[index] = "error"
+            record_execution("code_execution_batch", message, 0.0)
+            rejected.append(message)
+    try:
+        setup = compile_cache.get(request.setup).bytecode if request.setup else None
+    except SnippetRejected as e:
+        yield {"setup": rejected_response(e, 0.0)}
+        reason = "Setup code failed"
+        exception = None
+        items = []
+
+    if items:
+        job = {
+            "kind": "batch",
+            "setup": setup,
+            "snippets": items,
+            "timeout": request.timeout,
+            "parallel": parallel,
+            **session_job(request.session_id)
         }
+        # Setup plus every wave of items, with slack for forking
+        budget = request.timeout * (1 + math.ceil(len(items) / parallel)) + 5
+        try:
+            for message in zygote.stream(job, budget):
+                if "index" in message:
+                    finished[message["index"]] = message["status"]
+                    cpu_seconds += message["cpu_seconds"]
+                    record_execution("code_execution_batch", message, message["wall_seconds"])
+                elif "setup" in message and message["setup"]["status"] != "success":
+                    reason = "Setup code failed"
+                    exception = None
+                if "pid" not in message:
+                    yield message
+                if "setup" in message:
+                    yield from rejected
+                    rejected = []
+        except TimeoutError as e:
+            reason = str(e)
+            exception = "TimeoutError"
+    yield from rejected
+    for index in range(len(request.snippets)):
+        if index not in finished:
+            finished[index] = "error"
+            message = {"index": index, "status": "error", "error": reason, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                       "usage": usage_report(0.0, exception=exception)}
+            if exception:
+                # Items skipped after a failed setup never ran, so only killed items are counted
+                record_execution("code_execution_batch", message, 0.0)
+            yield message
+    summary = {
+        "items": len(request.snippets),
+        "succeeded": sum(status == "success" for status in finished.values()),
+        "parallel": parallel,
+        "wall_seconds": round(time.perf_counter() - start, 3),
+        "cpu_seconds": round(cpu_seconds, 3)
+    }
+    if request.session_id:
+        # Items run concurrently, so the session's total is only checked once all have finished
+        error = enforce_quota(request.session_id, before)
+        if error:
+            logger.warning(error)
+            summary["error"] = error
+    yield {"summary": summary}
+
+@app.post("/execute/batch", response_model=Dict[str, Any])
+async def execute_batch(request: BatchRequest):
+    """
+    Run many independent snippets in parallel after shared setup code.
+
+    The setup code runs once; each snippet then runs in its own child forked
+    from that state, so it sees the setup variables but not other snippets'
+    changes. Up to `parallel` items run at once, each with its own `timeout`.
+    With `stream`, results are sent as NDJSON lines in completion order;
+    otherwise they are returned together, ordered by index. Each item
+    reports its wall and CPU time.
+    """
+    if zygote is None:
+        raise HTTPException(status_code=503, detail="Batch execution needs the zygote (USE_ZYGOTE=true)")
+    os.makedirs(WORKSPACE_DIR, exist_ok=True)
+    logger.info(f"Executing batch of {len(request.snippets)} snippets")
+    if request.stream:
+        return StreamingResponse(
+            (json.dumps(message) + "\n" for message in batch_messages(request)),
+            media_type="application/x-ndjson"
+        )
+
+    messages = await asyncio.to_thread(list, batch_messages(request))
+    results = sorted((m for m in messages if "index" in m), key=lambda m: m["index"])
+    summary = messages[-1]["summary"]
+    return {
+        "status": "success" if summary["succeeded"] == summary["items"] and "error" not in summary else "error",
+        "setup": next((m["setup"] for m in messages if "setup" in m), None),
+        "results": results,
+        **summary
+    }
 
 @app.post("/pip/install", response_model=CodeResponse)
 async def pip_install(request: PipRequest):
+    """Install a package, preferring the local wheelhouse over the package index.
+
+    Repeat installs resolve offline from cached wheels. Installs for the same
+    package are serialized and pip never runs two installs at once, so
+    concurrent requests cannot corrupt site-packages. New packages are
+    importable by later executions without a restart.
+    """
     try:
         # Validate package name
         validate_package_name(request.package)
-        
-        # Construct pip command
-        pip_cmd = ['pip', 'install', '--no-cache-dir']
+        if request.version != "latest" and not VERSION_PATTERN.match(request.version):
+            raise HTTPException(status_code=400, detail="Invalid version format")
+
+        requirement = request.package
         if request.version != "latest":
-            pip_cmd.append(f"{request.package}=={request.version}")
-        else:
-            pip_cmd.append(request.package)
-
-        # Run pip install
-        process = subprocess.run(
-            pip_cmd,
-            capture_output=True,
-            text=True,
-            timeout=60  # 1 minute timeout for pip
-        )
+            requirement = f"{request.package}=={request.version}"
+
+        start = time.perf_counter()
+        async with keyed_lock(package_locks, canonical_package_name(request.package)):
+            current = installed_version(request.package)
+            if current and request.version in ("latest", current):
+                return CodeResponse(
+                    success=True,
+                    output=f"{request.package} {current} is already installed",
+                    installed_version=current,
+                    installation_time=round(time.perf_counter() - start, 3),
+                    source="installed"
+                )
+
+            source = "wheelhouse"
+            returncode, stdout, stderr = await install_from_wheelhouse(requirement)
+            if returncode != 0:
+                # Not cached yet: fetch wheels for the package and its dependencies, then install offline
+                source = "index"
+                WHEELHOUSE_DIR.mkdir(parents=True, exist_ok=True)
+                logger.info(f"Adding {requirement} to the wheelhouse")
+                returncode, stdout, stderr = await run_pip(
+                    ['wheel', '--wheel-dir', str(WHEELHOUSE_DIR), *wheelhouse_links(), requirement]
+                )
+                if returncode == 0:
+                    returncode, stdout, stderr = await install_from_wheelhouse(requirement)
 
+        # Let running workers find modules that appeared on sys.path
+        importlib.invalidate_caches()
+        version = installed_version(request.package) or ""
+        if returncode == 0:
+            logger.info(f"Installed {request.package} {version} from {source}")
+            if zygote is not None:
+                # Children inherit the zygote's preloaded modules, so reload it to pick up the new version
+                await asyncio.to_thread(zygote.restart)
+            elif current and current != version:
+                stdout += (f"\nNote: {request.package} {current} was replaced; modules already imported "
+                           f"by earlier executions keep the old version until restart")
         return CodeResponse(
-            success=process.returncode == 0,
-            output=process.stdout,
-            error=process.stderr
+            success=returncode == 0,
+            output=stdout,
+            error=stderr,
+            installed_version=version,
+            installation_time=round(time.perf_counter() - start, 3),
+            source=source
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/pip/wheelhouse")
+async def list_wheelhouse():
+    """List cached wheels available for offline installs"""
+    wheels = {}
+    for label, directory in (("seeded", WHEELHOUSE_SEED_DIR), ("cached", WHEELHOUSE_DIR)):
+        wheels[label] = sorted(p.name for p in directory.glob("*.whl")) if directory.is_dir() else []
+    return wheels
+
+@app.get("/execute/compile-cache")
+async def compile_cache_status():
+    """Report compiled-snippet cache usage and the modules the zygote has preloaded"""
+    return {
+        **compile_cache.status(),
+        "preloaded": zygote.info.get("preloaded", []) if zygote is not None else []
+    }
+
+@app.put("/workspace/{session_id}/files/{file_path:path}")
+async def upload_workspace_file(session_id: str, file_path: str, request: Request):
+    """Upload a file into a workspace session, streamed to disk as the body arrives.
+
+    Without a Content-Range header, the body is written to a temporary file
+    and renamed into place once complete. With "Content-Range: bytes
+    start-end/total" it is written at `start`, which must not be past the
+    file's current size, so an interrupted upload can resume where it
+    stopped. The session's quota counts every file in it, including those
+    executions wrote; an upload that would exceed it fails with 413. Uploads
+    to one session are serialized so their quota checks see each other's files.
+    """
+    path = find_workspace_file(session_id, file_path)
+    if path.is_dir():
+        raise HTTPException(status_code=409, detail=f"{file_path} is a directory")
+    prune_sessions()
+    base = touch_session(session_id)
+
+    # One upload per session at a time, so concurrent uploads cannot each pass the quota check
+    async with keyed_lock(upload_locks, session_id):
+        existing = path.stat().st_size if path.exists() else 0
+        quota = SESSION_QUOTA_MB * 2**20
+        used = session_usage(session_id) - existing
+        start, end, total = 0, None, None
+        content_range = request.headers.get("content-range")
+        if content_range:
+            parsed = parse_content_range(content_range)
+            if parsed is None:
+                raise HTTPException(status_code=400, detail="Invalid Content-Range, expected 'bytes start-end/total'")
+            start, end, total = parsed
+            if start > existing:
+                raise HTTPException(status_code=416, detail=f"Upload must resume at or before byte {existing}")
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and used + start + int(content_length) > quota:
+            raise HTTPException(status_code=413, detail=f"Upload would exceed the session quota of {SESSION_QUOTA_MB} MB")
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        target = path if content_range else base / f"{UPLOAD_PREFIX}{uuid.uuid4().hex}"
+        written = 0
+        try:
+            with open(target, "r+b" if content_range and path.exists() else "wb") as f:
+                f.seek(start)
+                async for chunk in request.stream():
+                    written += len(chunk)
+                    if used + start + written > quota:
+                        raise HTTPException(status_code=413, detail=f"Upload exceeds the session quota of {SESSION_QUOTA_MB} MB")
+                    await asyncio.to_thread(f.write, chunk)
+                if end is not None and written != end - start + 1:
+                    raise HTTPException(status_code=400, detail=f"Content-Range covers {end - start + 1} bytes, body had {written}")
+                f.truncate(start + written)
+            if not content_range:
+                os.replace(target, path)
+        finally:
+            if not content_range and target.exists():
+                target.unlink()
+
+        size = path.stat().st_size
+        logger.info(f"Uploaded {written} bytes to session {session_id}: {file_path}")
+    return {
+        "session_id": session_id,
+        "path": path.relative_to(base.resolve()).as_posix(),
+        "bytes": size,
+        "complete": size == total if content_range else True
+    }
+
+@app.get("/workspace/{session_id}/files/{file_path:path}")
+async def download_workspace_file(session_id: str, file_path: str):
+    """Download a workspace file; streamed from disk, supports Range requests"""
+    path = find_workspace_file(session_id, file_path)
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail=f"{file_path} not found in session {session_id}")
+    touch_session(session_id)
+    return FileResponse(path, filename=path.name)
+
+@app.get("/workspace/{session_id}/files")
+async def list_workspace_files(session_id: str):
+    """List a session's files and its quota usage"""
+    check_session_id(session_id)
+    files = list_files(session_id) if session_path(session_id).is_dir() else []
+    return {
+        "session_id": session_id,
+        "files": files,
+        "bytes_used": session_usage(session_id),
+        "quota_bytes": SESSION_QUOTA_MB * 2**20
+    }
+
+@app.delete("/workspace/{session_id}/files/{file_path:path}")
+async def delete_workspace_file(session_id: str, file_path: str):
+    """Delete a file from a workspace session"""
+    path = find_workspace_file(session_id, file_path)
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail=f"{file_path} not found in session {session_id}")
+    path.unlink()
+    return {"status": "deleted", "session_id": session_id, "path": file_path}
+
+@app.delete("/workspace/{session_id}")
+async def delete_workspace_session(session_id: str):
+    """Delete a workspace session and all of its files"""
+    check_session_id(session_id)
+    if not delete_session(session_id):
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    return {"status": "deleted", "session_id": session_id}
+
+@app.get("/exports/{handle}")
+async def download_export(handle: str):
+    """Download an exported result; streamed from disk, supports Range requests"""
+    path = find_export(handle)
+    return FileResponse(path, media_type=EXPORT_MEDIA_TYPES[path.suffix], filename=path.name)
+
+@app.delete("/exports/{handle}")
+async def delete_export(handle: str):
+    """Delete an exported result before it expires"""
+    find_export(handle).unlink()
+    return {"status": "deleted", "handle": handle}
+
+@app.on_event("startup")
+async def start_zygote():
+    # Preloading takes a while; do it now rather than on the first /execute
+    if zygote is not None:
+        await asyncio.to_thread(zygote.start)
+
+@app.on_event("shutdown")
+async def stop_zygote():
+    if zygote is not None:
+        zygote.stop()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -0,0 +1,128 @@
+"""Static pre-check and compile cache for submitted code.
+
+Snippets are parsed and compiled once in the API process, before any child
+is forked. Syntax errors and disallowed imports are rejected there. Children
+receive the compiled code as marshal bytes instead of recompiling the source.
+The pre-check is a fast fail, not a security boundary: code can still reach
+any module through getattr or exec. The rlimits and the container are what
+contain it.
+"""
+import ast
+import hashlib
+import marshal
+import os
+import threading
+from collections import OrderedDict
+from types import CodeType
+from typing import List, NamedTuple
+
+# Compiled snippets kept, keyed by a hash of their source
+COMPILE_CACHE_SIZE = int(os.environ.get("COMPILE_CACHE_SIZE", "1024"))
+# Top-level modules snippets may not import
+DISALLOWED_IMPORTS = {m.strip() for m in os.environ.get("DISALLOWED_IMPORTS", "ctypes").split(",") if m.strip()}
+
+class SnippetRejected(Exception):
+    """The pre-check refused a snippet; exception is the name reported in its usage"""
+
+    def __init__(self, message: str, exception: str):
+        super().__init__(message)
+        self.exception = exception
+
+class CompiledSnippet(NamedTuple):
+    code: CodeType
+    bytecode: bytes  # marshal.dumps(code), sent to the child
+    imports: List[str]  # Top-level modules, sorted
+
+def dynamic_import_name(node: ast.Call):
+    """Module name of __import__("x") or importlib.import_module("x") with a constant argument"""
+    func = node.func
+    if not (isinstance(func, ast.Name) and func.id == "__import__"
+            or isinstance(func, ast.Attribute) and func.attr == "import_module"):
+        return None
+    if node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str):
+        return node.args[0].value
+    return None
+
+def imported_modules(tree: ast.AST) -> List[str]:
+    """Top-level modules a snippet imports, including constant-argument dynamic imports"""
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            modules.add(node.module.split(".")[0])
+        elif isinstance(node, ast.Call):
+            name = dynamic_import_name(node)
+            if name:
+                modules.add(name.split(".")[0])
+    return sorted(modules)
+
+def syntax_message(error: SyntaxError) -> str:
+    return f"{error.msg} (line {error.lineno})" if error.lineno else error.msg
+
+def precheck(source: str) -> CompiledSnippet:
+    """Parse, check and compile a snippet; raises SnippetRejected.
+
+    Building the Python AST costs more than compiling, so source that never
+    mentions "import" (which also covers __import__ and import_module) is
+    compiled directly.
+    """
+    try:
+        if "import" not in source:
+            code = compile(source, "<string>", "exec")
+            return CompiledSnippet(code, marshal.dumps(code), [])
+        tree = ast.parse(source, "<string>", "exec")
+        imports = imported_modules(tree)
+        disallowed = [name for name in imports if name in DISALLOWED_IMPORTS]
+        if disallowed:
+            raise SnippetRejected(f"Importing {', '.join(disallowed)} is not allowed in the sandbox", "ImportError")
+        # Also raises the errors only the compiler detects, e.g. 'return' outside function
+        code = compile(tree, "<string>", "exec")
+    except SyntaxError as e:
+        raise SnippetRejected(syntax_message(e), "SyntaxError")
+    except ValueError as e:  # Null bytes in the source, before Python 3.12
+        raise SnippetRejected(str(e), "SyntaxError")
+    return CompiledSnippet(code, marshal.dumps(code), imports)
+
+class CompileCache:
+    """Bounded LRU of compiled snippets keyed by a hash of their source"""
+
+    def __init__(self, max_entries: int = COMPILE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(source: str) -> str:
+        return hashlib.sha256(source.encode("utf-8", "surrogatepass")).hexdigest()
+
+    def get(self, source: str) -> CompiledSnippet:
+        """Compiled snippet for source, from the cache when possible; raises SnippetRejected"""
+        key = self.key(source)
+        with self.lock:
+            snippet = self.entries.get(key)
+            if snippet is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return snippet
+            self.misses += 1
+        # Rejections are not cached; they are cheap to find again and rarely resubmitted
+        snippet = precheck(source)
+        with self.lock:
+            self.entries[key] = snippet
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return snippet
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes": sum(len(s.bytecode) for s in self.entries.values())
+            }
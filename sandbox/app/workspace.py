@@ -0,0 +1,129 @@
+"""Per-session workspace directories for files moved in and out of the sandbox.
+
+Each session is a directory under SESSIONS_DIR. Executions given the
+session's id run with it as their working directory, so code can open or
+mmap uploaded files by relative path instead of receiving data in the
+request body.
+"""
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from executor import SESSIONS_DIR
+
+# Bytes a session may hold, counting files written by executions as well as uploads
+SESSION_QUOTA_MB = int(os.environ.get("SESSION_QUOTA_MB", "1024"))
+# Sessions untouched (no upload or execution) for this long are deleted
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", "86400"))
+
+SESSION_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+# Uploads are written under this prefix and renamed into place once complete
+UPLOAD_PREFIX = ".upload-"
+CONTENT_RANGE_PATTERN = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+def session_path(session_id: str) -> Path:
+    """Directory of a session (validated by the caller against SESSION_ID_PATTERN)"""
+    return SESSIONS_DIR / session_id
+
+def touch_session(session_id: str) -> Path:
+    """Create the session directory if needed and mark it as in use"""
+    path = session_path(session_id)
+    path.mkdir(parents=True, exist_ok=True)
+    os.utime(path)
+    return path
+
+def resolve_file(session_id: str, file_path: str) -> Optional[Path]:
+    """Path of a file inside the session, or None if file_path would leave it.
+
+    Symlinks are resolved first, so a link an execution created cannot expose
+    files outside the session.
+    """
+    base = session_path(session_id).resolve()
+    path = (base / file_path).resolve()
+    if path == base or not path.is_relative_to(base):
+        return None
+    if any(part.startswith(UPLOAD_PREFIX) for part in path.relative_to(base).parts):
+        return None
+    return path
+
+def walk_files(session_id: str):
+    """Yield (relative path, stat) for every regular file in the session"""
+    base = session_path(session_id)
+    for root, _, names in os.walk(base):
+        for name in names:
+            path = Path(root) / name
+            try:
+                stat = path.lstat()
+            except FileNotFoundError:
+                continue
+            yield path.relative_to(base), stat
+
+def session_usage(session_id: str) -> int:
+    """Bytes used by the session, including unfinished uploads"""
+    return sum(stat.st_size for _, stat in walk_files(session_id))
+
+def existing_files(session_id: str) -> Set[str]:
+    """Files in the session now, to tell later which ones an execution created"""
+    return {relative.as_posix() for relative, _ in walk_files(session_id)}
+
+def enforce_quota(session_id: str, before: Set[str]) -> Optional[str]:
+    """After an execution, remove the files it created if the session is over quota.
+
+    Returns None when the session is within quota, otherwise the error to
+    report. Files that existed before the execution are kept even if it grew
+    them, so uploads are never lost; the session then stays over quota and
+    further uploads fail until files are deleted.
+    """
+    quota = SESSION_QUOTA_MB * 2**20
+    used = session_usage(session_id)
+    if used <= quota:
+        return None
+    removed = 0
+    base = session_path(session_id)
+    for relative, _ in list(walk_files(session_id)):
+        if relative.as_posix() not in before and not relative.name.startswith(UPLOAD_PREFIX):
+            (base / relative).unlink(missing_ok=True)
+            removed += 1
+    return (f"Session {session_id} exceeded its quota of {SESSION_QUOTA_MB} MB ({used} bytes); "
+            f"removed {removed} files the execution created, {session_usage(session_id)} bytes now used")
+
+def list_files(session_id: str) -> List[Dict[str, Any]]:
+    files = []
+    for relative, stat in walk_files(session_id):
+        if relative.name.startswith(UPLOAD_PREFIX):
+            continue
+        files.append({"path": relative.as_posix(), "bytes": stat.st_size, "modified": stat.st_mtime})
+    return sorted(files, key=lambda f: f["path"])
+
+def parse_content_range(header: str) -> Optional[Tuple[int, int, Optional[int]]]:
+    """(start, end, total) of a "bytes start-end/total" header; total is None for "*" """
+    match = CONTENT_RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    start, end = int(match.group(1)), int(match.group(2))
+    total = None if match.group(3) == "*" else int(match.group(3))
+    if end < start or (total is not None and end >= total):
+        return None
+    return start, end, total
+
+def prune_sessions() -> None:
+    """Delete sessions untouched for SESSION_TTL_SECONDS"""
+    if not SESSIONS_DIR.exists():
+        return
+    cutoff = time.time() - SESSION_TTL_SECONDS
+    for path in SESSIONS_DIR.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                shutil.rmtree(path)
+        except FileNotFoundError:
+            pass
+
+def delete_session(session_id: str) -> bool:
+    path = session_path(session_id)
+    if not path.exists():
+        return False
+    shutil.rmtree(path)
+    return True
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Measure the compile time the snippet cache saves on a corpus of submissions.
+
+Replays a corpus in order through three paths:
+- compiling every submission from source, as exec(str) did in each child
+- the pre-check without a cache (parse, import scan, compile, marshal)
+- the compile cache: hash and lookup, the pre-check on a miss, plus the
+  child's marshal.loads
+
+--corpus takes a JSONL file of recorded /execute request bodies ({"code": ...}).
+Without it, a built-in set of helper snippets is resubmitted with a Zipf-like
+skew, as agents do.
+"""
+
+import argparse
+import json
+import marshal
+import os
+import random
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "app"))
+
+HELPERS = [
+    "import numpy as np\ndata = np.random.default_rng(0).random(1000)\nmean = float(data.mean())",
+    "import json\nresult = json.dumps({'a': 1, 'b': [1, 2, 3]})",
+    "def fib(n):\n    a, b = 0, 1\n    for _ in range(n):\n        a, b = b, a + b\n    return a\nvalue = fib(50)",
+    "import math\nroots = [math.sqrt(i) for i in range(100)]",
+    "import statistics\nvalues = [3, 1, 4, 1, 5, 9, 2, 6]\nsummary = (statistics.mean(values), statistics.median(values))",
+    "import re\nwords = re.findall(r'\\w+', 'the quick brown fox jumps over the lazy dog')\ncounts = {w: words.count(w) for w in words}",
+]
+
+def make_corpus(count: int, seed: int = 0) -> list:
+    """Helper snippets, longer generated ones and one-offs, resubmitted with a skew towards a few favourites"""
+    rng = random.Random(seed)
+    snippets = list(HELPERS)
+    for i in range(40):
+        body = "\n".join(f"        total += row[{j % 5}] * {rng.random():.6f}" for j in range(rng.randint(5, 60)))
+        snippets.append(f"def score_{i}(rows):\n    total = 0.0\n    for row in rows:\n{body}\n    return total\n"
+                        f"result = score_{i}([[1, 2, 3, 4, 5]] * 10)")
+    weights = [1 / (rank + 1) for rank in range(len(snippets))]
+    corpus = rng.choices(snippets, weights, k=count)
+    # A share of one-off snippets that can never hit the cache
+    for i in range(0, count, 10):
+        corpus[i] = f"x_{i} = {i} * 2\ny_{i} = [x_{i}] * 3"
+    return corpus
+
+def load_corpus(path: str) -> list:
+    with open(path) as f:
+        return [json.loads(line)["code"] for line in f if line.strip()]
+
+def timed(fn, corpus: list) -> list:
+    times = []
+    for source in corpus:
+        start = time.perf_counter()
+        fn(source)
+        times.append(time.perf_counter() - start)
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the sandbox compile cache')
+    parser.add_argument('--corpus', default=None, help='JSONL file of recorded /execute request bodies')
+    parser.add_argument('--count', type=int, default=10000, help='Submissions in the built-in corpus')
+    parser.add_argument('--cache-size', type=int, default=1024, help='Compile cache entries')
+
+    args = parser.parse_args()
+    from snippets import CompileCache, SnippetRejected, precheck
+
+    corpus = load_corpus(args.corpus) if args.corpus else make_corpus(args.count)
+    cache = CompileCache(args.cache_size)
+
+    def compile_source(source):
+        try:
+            compile(source, "<string>", "exec")
+        except SyntaxError:
+            pass
+
+    def precheck_only(source):
+        try:
+            precheck(source)
+        except SnippetRejected:
+            pass
+
+    def cached(source):
+        try:
+            marshal.loads(cache.get(source).bytecode)
+        except SnippetRejected:
+            pass
+
+    results = [
+        ("compile from source", timed(compile_source, corpus)),
+        ("pre-check, no cache", timed(precheck_only, corpus)),
+        ("compile cache", timed(cached, corpus)),
+    ]
+    baseline = sum(results[0][1])
+    status = cache.status()
+
+    print(f"{len(corpus)} submissions, {len(set(corpus))} distinct, "
+          f"cache hit rate {status['hits'] / max(1, status['hits'] + status['misses']):.0%}")
+    print("| path | total (ms) | p50 (us) | p99 (us) | vs compile from source |")
+    print("|---|---|---|---|---|")
+    for name, times in results:
+        times_us = sorted(t * 1e6 for t in times)
+        total = sum(times)
+        print(f"| {name} | {total * 1000:.1f} | {statistics.median(times_us):.1f} | "
+              f"{times_us[int(len(times_us) * 0.99)]:.1f} | {baseline / total:.1f}x |")
+
+if __name__ == "__main__":
+    main()
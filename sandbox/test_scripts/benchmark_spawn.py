@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Spawn latency of sandbox executions: zygote fork vs a fresh interpreter.
+
+Times a trivial snippet run three ways and prints p50/p99 in milliseconds:
+a child forked from the zygote (scientific stack already imported), a new
+interpreter that has to import the same modules, and plain exec in this
+process as a floor. Pass --url to also time POST /execute end to end.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "app"))
+
+SNIPPET = "import numpy as np\nresult = float(np.arange(10).sum())"
+
+def percentiles(timings: list) -> tuple:
+    ordered = sorted(timings)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return statistics.median(ordered) * 1000, p99 * 1000
+
+def measure(fn, runs: int) -> tuple:
+    fn()  # warm up
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return percentiles(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sandbox spawn latency')
+    parser.add_argument('--runs', type=int, default=200, help='Timed runs per path')
+    parser.add_argument('--url', default=None, help='Also benchmark POST {url}/execute')
+
+    args = parser.parse_args()
+    import executor
+
+    zygote = executor.Zygote()
+    zygote.start()
+    preload = ", ".join(executor.ZYGOTE_PRELOAD)
+    fresh = [sys.executable, "-c", "".join(f"import {m}\n" for m in executor.ZYGOTE_PRELOAD) + SNIPPET]
+
+    results = [
+        ("zygote fork", measure(lambda: zygote.run({"code": SNIPPET, "timeout": 30}, 30), args.runs)),
+        (f"fresh interpreter importing {preload}", measure(lambda: subprocess.run(fresh, check=True), max(10, args.runs // 10))),
+        ("exec in process (no isolation)", measure(lambda: executor.execute_request(SNIPPET), args.runs)),
+    ]
+    zygote.stop()
+    if args.url:
+        import requests
+        results.append(("POST /execute", measure(
+            lambda: requests.post(f"{args.url}/execute", json={"code": SNIPPET}).raise_for_status(), args.runs)))
+
+    print(f"Zygote ready in {zygote.info['startup_seconds']}s\n")
+    print("| path | p50 (ms) | p99 (ms) |")
+    print("|---|---|---|")
+    for name, (p50, p99) in results:
+        print(f"| {name} | {p50:.1f} | {p99:.1f} |")
+
+if __name__ == "__main__":
+    main()
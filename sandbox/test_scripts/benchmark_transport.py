@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Compare str() results with binary exports for large sandbox payloads.
+
+For each payload size, times /execute returning a float64 array as a string
+(both the summarised str(ndarray) and the full str(list)), then as npy and
+Arrow exports downloaded by handle and read back. Arrow files are read
+zero-copy through a memory map and npy files with mmap_mode="r".
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pyarrow as pa
+import requests
+
+def execute(url: str, code: str, export: dict = None) -> tuple:
+    start = time.perf_counter()
+    response = requests.post(f"{url}/execute", json={"code": code, "export": export})
+    response.raise_for_status()
+    body = response.json()
+    if body["status"] != "success":
+        raise RuntimeError(body["error"])
+    return body, len(response.content), time.perf_counter() - start
+
+def download(url: str, handle: str, path: str) -> int:
+    with requests.get(f"{url}/exports/{handle}", stream=True) as response:
+        response.raise_for_status()
+        with open(path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                f.write(chunk)
+    requests.delete(f"{url}/exports/{handle}")
+    return os.path.getsize(path)
+
+def bench_str(url: str, n: int, as_list: bool) -> dict:
+    code = "import numpy as np\ndata = np.random.default_rng(0).random(%d)" % n
+    if as_list:
+        code += "\ndata = data.tolist()"
+    body, size, seconds = execute(url, code)
+    start = time.perf_counter()
+    if as_list:
+        values = np.array(json.loads(body["result"]["data"]))
+    else:
+        values = None  # str(ndarray) keeps only the first and last few values
+    parse = time.perf_counter() - start
+    return {"bytes": size, "seconds": seconds + parse, "lossless": values is not None and len(values) == n}
+
+def bench_export(url: str, n: int, export_format: str, workdir: str) -> dict:
+    code = "import numpy as np\ndata = np.random.default_rng(0).random(%d)" % n
+    start = time.perf_counter()
+    body, _, _ = execute(url, code, {"data": export_format})
+    info = body["exports"]["data"]
+    path = os.path.join(workdir, f"{info['handle']}.{export_format}")
+    size = download(url, info["handle"], path)
+    if export_format == "npy":
+        values = np.load(path, mmap_mode="r")
+        float(values[-1])  # touch the data
+    else:
+        with pa.memory_map(path) as source:
+            values = pa.ipc.open_file(source).read_all().column("value").to_numpy()
+            float(values[-1])
+    seconds = time.perf_counter() - start
+    os.remove(path)
+    return {"bytes": size, "seconds": seconds, "lossless": len(values) == n}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark str() results vs binary exports')
+    parser.add_argument('--url', default="http://localhost:8001", help='Sandbox base URL')
+    parser.add_argument('--sizes-mb', type=int, nargs='+', default=[10, 100, 1000], help='Payload sizes in MB of float64 data')
+    parser.add_argument('--max-str-mb', type=int, default=100, help='Skip the str(list) path above this size')
+
+    args = parser.parse_args()
+
+    print("| payload | transport | response bytes | seconds | lossless |")
+    print("|---|---|---|---|---|")
+    with tempfile.TemporaryDirectory() as workdir:
+        for size_mb in args.sizes_mb:
+            n = size_mb * 2**20 // 8
+            runs = [("str(ndarray)", lambda: bench_str(args.url, n, False))]
+            if size_mb <= args.max_str_mb:
+                runs.append(("str(list)", lambda: bench_str(args.url, n, True)))
+            runs.append(("npy export", lambda: bench_export(args.url, n, "npy", workdir)))
+            runs.append(("arrow export", lambda: bench_export(args.url, n, "arrow", workdir)))
+            for name, run in runs:
+                try:
+                    result = run()
+                except Exception as e:
+                    print(f"| {size_mb} MB | {name} | failed: {e} | | |")
+                    continue
+                print(f"| {size_mb} MB | {name} | {result['bytes']} | {result['seconds']:.2f} | "
+                      f"{'yes' if result['lossless'] else 'no'} |")
+
+if __name__ == "__main__":
+    main()